@@ -0,0 +1,423 @@
+"""
+This file contains pure python versions of the analyzers defined in resources/index-schema.json
+"""
+import re
+import unicodedata
+
+WORD_PATTERN = re.compile(r"\w+(?:['’]\w+)*")
+URL_EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+|https?://\S+|\w+(?:['’]\w+)*")
+LETTER_PATTERN = re.compile(r"[^\W\d_]+")
+
+# the java character classes used by the pattern analyzers of the schema, and their python counterpart
+JAVA_CHARACTER_CLASSES = [
+    (r"[\p{L}&&[^\p{Lu}]]", "[a-zß-öø-ÿ]"),
+    (r"[^\p{L}\d]", r"[\W_]"),
+    (r"\p{Lu}", "[A-ZÀ-ÖØ-Þ]"),
+    (r"\p{L}", r"[^\W\d_]"),
+]
+
+VOWELS = "AEIOU"
+FRONT_VOWELS = "EIY"
+STOP_WORDS = {"a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+              "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+              "they", "this", "to", "was", "will", "with"}
+
+
+def standard_tokenizer(text):
+    """
+    This method splits a text on word boundaries, apostrophes inside a word are kept (O'halleran)
+    :param text:
+    :return: list of tokens
+    """
+    return WORD_PATTERN.findall(text)
+
+
+def keyword_tokenizer(text):
+    """
+    This method emits the whole text as a single token
+    :param text:
+    :return: list of tokens
+    """
+    return [text] if text else []
+
+
+def letter_tokenizer(text):
+    """
+    This method splits a text on anything that is not a letter
+    :param text:
+    :return: list of tokens
+    """
+    return LETTER_PATTERN.findall(text)
+
+
+def url_email_tokenizer(text):
+    """
+    This method works as the standard tokenizer but keeps urls and emails as single tokens
+    :param text:
+    :return: list of tokens
+    """
+    return URL_EMAIL_PATTERN.findall(text)
+
+
+def lowercase(tokens):
+    """
+    :param tokens:
+    :return: the lower cased tokens
+    """
+    return [token.lower() for token in tokens]
+
+
+def ascii_folding(tokens):
+    """
+    This method removes the accents of the tokens (e.g. é -> e)
+    :param tokens:
+    :return: the folded tokens
+    """
+    return [unicodedata.normalize("NFKD", token).encode("ascii", "ignore").decode("ascii") or token
+            for token in tokens]
+
+
+def minimal_english_stem(token):
+    """
+    This method removes the plural of an english word, as lucene EnglishMinimalStemmer does
+    :param token:
+    :return: the stemmed token
+    """
+    if len(token) < 3 or token[-1] != "s":
+        return token
+    if token.endswith("ies") and len(token) > 3 and token[-4] not in "ae":
+        return token[:-3] + "y"
+    if token.endswith("es") and token[-3] not in "aeo":
+        return token[:-1]
+    if token[-2] not in "us":
+        return token[:-1]
+    return token
+
+
+def metaphone(word, max_length=4):
+    """
+    This method encodes a word with the original metaphone algorithm, which is the default encoder
+    of the phonetic token filter
+    :param word:
+    :param max_length: maximum length of the code
+    :return: the phonetic code of the word
+    """
+    word = "".join(char for char in word.upper() if "A" <= char <= "Z")
+    if not word:
+        return ""
+    if word[:2] in ("AE", "GN", "KN", "PN", "WR"):
+        word = word[1:]
+    elif word[0] == "X":
+        word = "S" + word[1:]
+    elif word[:2] == "WH":
+        word = "W" + word[2:]
+    code = []
+    length = len(word)
+    i = 0
+    while i < length and len(code) < max_length:
+        char = word[i]
+        previous = word[i - 1] if i > 0 else ""
+        following = word[i + 1] if i + 1 < length else ""
+        after_next = word[i + 2] if i + 2 < length else ""
+        if char == previous and char != "C":
+            i += 1
+            continue
+        if char in VOWELS:
+            if i == 0:
+                code.append(char)
+        elif char == "B":
+            if not (previous == "M" and i == length - 1):
+                code.append("B")
+        elif char == "C":
+            if following == "I" and after_next == "A":
+                code.append("X")
+            elif following == "H":
+                code.append("K" if previous == "S" else "X")
+                i += 1
+            elif following in FRONT_VOWELS and following:
+                if previous != "S":
+                    code.append("S")
+            else:
+                code.append("K")
+        elif char == "D":
+            if following == "G" and after_next in FRONT_VOWELS and after_next:
+                code.append("J")
+                i += 2
+            else:
+                code.append("T")
+        elif char == "G":
+            if following == "H" and i + 2 < length and after_next not in VOWELS:
+                pass
+            elif following == "N" and (i + 2 == length or word[i + 1:] == "NED"):
+                pass
+            elif following in FRONT_VOWELS and following and previous != "G":
+                code.append("J")
+            else:
+                code.append("K")
+        elif char == "H":
+            if not (previous and previous in "CSPTG") and following and following in VOWELS:
+                code.append("H")
+        elif char == "K":
+            if previous != "C":
+                code.append("K")
+        elif char == "P":
+            if following == "H":
+                code.append("F")
+                i += 1
+            else:
+                code.append("P")
+        elif char == "Q":
+            code.append("K")
+        elif char == "S":
+            if following == "H":
+                code.append("X")
+                i += 1
+            elif following == "I" and after_next in ("O", "A"):
+                code.append("X")
+            else:
+                code.append("S")
+        elif char == "T":
+            if following == "I" and after_next in ("O", "A"):
+                code.append("X")
+            elif following == "H":
+                code.append("0")
+                i += 1
+            elif not (following == "C" and after_next == "H"):
+                code.append("T")
+        elif char == "V":
+            code.append("F")
+        elif char in "WY":
+            if following in VOWELS and following:
+                code.append(char)
+        elif char == "X":
+            code.append("KS")
+        elif char == "Z":
+            code.append("S")
+        else:
+            code.append(char)
+        i += 1
+    return "".join(code)[:max_length]
+
+
+def phonetic(tokens):
+    """
+    This method replaces the tokens with their metaphone code
+    :param tokens:
+    :return: the phonetic codes
+    """
+    return [code for code in (metaphone(token) for token in tokens) if code]
+
+
+def soundex(word):
+    """
+    This method calculates the american soundex code of a word (a letter followed by three digits)
+    :param word:
+    :return: the soundex code, empty if the word has no letter
+    """
+    letters = [char for char in word.upper() if "A" <= char <= "Z"]
+    if not letters:
+        return ""
+    digits = {char: str(digit) for digit, group in enumerate(["AEIOUY", "BFPV", "CGJKQSXZ", "DT", "L", "MN", "R"])
+              for char in group}
+    code = [letters[0]]
+    previous = digits.get(letters[0], "")
+    for char in letters[1:]:
+        digit = digits.get(char, "")
+        if digit and digit != "0" and digit != previous:
+            code.append(digit)
+        # h and w do not separate letters with the same code, vowels do
+        if char not in "HW":
+            previous = digit
+    return ("".join(code) + "000")[:4]
+
+
+PHONETIC_ENCODERS = {
+    "metaphone": metaphone,
+    "soundex": soundex,
+}
+
+
+def create_phonetic_filter(encoder="metaphone", replace=True):
+    """
+    This method creates a phonetic token filter
+    :param encoder: name of the phonetic encoder (metaphone or soundex)
+    :param replace: if false, the original tokens are kept next to their codes
+    :return: a function from a list of tokens to a list of tokens
+    """
+    if encoder not in PHONETIC_ENCODERS:
+        raise ValueError("phonetic encoder {} is not supported".format(encoder))
+    encode = PHONETIC_ENCODERS[encoder]
+
+    def phonetic_filter(tokens):
+        codes = []
+        for token in tokens:
+            if not replace:
+                codes.append(token)
+            code = encode(token)
+            if code:
+                codes.append(code)
+        return codes
+
+    return phonetic_filter
+
+
+def n_grams(tokens, min_gram, max_gram):
+    """
+    This method replaces each token with its n-grams, tokens shorter than min_gram are dropped
+    :param tokens:
+    :param min_gram:
+    :param max_gram:
+    :return: the n-grams
+    """
+    grams = []
+    for token in tokens:
+        for start in range(0, len(token) - min_gram + 1):
+            for size in range(min_gram, min(max_gram, len(token) - start) + 1):
+                grams.append(token[start:start + size])
+    return grams
+
+
+def edge_n_grams(tokens, min_gram, max_gram):
+    """
+    This method replaces each token with its prefixes, tokens shorter than min_gram are dropped
+    :param tokens:
+    :param min_gram:
+    :param max_gram:
+    :return: the prefixes
+    """
+    return [token[:size] for token in tokens for size in range(min_gram, min(max_gram, len(token)) + 1)]
+
+
+def english_analyzer(text):
+    """
+    This method approximates the language analyzers of azure (en.microsoft, stemming tokenizer):
+    lower cased words without stop words, reduced to their singular form
+    :param text:
+    :return: list of tokens
+    """
+    return [minimal_english_stem(token) for token in lowercase(standard_tokenizer(text)) if token not in STOP_WORDS]
+
+
+def translate_java_pattern(pattern):
+    """
+    This method translates the java character classes used in the schema to python regular expressions
+    :param pattern: java regular expression
+    :return: python regular expression
+    """
+    for java_class, python_class in JAVA_CHARACTER_CLASSES:
+        pattern = pattern.replace(java_class, python_class)
+    return pattern
+
+
+def split_on_pattern(pattern, text):
+    """
+    This method splits a text on every match of a pattern, as the pattern analyzer does
+    :param pattern: compiled regular expression matching the separators
+    :param text:
+    :return: list of non empty tokens
+    """
+    tokens = []
+    position = 0
+    for match in pattern.finditer(text):
+        if match.start() > position:
+            tokens.append(text[position:match.start()])
+        position = max(position, match.end())
+    if position < len(text):
+        tokens.append(text[position:])
+    return tokens
+
+
+TOKENIZERS = {
+    "standard": standard_tokenizer,
+    "classic": standard_tokenizer,
+    "keyword": keyword_tokenizer,
+    "keyword_v2": keyword_tokenizer,
+    "letter": letter_tokenizer,
+    "uax_url_email": url_email_tokenizer,
+}
+
+TOKEN_FILTERS = {
+    "lowercase": lowercase,
+    "asciifolding": ascii_folding,
+    "phonetic": phonetic,
+}
+
+PREDEFINED_ANALYZERS = {
+    "standard.lucene": lambda text: lowercase(standard_tokenizer(text)),
+    "en.microsoft": english_analyzer,
+    "en.lucene": english_analyzer,
+    "keyword": lambda text: keyword_tokenizer(text),
+}
+
+
+def create_token_filter(definition):
+    """
+    This method creates a token filter from its definition in the schema
+    :param definition: dictionary with @odata.type and the parameters of the filter
+    :return: a function from a list of tokens to a list of tokens
+    """
+    filter_type = definition["@odata.type"]
+    if "EdgeNGram" in filter_type:
+        return lambda tokens: edge_n_grams(tokens, definition.get("minGram", 1), definition.get("maxGram", 2))
+    if "NGram" in filter_type:
+        return lambda tokens: n_grams(tokens, definition.get("minGram", 1), definition.get("maxGram", 2))
+    if "Phonetic" in filter_type:
+        return create_phonetic_filter(definition.get("encoder", "metaphone"), definition.get("replace", True))
+    raise ValueError("token filter {} is not supported".format(filter_type))
+
+
+def create_tokenizer(definition):
+    """
+    This method creates a tokenizer from its definition in the schema
+    :param definition: dictionary with @odata.type and the parameters of the tokenizer
+    :return: a function from a text to a list of tokens
+    """
+    if "Stemming" in definition["@odata.type"]:
+        return english_analyzer
+    return TOKENIZERS[definition["@odata.type"].split(".")[-1].lower().replace("tokenizer", "")]
+
+
+def create_analyzer(definition, tokenizers, token_filters):
+    """
+    This method creates an analyzer from its definition in the schema
+    :param definition: dictionary with @odata.type, the tokenizer and the token filters of the analyzer
+    :param tokenizers: custom tokenizers of the schema by name
+    :param token_filters: custom token filters of the schema by name
+    :return: a function from a text to a list of tokens
+    """
+    if "PatternAnalyzer" in definition["@odata.type"]:
+        pattern = re.compile(translate_java_pattern(definition.get("pattern", r"\W+")))
+        lower = definition.get("lowercase", True)
+        return lambda text: lowercase(split_on_pattern(pattern, text)) if lower else split_on_pattern(pattern, text)
+
+    tokenizer = tokenizers.get(definition["tokenizer"]) or TOKENIZERS[definition["tokenizer"]]
+    filters = [token_filters.get(name) or TOKEN_FILTERS[name] for name in definition.get("tokenFilters", [])]
+
+    def analyze(text):
+        tokens = tokenizer(text)
+        for token_filter in filters:
+            tokens = token_filter(tokens)
+        return tokens
+
+    return analyze
+
+
+def create_field_analyzers(schema):
+    """
+    This method creates the analyzer of every searchable field of an index schema
+    :param schema: the index schema (resources/index-schema.json)
+    :return: dictionary of field name -> analyzer function
+    """
+    tokenizers = {definition["name"]: create_tokenizer(definition) for definition in schema.get("tokenizers", [])}
+    token_filters = {definition["name"]: create_token_filter(definition)
+                     for definition in schema.get("tokenFilters", [])}
+    analyzers = dict(PREDEFINED_ANALYZERS)
+    for definition in schema.get("analyzers", []):
+        analyzers[definition["name"]] = create_analyzer(definition, tokenizers, token_filters)
+    field_analyzers = {}
+    for field in schema["fields"]:
+        if not field.get("searchable") or field.get("key"):
+            continue
+        analyzer_name = field.get("analyzer") or field.get("indexAnalyzer") or "standard.lucene"
+        field_analyzers[field["name"]] = analyzers[analyzer_name]
+    return field_analyzers
@@ -0,0 +1,272 @@
+"""
+This file contains methods to communicate with azure src from asyncio code
+"""
+import asyncio
+import json
+import logging
+import time
+from itertools import islice
+from types import SimpleNamespace
+
+import aiohttp
+
+from azuresearchclient import AzureSearchClient, RETRY_DOCUMENT_STATUS_CODES, RETRY_STATUS_CODES
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    This class limits the rate of requests: a request takes a token, tokens are refilled at rate per second
+    and up to capacity tokens can be saved, so short bursts are allowed
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximum number of saved tokens, rate by default
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        # created inside the running event loop, an asyncio.Lock created before asyncio.run is bound to another loop
+        # on python < 3.10
+        self.lock = None
+
+    async def acquire(self):
+        """
+        This method waits until a token is available and takes it
+        """
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncAzureSearchClient:
+    """
+    This class has the same create_index, insert_documents and make_search methods as AzureSearchClient,
+    as coroutines. Every request goes through a single aiohttp session, at most concurrency requests are
+    in flight at the same time and, if a rate is given, requests are started at most rate times per second.
+    The configuration, the documents, the retry policy and the cache are the ones of an AzureSearchClient, which never
+    opens its own connection pool. Use it as an async context manager, or call close, so that the connections
+    are released
+    """
+
+    def __init__(self, endpoint=None, cache=None, metrics=None, concurrency=None, rate=None):
+        """
+        :param endpoint: base url of the search service, built from resources/config.yml by default
+        :param cache: optional QueryCache, looked up before a query is sent to the service
+        :param metrics: optional QueryMetrics, if given the latency and payload sizes of every query are recorded
+        :param concurrency: maximum number of requests in flight, the pool size of the http config by default
+        :param rate: maximum number of requests started per second, the rate_limit of the http config by default
+        (no limit if it is not set)
+        """
+        self.client = AzureSearchClient(endpoint, cache, metrics)
+        self.utils = self.client.utils
+        self.endpoint = self.client.endpoint.rstrip("/") + "/"
+        self.api_version = self.client.api_version
+        self.concurrency = concurrency or self.client.pool_size
+        rate = rate or (self.client.config.get("http") or {}).get("rate_limit")
+        self.rate_limiter = TokenBucket(rate) if rate else None
+        self.semaphore = None
+        self.session = None
+        self.retries = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    def get_session(self):
+        """
+        This method creates the http session on first use, inside the running event loop.
+        Its connector keeps up to concurrency connections alive
+        :return: the aiohttp session
+        """
+        if self.session is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            self.session = aiohttp.ClientSession(
+                headers=self.client.headers,
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.client.timeout))
+        return self.session
+
+    async def close(self):
+        """
+        This method closes the http session and its connections, and the ones of the AzureSearchClient if it opened any
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.client.close()
+
+    async def send_request(self, method, url, body, max_retries=None):
+        """
+        This method sends a request once a slot of the semaphore and a token of the rate limiter are available.
+        Throttled (429), unavailable (5xx) responses and connection errors are retried with exponential backoff,
+        honouring the Retry-After header of the service when present
+        :param method: http method (e.g. POST, PUT)
+        :param url:
+        :param body: json body of the request
+        :param max_retries: maximum number of retries, the one of the configuration by default
+        :return: status code, headers and body of the last attempt
+        """
+        session = self.get_session()
+        max_retries = self.client.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            try:
+                async with self.semaphore:
+                    async with session.request(method, url, json=body) as response:
+                        content = await response.read()
+                        result = (response.status, response.headers, content)
+                if result[0] not in RETRY_STATUS_CODES or attempt >= max_retries:
+                    return result
+                delay = self.client.get_retry_delay(response, attempt)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= max_retries:
+                    raise
+                delay = self.client.get_retry_delay(None, attempt)
+            self.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def parse_json(content):
+        """
+        :param content: body of a response
+        :return: the decoded json body
+        """
+        return json.loads(content.decode("utf-8"))
+
+    async def create_index(self, index_name="test", schema=None):
+        """
+        this method is to create an index in azure src using a schema file (resources/index-schema.json)
+        :param index_name:
+        :param schema: the index schema, resources/index-schema.json by default
+        :return: response of the generated index schema
+        """
+        url = self.endpoint + "indexes/" + index_name + self.api_version
+        body = dict(schema) if schema is not None else self.utils.read_json_from_resources("index-schema.json")
+        body["name"] = index_name
+        self.client.schemas[index_name] = body
+        _, _, content = await self.send_request("PUT", url, body)
+        self.client.invalidate_cache(index_name)
+        return self.parse_json(content)
+
+    async def insert_documents(self, index_name="test", batch_size=1000, names=None):
+        """
+        This method inserts the names of names.csv into an index. Names are read lazily and uploaded in batches,
+        up to concurrency batches at the same time. Documents rejected with a transient status are retried on their own
+        :param index_name:
+        :param batch_size: number of documents per request (the service accepts up to 1000)
+        :param names: optional iterable of names inserted instead of the ones of names.csv
+        :return: the status of every document and the number of succeeded and failed documents
+        """
+        url = self.endpoint + "indexes/" + index_name + "/docs/index" + self.api_version
+        documents = self.client.iter_documents(names=names, schema=self.client.get_schema(index_name))
+        statuses = []
+        in_flight = set()
+        for batch in iter(lambda: self.client.dedupe_documents(islice(documents, batch_size)), []):
+            if len(in_flight) >= self.concurrency:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    statuses.extend(task.result())
+            in_flight.add(asyncio.ensure_future(self.upload_batch(url, batch)))
+        for task in in_flight:
+            statuses.extend(await task)
+        self.client.invalidate_cache(index_name)
+        succeeded = sum(1 for status in statuses if status.get("status"))
+        return {"value": statuses, "succeeded": succeeded, "failed": len(statuses) - succeeded}
+
+    async def upload_batch(self, url, documents):
+        """
+        This method uploads a batch of documents and retries the documents which failed with a transient status.
+        A throttled or failed request is retried by the same loop, as a failure of all its documents,
+        so a batch is sent at most max_retries + 1 times
+        :param url: url of the docs/index endpoint
+        :param documents: list of documents with distinct ids
+        :return: the final status of every document of the batch
+        """
+        final_statuses = {}
+        attempt = 0
+        while documents:
+            response = None
+            try:
+                status_code, headers, content = await self.send_request("POST", url, {"value": documents}, 0)
+                # get_retry_delay only reads the Retry-After header of a response
+                response = SimpleNamespace(headers=headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.client.max_retries:
+                    raise
+                failed = {document["id"] for document in documents}
+            if response is not None:
+                if status_code in (200, 207):
+                    statuses = self.parse_json(content)["value"]
+                else:
+                    statuses = [{"key": document["id"], "status": False, "statusCode": status_code,
+                                 "errorMessage": content.decode("utf-8", "replace")} for document in documents]
+                failed = set()
+                for status in statuses:
+                    final_statuses[status["key"]] = status
+                    if not status["status"] and (status.get("statusCode") in RETRY_DOCUMENT_STATUS_CODES
+                                                 or status_code in RETRY_STATUS_CODES):
+                        failed.add(status["key"])
+            if not failed or attempt >= self.client.max_retries:
+                break
+            self.retries += 1
+            await asyncio.sleep(self.client.get_retry_delay(response, attempt))
+            attempt += 1
+            documents = [document for document in documents if document["id"] in failed]
+        return list(final_statuses.values())
+
+    async def make_search(self, misspelled_name, fields, index_name="test"):
+        """
+        this method queries the azure src index
+        :param misspelled_name:
+        :param fields:
+        :param index_name:
+        :return: a name with the maximum rank or NOT_FOUND otherwise
+        """
+        url = self.endpoint + "indexes/" + index_name + "/docs/search" + self.api_version
+        body = self.utils.create_azure_search_body(misspelled_name, fields, top=1, select=["standard_lucene"])
+        cache = self.client.cache
+        # the cache is a SQLite file, it is read and written on the default executor instead of the event loop
+        loop = asyncio.get_running_loop()
+        if cache is not None:
+            cached = await loop.run_in_executor(None, cache.get, index_name, misspelled_name, body["searchFields"])
+            if cached is not None:
+                return cached
+        start = time.perf_counter()
+        status_code, headers, content = await self.send_request("POST", url, body)
+        client_latency = time.perf_counter() - start
+        LOGGER.debug("search %s -> %s in %.1f ms", body, status_code, client_latency * 1000)
+        if self.client.metrics is not None:
+            elapsed_time = headers.get("elapsed-time")
+            self.client.metrics.record(fields, client_latency, float(elapsed_time) / 1000 if elapsed_time else None,
+                                       len(json.dumps(body).encode("utf-8")), len(content))
+        found_name = self.utils.get_maximum_rank_from_azure_search_response(self.parse_json(content))
+        if cache is not None and 200 <= status_code < 300:
+            await loop.run_in_executor(None, cache.put, index_name, misspelled_name, body["searchFields"], found_name)
+        return found_name
+
+    async def make_search_many(self, queries, index_name="test"):
+        """
+        this method sends many independent queries at once, up to the concurrency of the client
+        :param queries: list of (misspelled name, fields)
+        :param index_name:
+        :return: list of names with the maximum rank (or NOT_FOUND), in the same order as queries
+        """
+        return await asyncio.gather(*(self.make_search(name, fields, index_name) for name, fields in queries))
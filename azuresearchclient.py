@@ -1,48 +1,233 @@
 """
 This file contains methods to communicate with azure src
 """
+import contextvars
+import logging
 import os
-import uuid
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from searchbackend import RETRY_STATUS_CODES, SearchBackend
 from utils import Utils
 
+LOGGER = logging.getLogger(__name__)
+
+# status codes of a single document in a batch which are worth retrying
+RETRY_DOCUMENT_STATUS_CODES = (409, 422, 429, 503)
 
-class AzureSearchClient:
+
+class AzureSearchClient(SearchBackend):
     """
     This class contains methods to communicate with azure src
     """
 
-    def __init__(self):
+    def __init__(self, endpoint=None, cache=None, metrics=None):
+        """
+        :param endpoint: base url of the search service. By default it is built from the
+        service name in resources/config.yml, it can be overridden (e.g. to a local stub server)
+        :param cache: optional QueryCache, if given the results of make_search are looked up there
+        before a query is sent to the service
+        :param metrics: optional QueryMetrics, if given the latency and payload sizes of every query are recorded
+        """
         self.utils = Utils(os.path.join("resources"))
         self.config = self.utils.get_config()
-        self.endpoint = 'https://{}.search.windows.net/'.format(self.config["search"]["service_name"])
+        self.endpoint = endpoint or 'https://{}.search.windows.net/'.format(self.config["search"]["service_name"])
         self.api_version = '?api-version=2020-06-30'
         self.headers = {'Content-Type': 'application/json',
                         'api-key': '{}'.format(self.config["search"]["api_key"])}
+        http_config = self.config.get("http") or {}
+        self.pool_size = http_config.get("pool_size", 10)
+        self.timeout = http_config.get("timeout", 30)
+        self.max_retries = http_config.get("max_retries", 5)
+        self.backoff_factor = http_config.get("backoff_factor", 0.5)
+        self.pooled_session = None
+        self.retries = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        self.cache = cache
+        self.schemas = {}
+        self.metrics = metrics
+
+    @property
+    def session(self):
+        """
+        :return: the pooled http session, created on first use so that a client only used for its configuration
+        (e.g. by AsyncAzureSearchClient) opens no connection pool
+        """
+        if self.pooled_session is None:
+            with self.lock:
+                if self.pooled_session is None:
+                    self.pooled_session = self.create_session()
+        return self.pooled_session
+
+    def create_session(self):
+        """
+        This method creates a persistent http session which keeps up to pool_size connections alive,
+        so that consecutive (or concurrent) requests do not pay a new TCP/TLS handshake each
+        :return: a requests session
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def send_request(self, method, url, body):
+        """
+        This method sends a request through the pooled session. Throttled (429), unavailable (5xx)
+        responses and connection errors are retried with exponential backoff, honouring the
+        Retry-After header of the service when present
+        :param method: http method (e.g. POST, PUT)
+        :param url:
+        :param body: json body of the request
+        :return: the response of the last attempt
+        """
+        return self.send_with_retries(method, url, json=body)
 
-    def insert_documents(self, index_name="test"):
+    def get_connection_stats(self):
         """
-        Thsi method is to insert document into an index in azure src
+        This method reports how the pooled connections were used
+        :return: dictionary with the number of requests, opened connections, reused connections and retries
+        """
+        connections = 0
+        requests_sent = 0
+        # the same adapter is mounted for http:// and https://
+        adapters = {id(adapter): adapter for adapter in self.session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+        return {"requests": requests_sent,
+                "connections": connections,
+                "reused_connections": max(0, requests_sent - connections),
+                "retries": self.retries}
+
+    def insert_documents(self, index_name="test", batch_size=1000, concurrency=1, names=None):
+        """
+        Thsi method is to insert document into an index in azure src.
+        Names are read lazily from names.csv and uploaded in batches, up to concurrency batches at the same time.
+        Documents rejected with a transient status are retried on their own
+        :param index_name:
+        :param batch_size: number of documents per request (the service accepts up to 1000)
+        :param concurrency: maximum number of batches in flight at the same time
+        :param names: optional iterable of names inserted instead of the ones of names.csv
+        :return: the status of every document and the number of succeeded and failed documents
+        """
+        result = self.index_documents(index_name, self.iter_documents(names=names, schema=self.get_schema(index_name)),
+                                      batch_size, concurrency)
+        self.invalidate_cache(index_name)
+        return result
+
+    def index_documents(self, index_name, documents, batch_size=1000, concurrency=1):
+        """
+        This method sends documents with their own action (upload, mergeOrUpload, delete) in batches,
+        up to concurrency batches at the same time. The cache is left untouched, the caller knows which
+        of the cached results the documents affect
         :param index_name:
+        :param documents: iterable of documents, each with its @search.action
+        :param batch_size: number of documents per request (the service accepts up to 1000)
+        :param concurrency: maximum number of batches in flight at the same time
+        :return: the status of every document and the number of succeeded and failed documents
         """
         url = self.endpoint + "indexes/" + index_name + "/docs/index" + self.api_version
-        response = requests.post(url, headers=self.headers, json=self.create_documents_payload())
-        return response.json()
+        documents = iter(documents)
+        statuses = []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            in_flight = set()
+            for batch in iter(lambda: self.dedupe_documents(islice(documents, batch_size)), []):
+                if len(in_flight) >= concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        statuses.extend(future.result())
+                in_flight.add(executor.submit(self.upload_batch, url, batch))
+            for future in in_flight:
+                statuses.extend(future.result())
+        succeeded = sum(1 for status in statuses if status.get("status"))
+        return {"value": statuses, "succeeded": succeeded, "failed": len(statuses) - succeeded}
+
+    @staticmethod
+    def dedupe_documents(documents):
+        """
+        This method keeps the last action of every document id of a batch, the service reports one status per id
+        :param documents: iterable of documents
+        :return: list of documents with distinct ids
+        """
+        return list({document["id"]: document for document in documents}.values())
+
+    def upload_batch(self, url, documents):
+        """
+        This method uploads a batch of documents and retries the documents which failed with a transient status.
+        A throttled or failed request is retried by the same loop, as a failure of all its documents,
+        so a batch is sent at most max_retries + 1 times
+        :param url: url of the docs/index endpoint
+        :param documents: list of documents with distinct ids
+        :return: the final status of every document of the batch
+        """
+        final_statuses = {}
+        attempt = 0
+        while documents:
+            response = None
+            try:
+                response = self.send_with_retries("POST", url, max_retries=0, json={"value": documents})
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                failed = {document["id"] for document in documents}
+            if response is not None:
+                if response.status_code in (200, 207):
+                    statuses = response.json()["value"]
+                else:
+                    statuses = [{"key": document["id"], "status": False, "statusCode": response.status_code,
+                                 "errorMessage": response.text} for document in documents]
+                failed = set()
+                for status in statuses:
+                    final_statuses[status["key"]] = status
+                    if not status["status"] and (status.get("statusCode") in RETRY_DOCUMENT_STATUS_CODES
+                                                 or response.status_code in RETRY_STATUS_CODES):
+                        failed.add(status["key"])
+            if not failed or attempt >= self.max_retries:
+                break
+            with self.lock:
+                self.retries += 1
+            time.sleep(self.get_retry_delay(response, attempt))
+            attempt += 1
+            documents = [document for document in documents if document["id"] in failed]
+        return list(final_statuses.values())
 
-    def create_index(self, index_name="test"):
+    def create_index(self, index_name="test", schema=None):
         """
         this method is to create an index in azure src using a schema file (resources/index-schema.json)
         :param index_name:
+        :param schema: the index schema, resources/index-schema.json by default
         :return: response of the generated index schema
         """
         url = self.endpoint + "/indexes/" + index_name + self.api_version
-        body = self.utils.read_json_from_resources("index-schema.json")
+        body = dict(schema) if schema is not None else self.utils.read_json_from_resources("index-schema.json")
         body["name"] = index_name
-        response = requests.put(url, headers=self.headers,
-                                json=body)
+        self.schemas[index_name] = body
+        response = self.send_request("PUT", url, body)
+        self.invalidate_cache(index_name)
         return response.json()
 
+    def delete_index(self, index_name="test"):
+        """
+        this method drops an index, a missing index is not an error
+        :param index_name:
+        """
+        response = self.send_request("DELETE", self.endpoint + "indexes/" + index_name + self.api_version, None)
+        self.schemas.pop(index_name, None)
+        self.invalidate_cache(index_name)
+        if not response.ok and response.status_code != 404:
+            raise Exception("index {} could not be deleted: {}".format(index_name, response.text))
+
     def make_search(self, misspelled_name, fields, index_name="test"):
         """
         this method queries the azure src index
@@ -52,36 +237,95 @@ class AzureSearchClient:
         :query  the query
         """
         url = self.endpoint + "/indexes/" + index_name + "/docs/search" + self.api_version
-        body = self.utils.create_azure_search_body(misspelled_name, fields)
-        print(body)
-        azure_response = requests.post(url, headers=self.headers,
-                                       json=body)
-        print(azure_response)
-        return self.utils.get_maximum_rank_from_azure_search_response(azure_response.json())
+        # only the name of the best hit is used
+        body = self.utils.create_azure_search_body(misspelled_name, fields, top=1, select=["standard_lucene"])
+        if self.cache is not None:
+            cached = self.cache.get(index_name, misspelled_name, body["searchFields"])
+            if cached is not None:
+                return cached
+        start = time.perf_counter()
+        azure_response = self.send_request("POST", url, body)
+        client_latency = time.perf_counter() - start
+        LOGGER.debug("search %s -> %s in %.1f ms", body, azure_response.status_code, client_latency * 1000)
+        if self.metrics is not None:
+            self.record_metrics(fields, client_latency, azure_response)
+        found_name = self.utils.get_maximum_rank_from_azure_search_response(azure_response.json())
+        if self.cache is not None and azure_response.ok:
+            self.cache.put(index_name, misspelled_name, body["searchFields"], found_name)
+        return found_name
+
+    def make_search_many(self, queries, index_name="test"):
+        """
+        this method sends many independent queries at once, multiplexed over the pooled connections.
+        The queries are sent by the executor of the client (get_executor), up to pool_size at the same time.
+        Each query runs in a copy of the context of the caller, so that instrumentation.recorded_as holds
+        :param queries: list of (misspelled name, fields)
+        :param index_name:
+        :return: list of names with the maximum rank (or NOT_FOUND), in the same order as queries
+        """
+        contexts = [contextvars.copy_context() for _ in queries]
+        return list(self.get_executor().map(
+            lambda context, query: context.run(self.make_search, query[0], query[1], index_name), contexts, queries))
+
+    def get_executor(self):
+        """
+        :return: the thread pool of make_search_many, created on first use with one thread per pooled connection
+        and shared by all the calls
+        """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.pool_size)
+            return self.executor
+
+    def close(self):
+        """
+        This method stops the threads of make_search_many and closes the pooled connections
+        """
+        with self.lock:
+            executor, self.executor = self.executor, None
+            session, self.pooled_session = self.pooled_session, None
+        if executor is not None:
+            executor.shutdown()
+        if session is not None:
+            session.close()
+
+    def record_metrics(self, fields, client_latency, response):
+        """
+        This method records the latency and payload sizes of a query
+        :param fields: the searched fields
+        :param client_latency: seconds spent waiting for the response
+        :param response: the response of the service
+        """
+        elapsed_time = response.headers.get("elapsed-time")
+        service_latency = float(elapsed_time) / 1000 if elapsed_time else None
+        request_bytes = len(response.request.body or b"")
+        self.metrics.record(fields, client_latency, service_latency, request_bytes, len(response.content))
+
+    def make_search_hits(self, misspelled_name, fields, index_name="test", top=50):
+        """
+        this method queries the azure src index and returns the ranked hits instead of the top one
+        :param misspelled_name:
+        :param fields:
+        :param index_name:
+        :param top: maximum number of hits to be returned
+        :return: a list of (name, score)
+        """
+        url = self.endpoint + "/indexes/" + index_name + "/docs/search" + self.api_version
+        body = self.utils.create_azure_search_body(misspelled_name, fields, top, ["standard_lucene"])
+        azure_response = self.send_request("POST", url, body)
+        return self.utils.get_ranked_hits_from_azure_search_response(azure_response.json())
+
+    def invalidate_cache(self, index_name):
+        """
+        This method drops the cached query results of an index after it has been (re)created or its documents changed
+        :param index_name:
+        """
+        if self.cache is not None:
+            self.cache.invalidate(index_name)
 
     def create_documents_payload(self):
         """
         This method is to create documents payload for the azure src from tokens.csv file
         :return: a payload to insert documents into azure src
         """
-        documents = []
-        tokens = self.utils.read_csv("names.csv")
-        for token in tokens:
-            documents.append({
-                "@src.action": "upload",
-                "id": str(uuid.uuid4()),
-                "standard_lucene": token[0],
-                "phonetic": token[0],
-                "edge_n_gram": token[0],
-                "keyword": token[0],
-                "letter": token[0],
-                "ngram": token[0],
-                "camelcase": token[0],
-                "email": token[0],
-                "stemming": token[0],
-                "url_email": token[0],
-                "text_microsoft": token[0]
-
-            })
-
-        return {"value": documents}
\ No newline at end of file
+        return {"value": list(self.iter_documents())}
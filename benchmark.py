@@ -0,0 +1,343 @@
+"""
+This file contains a benchmark of the evaluation pipeline on synthetic corpora of names
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, the maximum resident set size is not reported
+    resource = None
+
+from constants import Constants
+from fuzzyindex import FuzzyNameIndex
+from localsearchclient import LocalSearchClient
+from statistics import Statistics
+from utils import Utils
+
+LOGGER = logging.getLogger(__name__)
+
+# spellings which sound alike, applied in both directions
+PHONETIC_SWAPS = [("ph", "f"), ("ck", "k"), ("c", "k"), ("y", "i"), ("ee", "ea"), ("ou", "ow"), ("s", "z"),
+                  ("v", "w"), ("oo", "u"), ("ei", "ie"), ("gh", "g"), ("th", "t"), ("ll", "l"), ("tt", "t")]
+SYLLABLE = re.compile(r"[^aeiouy]*[aeiouy]+", re.IGNORECASE)
+
+
+class NameGenerator:
+    """
+    This class generates names and misspellings of names. First names are the ones of names.csv, last names
+    are the ones of names.csv and new ones made of their syllables, so any number of distinct names can be
+    generated. Misspellings combine the errors seen in names-misspelled.csv: split or joined tokens
+    (Tom O'halleran -> Tom O Halleran, Mo Brooks -> MoBrooks), dropped or added punctuation, phonetic swaps,
+    dropped, doubled and transposed letters
+    """
+
+    def __init__(self, names, seed=0):
+        """
+        :param names: the names the first names, last names and syllables are taken from
+        :param seed: seed of the random generator
+        """
+        self.random = random.Random(seed)
+        tokens = [name.split() for name in names if len(name.split()) > 1]
+        self.first_names = sorted({token[0] for token in tokens})
+        self.last_names = sorted({" ".join(token[1:]) for token in tokens})
+        self.syllables = sorted({syllable.lower() for last_name in self.last_names
+                                 for token in last_name.replace("'", "").split()
+                                 for syllable in SYLLABLE.findall(token)})
+
+    def generate_last_name(self):
+        """
+        :return: a last name of names.csv, or a new one made of 2 or 3 syllables
+        """
+        if self.random.random() < 0.5:
+            return self.random.choice(self.last_names)
+        syllables = self.random.sample(self.syllables, self.random.randint(2, 3))
+        return "".join(syllables).capitalize()
+
+    def generate_names(self, count):
+        """
+        :param count: number of names
+        :return: list of distinct names
+        """
+        names = {}
+        while len(names) < count:
+            name = self.random.choice(self.first_names) + " " + self.generate_last_name()
+            names.setdefault(name, None)
+        return list(names)
+
+    def misspell(self, name):
+        """
+        This method applies one or two random errors to a name
+        :param name:
+        :return: the misspelled name
+        """
+        errors = [self.split_or_join, self.change_punctuation, self.swap_phonetic, self.drop_letter,
+                  self.double_letter, self.transpose_letters]
+        misspelled = name
+        for error in self.random.sample(errors, self.random.randint(1, 2)):
+            misspelled = error(misspelled)
+        if self.random.random() < 0.05:
+            misspelled = misspelled.lower()
+        return misspelled
+
+    def split_or_join(self, name):
+        """
+        :return: the name with an apostrophe replaced by a space, two tokens joined or a token split
+        """
+        if "'" in name:
+            head, tail = name.split("'", 1)
+            return head + " " + tail[:1].upper() + tail[1:]
+        if " " in name and self.random.random() < 0.5:
+            positions = [i for i, char in enumerate(name) if char == " "]
+            position = self.random.choice(positions)
+            return name[:position] + name[position + 1:]
+        tokens = name.split(" ")
+        index = self.random.randrange(len(tokens))
+        if len(tokens[index]) < 4:
+            return name
+        position = self.random.randint(1, len(tokens[index]) - 1)
+        tokens[index] = tokens[index][:position] + " " + tokens[index][position:]
+        return " ".join(tokens)
+
+    def change_punctuation(self, name):
+        """
+        :return: the name without its apostrophes and hyphens, or with a period after its first token
+        """
+        if "'" in name or "-" in name:
+            return name.replace("'", "").replace("-", " ")
+        tokens = name.split(" ")
+        return tokens[0] + ". " + " ".join(tokens[1:]) if len(tokens) > 1 else name
+
+    def swap_phonetic(self, name):
+        """
+        :return: the name with a spelling replaced by one which sounds alike
+        """
+        lowered = name.lower()
+        swaps = [(first, second) for first, second in PHONETIC_SWAPS if first in lowered] + \
+                [(second, first) for first, second in PHONETIC_SWAPS if second in lowered]
+        if not swaps:
+            return self.drop_letter(name)
+        first, second = self.random.choice(swaps)
+        position = lowered.index(first)
+        replacement = second.upper() if name[position].isupper() and second else second
+        return name[:position] + replacement[:1] + second[1:] + name[position + len(first):]
+
+    def get_letter_positions(self, name):
+        """
+        :return: positions of the letters of a name which are not the first letter of a token
+        """
+        return [i for i in range(1, len(name)) if name[i].isalpha() and name[i - 1] != " "]
+
+    def drop_letter(self, name):
+        """
+        :return: the name without one of its letters
+        """
+        positions = self.get_letter_positions(name)
+        if not positions:
+            return name
+        position = self.random.choice(positions)
+        return name[:position] + name[position + 1:]
+
+    def double_letter(self, name):
+        """
+        :return: the name with one of its letters doubled
+        """
+        positions = self.get_letter_positions(name)
+        if not positions:
+            return name
+        position = self.random.choice(positions)
+        return name[:position] + name[position] + name[position:]
+
+    def transpose_letters(self, name):
+        """
+        :return: the name with two adjacent letters swapped
+        """
+        positions = [i for i in self.get_letter_positions(name) if i + 1 < len(name) and name[i + 1].isalpha()]
+        if not positions:
+            return name
+        position = self.random.choice(positions)
+        return name[:position] + name[position + 1] + name[position] + name[position + 2:]
+
+    def generate_corpus(self, size, queries, not_found_rate=0.05):
+        """
+        This method generates the names to be indexed and the queries
+        :param size: number of names to be indexed
+        :param queries: number of misspelled names
+        :param not_found_rate: fraction of misspelled names of names which are not indexed (expected NOT_FOUND)
+        :return: names, expected names and misspelled names
+        """
+        names = self.generate_names(size)
+        indexed = set(names)
+        others = [name for name in self.generate_names(size + queries) if name not in indexed]
+        expected = []
+        misspelled = []
+        for _ in range(queries):
+            if others and self.random.random() < not_found_rate:
+                misspelled.append(self.misspell(self.random.choice(others)))
+                expected.append("NOT_FOUND")
+            else:
+                name = self.random.choice(names)
+                misspelled.append(self.misspell(name))
+                expected.append(name)
+        return names, expected, misspelled
+
+
+class Benchmark:
+    """
+    This class times the stages of the pipeline (corpus generation, ingestion, statistics, reports, f1 scores)
+    on synthetic corpora of growing sizes, against the in-process backends, and optionally an azure src stub.
+    Each size runs in its own workspace directory holding a resources and a generated directory,
+    so the reports of the repository are left untouched
+    """
+
+    def __init__(self, directory="benchmark", memory=False, seed=0):
+        """
+        :param directory: directory of the workspaces
+        :param memory: if true, the peak of the memory allocated by each stage is traced (it slows the stages down)
+        :param seed: seed of the corpus generator and of the sampled subsets
+        """
+        self.directory = os.path.abspath(directory)
+        self.memory = memory
+        self.seed = seed
+        self.resources = os.path.abspath("resources")
+        self.results = []
+
+    @contextmanager
+    def workspace(self, size):
+        """
+        This method creates the workspace of a size, with the schema and config of resources, and moves into it
+        :param size: number of names
+        """
+        path = os.path.join(self.directory, str(size))
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(os.path.join(path, "resources"))
+        for file_name in ("config.yml", "index-schema.json"):
+            shutil.copy(os.path.join(self.resources, file_name), os.path.join(path, "resources", file_name))
+        current = os.getcwd()
+        os.chdir(path)
+        try:
+            yield path
+        finally:
+            os.chdir(current)
+
+    def measure(self, stage, size, items, function, *args, **kwargs):
+        """
+        This method times a stage and records it
+        :param stage: name of the stage
+        :param size: number of names
+        :param items: number of items (names, queries, files) processed by the stage
+        :param function: the stage
+        :return: the value returned by the stage
+        """
+        if self.memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        value = function(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        peak = None
+        if self.memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        # maximum resident set size of the process so far, in kilobytes on linux
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource is not None else None
+        self.results.append({"stage": stage, "size": size, "items": items, "seconds": seconds,
+                             "items_per_second": items / seconds if seconds > 0 else -1, "peak_bytes": peak,
+                             "max_rss_bytes": max_rss})
+        LOGGER.info("%s (%s names): %s items in %.3f s", stage, size, items, seconds)
+        return value
+
+    @staticmethod
+    def write_csv(file_name, names):
+        """
+        This method writes one name per line, as the CSV files of resources
+        """
+        with open(os.path.join("resources", file_name), 'w', newline='') as a_file:
+            csv.writer(a_file).writerows([name] for name in names)
+
+    def run(self, size, queries=1000, subsets=10, endpoint=None):
+        """
+        This method benchmarks the pipeline on a corpus of size names
+        :param size: number of names to be indexed
+        :param queries: number of misspelled names
+        :param subsets: number of combinations of fields evaluated on the local backend
+        :param endpoint: optional endpoint of an azure src stub, to benchmark the ingestion over http
+        :return: the records of the stages of this size
+        """
+        first = len(self.results)
+        with self.workspace(size):
+            generator = NameGenerator([row[0] for row in Utils(self.resources).read_csv("names.csv")], self.seed)
+            names, expected, misspelled = self.measure("generate_corpus", size, size + queries,
+                                                       generator.generate_corpus, size, queries)
+            self.write_csv("names.csv", names)
+            self.write_csv("names-expected.csv", expected)
+            self.write_csv("names-misspelled.csv", misspelled)
+            statistics = Statistics()
+            correct_list = statistics.utils.read_csv("names-expected.csv")
+            misspelled_list = statistics.utils.read_csv("names-misspelled.csv")
+
+            local = LocalSearchClient()
+            local.create_index("test")
+            self.measure("ingest_local", size, size, local.insert_documents, "test")
+            if endpoint:
+                from azuresearchclient import AzureSearchClient
+                azure = AzureSearchClient(endpoint)
+                azure.create_index("test")
+                self.measure("ingest_azure", size, size, azure.insert_documents, "test", concurrency=4)
+            fuzzy = self.measure("index_fuzzy", size, size, FuzzyNameIndex, names)
+
+            all_subsets = statistics.utils.get_subsets(Constants.name_search_fields)
+            sample = random.Random(self.seed).sample(all_subsets, min(subsets, len(all_subsets)))
+            self.measure("statistics_local", size, queries * len(sample), statistics.calculate_statistics,
+                         correct_list, misspelled_list, sample, local)
+            results = statistics.results
+            self.measure("statistics_fuzzy", size, queries, statistics.calculate_statistics,
+                         correct_list, misspelled_list, [("fuzzy",)], fuzzy)
+            self.measure("write_reports", size, queries * len(sample), self.write_reports, statistics, results, sample)
+            self.measure("f1_results", size, len(sample), statistics.generate_f1, results)
+            self.measure("f1_reports", size, len(sample), statistics.generate_f1)
+            self.measure("f1_reports_vectorized", size, len(sample), statistics.generate_f1_vectorized)
+        return self.results[first:]
+
+    @staticmethod
+    def write_reports(statistics, results, subsets):
+        """
+        This method writes the report of every subset, as calculate_statistics does with generate_reports
+        """
+        for subset in subsets:
+            statistics.utils.generate_reports(results.get_rows(subset), '-'.join(subset))
+
+    def write_report(self, file_name="benchmark", directory="reports"):
+        """
+        This method writes the records of every stage to a json file
+        :param file_name:
+        :param directory:
+        """
+        Utils(directory).write_json_to_directory(self.results, file_name, directory)
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Benchmark the evaluation pipeline on synthetic corpora")
+    PARSER.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    PARSER.add_argument("--queries", type=int, default=1000)
+    PARSER.add_argument("--subsets", type=int, default=10)
+    PARSER.add_argument("--endpoint", help="endpoint of an azure src stub, to benchmark the ingestion over http")
+    PARSER.add_argument("--memory", action="store_true", help="trace the peak memory of every stage")
+    PARSER.add_argument("--seed", type=int, default=0)
+    PARSER.add_argument("--output", default="benchmark", help="name of the json file written in reports")
+    ARGS = PARSER.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    BENCHMARK = Benchmark(memory=ARGS.memory, seed=ARGS.seed)
+    for SIZE in ARGS.sizes:
+        BENCHMARK.run(SIZE, ARGS.queries, ARGS.subsets, ARGS.endpoint)
+    BENCHMARK.write_report(ARGS.output)
+    print(json.dumps(BENCHMARK.results, indent=2))
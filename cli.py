@@ -0,0 +1,371 @@
+"""
+This file contains a command line interface running each stage of the pipeline on its own:
+index, ingest, sync, sweep, score, plot and query.
+Heavy modules (pandas, matplotlib, yaml, the search clients) are only imported by the stages needing them
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+LOGGER = logging.getLogger("cli")
+
+BACKENDS = ["azure", "elastic", "local", "fuzzy"]
+
+
+class IndexedBackend:
+    """
+    This class searches a given index of a search engine, calculate_statistics searches the default one
+    """
+
+    def __init__(self, search_engine, index_name):
+        self.search_engine = search_engine
+        self.index_name = index_name
+
+    def make_search(self, misspelled_name, fields):
+        return self.search_engine.make_search(misspelled_name, fields, self.index_name)
+
+    def make_search_many(self, queries):
+        return self.search_engine.make_search_many(queries, self.index_name)
+
+
+def get_corpus(args):
+    """
+    :param args: the parsed arguments, with the optional corpus directory
+    :return: the CompiledCorpus, (re)built from the resources if it is missing or stale, None without --corpus
+    """
+    if not args.corpus:
+        return None
+    from compiledcorpus import CompiledCorpus
+    return CompiledCorpus.load_or_build(args.corpus)
+
+
+def get_indexed_names(args):
+    """
+    :param args: the parsed arguments, with the optional corpus directory
+    :return: the names of the corpus to be indexed, None to read resources/names.csv
+    """
+    corpus = get_corpus(args)
+    return corpus.iter_indexed_names() if corpus is not None else None
+
+
+def create_backend(args):
+    """
+    This method creates the search engine of a stage. The local and fuzzy backends live in memory,
+    so their index is created and filled every time
+    :param args: the parsed arguments, with the backend, the endpoint and the index name
+    :return: the search engine
+    """
+    if args.backend == "azure":
+        from azuresearchclient import AzureSearchClient
+        return AzureSearchClient(args.endpoint)
+    if args.backend == "elastic":
+        from elasticsearchclient import ElasticSearchClient
+        return ElasticSearchClient(args.endpoint)
+    if args.backend == "fuzzy":
+        from fuzzyindex import FuzzyNameIndex
+        corpus = get_corpus(args)
+        return FuzzyNameIndex.from_corpus(corpus) if corpus is not None else FuzzyNameIndex.from_csv("names.csv")
+    from localsearchclient import LocalSearchClient
+    client = LocalSearchClient()
+    client.create_index(args.index)
+    client.insert_documents(args.index, get_indexed_names(args))
+    return client
+
+
+def create_index(args):
+    """
+    This method (re)creates the index of the remote backend
+    """
+    if args.backend in ("local", "fuzzy"):
+        LOGGER.info("the %s backend is created in memory by each stage", args.backend)
+        return 0
+    from namesync import NameManifest
+    create_backend(args).create_index(args.index)
+    # the new index is empty, the next sync uploads every name
+    manifest = NameManifest()
+    manifest.drop(args.index)
+    manifest.close()
+    LOGGER.info("index %s created", args.index)
+    return 0
+
+
+def ingest(args):
+    """
+    This method inserts the names of resources/names.csv into the index of the remote backend and records them
+    in the manifest, so that the next sync only sends what changed
+    """
+    if args.backend in ("local", "fuzzy"):
+        LOGGER.info("the %s backend is filled in memory by each stage", args.backend)
+        return 0
+    from namesync import NameSynchronizer
+    kwargs = {"batch_size": args.batch_size}
+    if args.backend == "azure":
+        kwargs["concurrency"] = args.concurrency
+    synchronizer = NameSynchronizer(create_backend(args))
+    try:
+        result = synchronizer.ingest(args.index, names=get_indexed_names(args), **kwargs)
+    finally:
+        synchronizer.manifest.close()
+    LOGGER.info("%s documents inserted, %s failed", result["succeeded"], result["failed"])
+    return 0 if result["failed"] == 0 else 1
+
+
+def sync(args):
+    """
+    This method sends only the names of resources/names.csv which changed since the last sync to the index
+    of the remote backend, and drops the cached queries and stored results they affect
+    """
+    if args.backend in ("local", "fuzzy"):
+        LOGGER.info("the %s backend is filled in memory by each stage", args.backend)
+        return 0
+    from namesync import NameSynchronizer
+    from querycache import QueryCache
+    from resultstore import ResultStore
+    from utils import Utils
+    cache = QueryCache(args.cache) if args.cache else None
+    result_store = ResultStore(args.store) if args.store else None
+    misspelled_list = Utils("resources").read_csv("names-misspelled.csv") if args.store else None
+    kwargs = {"batch_size": args.batch_size}
+    if args.backend == "azure":
+        kwargs["concurrency"] = args.concurrency
+    try:
+        summary = NameSynchronizer(create_backend(args), cache=cache, result_store=result_store,
+                                   misspelled_list=misspelled_list).sync(args.index, dry_run=args.dry_run, **kwargs)
+    finally:
+        for closable in (cache, result_store):
+            if closable is not None:
+                closable.close()
+    print(json.dumps(summary))
+    return 0 if summary["failed"] == 0 else 1
+
+
+def sweep(args):
+    """
+    This method sends the misspelled names to every combination of the fields and writes the results
+    """
+    from constants import Constants
+    from statistics import Statistics
+    corpus = get_corpus(args)
+    statistics = Statistics(corpus)
+    fields = args.fields or Constants.name_search_fields
+    subsets = [("fuzzy",)] if args.backend == "fuzzy" else statistics.utils.get_subsets(fields)
+    if args.max_fields:
+        subsets = [subset for subset in subsets if len(subset) <= args.max_fields]
+    result_store = None
+    if args.store:
+        from resultstore import ResultStore
+        result_store = ResultStore(args.store)
+    search_engine = create_backend(args)
+    if args.backend != "fuzzy":
+        search_engine = IndexedBackend(search_engine, args.index)
+    if corpus is not None:
+        correct_list = corpus.get_expected_rows()
+        misspelled_list = corpus.get_misspelled_rows()
+    else:
+        correct_list = statistics.utils.read_csv("names-expected.csv")
+        misspelled_list = statistics.utils.read_csv("names-misspelled.csv")
+    try:
+        if args.race:
+            statistics.calculate_statistics_racing(correct_list, misspelled_list, subsets, search_engine,
+                                                   not args.no_reports, args.concurrency, result_store,
+                                                   args.batch_size, args.round_size)
+        else:
+            statistics.calculate_statistics(correct_list, misspelled_list, subsets, search_engine,
+                                            not args.no_reports, args.concurrency, result_store, args.batch_size)
+    finally:
+        if result_store is not None:
+            result_store.close()
+    return 0
+
+
+def schema_sweep(args):
+    """
+    This method evaluates the variants of the index schema of a grid of analyzer parameters
+    and writes reports/schema-sweep.json
+    """
+    from schemasweep import SchemaSweep
+    from utils import Utils
+    utils = Utils("resources")
+    if args.backend == "local":
+        # the variant indexes are created by the sweep
+        from localsearchclient import LocalSearchClient
+        search_engine = LocalSearchClient()
+    else:
+        search_engine = create_backend(args)
+    corpus = get_corpus(args)
+    if corpus is not None:
+        correct_list = corpus.get_expected_rows()
+        misspelled_list = corpus.get_misspelled_rows()
+    else:
+        correct_list = utils.read_csv("names-expected.csv")
+        misspelled_list = utils.read_csv("names-misspelled.csv")
+    schema_sweep = SchemaSweep(search_engine, correct_list, misspelled_list, json.loads(args.grid), corpus=corpus,
+                               prefix=args.prefix, parallel=args.parallel, concurrency=args.concurrency,
+                               batch_size=args.batch_size, keep_indexes=args.keep_indexes)
+    subsets = [tuple(fields.split("-")) for fields in args.subsets] if args.subsets else None
+    report = schema_sweep.run(subsets)
+    schema_sweep.write_report()
+    for stat in report:
+        print("{:.4f}  {:8.2f} ms  {}  {}  {}{}".format(stat["f1"], stat["client_p50"], stat["variant"],
+                                                      stat["fields"], json.dumps(stat["parameters"]),
+                                                      "  (reused)" if stat["reused"] else ""))
+    for fields, stat in schema_sweep.get_best().items():
+        print("best for {}: {} {}".format(fields, stat["variant"], json.dumps(stat["parameters"])))
+    return 0
+
+
+def get_scores(args):
+    """
+    :param args: the parsed arguments, with the optional result store
+    :return: the scores of every subset, from the result store or the generated reports
+    """
+    from statistics import Statistics
+    statistics = Statistics()
+    result_store = None
+    if args.store:
+        from resultstore import ResultStore
+        result_store = ResultStore(args.store)
+    try:
+        if args.vectorized:
+            return statistics.generate_f1_vectorized(result_store)
+        return statistics.generate_f1(result_store)
+    finally:
+        if result_store is not None:
+            result_store.close()
+
+
+def score(args):
+    """
+    This method calculates the f1 scores, writes them to reports/scores.json and prints the best subsets
+    """
+    from utils import Utils
+    utils = Utils("resources")
+    scores = get_scores(args)
+    utils.write_json_to_directory(scores, "scores", "reports")
+    for stat in utils.sort_on_f1_score(scores)[:args.top]:
+        print("{:.4f}  {}{}".format(stat["f1"], stat["fields"],
+                                    "  (pruned after {} names)".format(stat["evaluated"]) if stat["pruned"] else ""))
+    pruned = [stat for stat in scores if stat["pruned"]]
+    if pruned:
+        print("pruned: {} of {} subsets, {} queries saved".format(len(pruned), len(scores),
+                                                                  sum(stat["queries_saved"] for stat in pruned)))
+    # the scores of the pruned subsets are the ones of the names they were evaluated on
+    print("best: " + utils.get_shortest_fields_with_highest_f1_score([stat for stat in scores if not stat["pruned"]]))
+    return 0
+
+
+def plot(args):
+    """
+    This method plots the f1 scores
+    """
+    from statistics import Statistics
+    Statistics.create_plot(get_scores(args), args.output)
+    return 0
+
+
+def query(args):
+    """
+    This method searches names and prints the result of each
+    """
+    backend = create_backend(args)
+    for name in args.names:
+        if args.backend == "fuzzy":
+            print(json.dumps({"query": name, "result": backend.make_search(name)}))
+        else:
+            print(json.dumps({"query": name, "result": backend.make_search(name, args.fields, args.index)}))
+    return 0
+
+
+def create_parser():
+    """
+    :return: the parser of the command line
+    """
+    parser = argparse.ArgumentParser(description="Evaluate analyzers for name disambiguation")
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "INFO"),
+                        help="the logging level, the LOG_LEVEL environment variable or INFO by default")
+    parser.add_argument("--corpus", help="directory of the compiled corpus the names are read from, "
+                                         "it is built from the CSV files of the resources if missing or stale")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    def add_backend_arguments(subparser, backends=BACKENDS):
+        subparser.add_argument("--backend", choices=backends, default="azure")
+        subparser.add_argument("--endpoint", help="endpoint of the search service, e.g. a local stub server")
+        subparser.add_argument("--index", default="test")
+
+    subparser = subparsers.add_parser("index", help="(re)create the search index")
+    add_backend_arguments(subparser)
+    subparser.set_defaults(function=create_index)
+
+    subparser = subparsers.add_parser("ingest", help="insert resources/names.csv into the search index")
+    add_backend_arguments(subparser)
+    subparser.add_argument("--batch-size", type=int, default=1000)
+    subparser.add_argument("--concurrency", type=int, default=1)
+    subparser.set_defaults(function=ingest)
+
+    subparser = subparsers.add_parser("sync", help="send the names which changed since the last sync to the index")
+    add_backend_arguments(subparser)
+    subparser.add_argument("--batch-size", type=int, default=1000)
+    subparser.add_argument("--concurrency", type=int, default=1)
+    subparser.add_argument("--cache", help="QueryCache whose affected queries are dropped")
+    subparser.add_argument("--store", help="ResultStore whose affected results are dropped")
+    subparser.add_argument("--dry-run", action="store_true", help="only count the names to be sent")
+    subparser.set_defaults(function=sync)
+
+    subparser = subparsers.add_parser("sweep", help="search the misspelled names on every combination of fields")
+    add_backend_arguments(subparser)
+    subparser.add_argument("--fields", nargs="+", help="fields to be combined, all the name fields by default")
+    subparser.add_argument("--max-fields", type=int, help="maximum number of fields per combination")
+    subparser.add_argument("--concurrency", type=int, default=1)
+    subparser.add_argument("--batch-size", type=int, help="search by blocks through make_search_many")
+    subparser.add_argument("--store", help="SQLite result store, the generated directory is used otherwise")
+    subparser.add_argument("--no-reports", action="store_true", help="do not write the generated reports")
+    subparser.add_argument("--race", action="store_true", help="drop the subsets which cannot beat the leader")
+    subparser.add_argument("--round-size", type=int, default=20, help="number of names per round of the race")
+    subparser.set_defaults(function=sweep)
+
+    subparser = subparsers.add_parser("schema-sweep", help="evaluate variants of the index schema side by side")
+    add_backend_arguments(subparser, ("azure", "elastic", "local"))
+    subparser.add_argument("--grid", required=True,
+                           help='JSON of "definition name.parameter" -> list of values, '
+                                'e.g. {"n-gram_filter.minGram": [3, 4]}')
+    subparser.add_argument("--subsets", nargs="+",
+                           help="combinations of fields joined by -, every field changed by the grid by default")
+    subparser.add_argument("--prefix", default="sweep", help="prefix of the names of the variant indexes")
+    subparser.add_argument("--parallel", type=int, default=2, help="maximum number of variant indexes at once")
+    subparser.add_argument("--concurrency", type=int, default=1)
+    subparser.add_argument("--batch-size", type=int, help="search by blocks through make_search_many")
+    subparser.add_argument("--keep-indexes", action="store_true", help="do not drop the variant indexes")
+    subparser.set_defaults(function=schema_sweep)
+
+    for command, function, description in (("score", score, "calculate the f1 score of every combination"),
+                                           ("plot", plot, "plot the f1 scores")):
+        subparser = subparsers.add_parser(command, help=description)
+        subparser.add_argument("--store", help="SQLite result store, the generated reports are read otherwise")
+        subparser.add_argument("--vectorized", action="store_true", help="calculate the scores with pandas")
+        subparser.set_defaults(function=function)
+    subparsers.choices["score"].add_argument("--top", type=int, default=10)
+    subparsers.choices["plot"].add_argument("--output", help="save the plot to this file instead of showing it")
+
+    subparser = subparsers.add_parser("query", help="search names")
+    add_backend_arguments(subparser)
+    subparser.add_argument("names", nargs="+")
+    subparser.add_argument("--fields", nargs="+", default=["standard_lucene"])
+    subparser.set_defaults(function=query)
+    return parser
+
+
+def main(argv=None):
+    """
+    :param argv: the command line arguments, sys.argv by default
+    :return: the exit code
+    """
+    args = create_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+This file contains a compact in-memory representation of the results of the statistics
+"""
+from array import array
+
+import numpy as np
+
+from constants import Constants
+
+NOT_FOUND = "NOT_FOUND"
+# outcome codes, OUTCOMES[code] is the value of the matching statistics.Result
+TP, FP, TN, FN = range(4)
+OUTCOMES = np.array(["TP", "FP", "TN", "FN"], dtype=object)
+
+
+def classify(expected_ids, retrieved_ids):
+    """
+    This method marks the confusion matrix of many results at once, as Statistics.mark_confusion_matrix does
+    for one: TP if the expected name is found, TN if nothing is expected nor found, FP if another name is found
+    and FN if nothing is found while a name is expected
+    :param expected_ids: array of ids of the expected names (0 is NOT_FOUND)
+    :param retrieved_ids: array of ids of the retrieved names (0 is NOT_FOUND)
+    :return: array of outcome codes (uint8)
+    """
+    expected_ids = np.asarray(expected_ids)
+    retrieved_ids = np.asarray(retrieved_ids)
+    found = retrieved_ids != 0
+    same = expected_ids == retrieved_ids
+    return np.where(same, np.where(found, TP, TN), np.where(found, FP, FN)).astype(np.uint8)
+
+
+class NameTable:
+    """
+    This class interns names: every distinct name is stored once and referenced by an integer id.
+    NOT_FOUND is always id 0. With a base table (e.g. the names of a CompiledCorpus), the names of the base keep
+    their ids and are looked up in it on demand, only the other names are stored here
+    """
+
+    def __init__(self, base=None):
+        """
+        :param base: optional StringTable whose id 0 is NOT_FOUND
+        """
+        self.base = base
+        self.offset = len(base) if base is not None else 0
+        self.ids = {NOT_FOUND: 0}
+        self.names = [] if base is not None else [NOT_FOUND]
+        self.name_array = None
+
+    def intern(self, name):
+        """
+        :param name:
+        :return: the id of a name, a new id is assigned to an unknown name
+        """
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = self.base.get_id(name) if self.base is not None else None
+            if name_id is None:
+                name_id = self.offset + len(self.names)
+                self.names.append(name)
+            self.ids[name] = name_id
+        return name_id
+
+    def intern_all(self, names):
+        """
+        :param names: iterable of names
+        :return: array of the ids of the names (int32)
+        """
+        ids = array('i', (self.intern(name) for name in names))
+        return np.frombuffer(ids, dtype=np.int32) if ids else np.zeros(0, dtype=np.int32)
+
+    def lookup(self, ids):
+        """
+        :param ids: array of ids
+        :return: array of the names of the ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.base is not None:
+            return np.array([self.base[name_id] if name_id < self.offset else self.names[name_id - self.offset]
+                             for name_id in ids.tolist()], dtype=object)
+        if self.name_array is None or len(self.name_array) != len(self.names):
+            self.name_array = np.array(self.names, dtype=object)
+        return self.name_array[ids]
+
+
+class CompactResults:
+    """
+    This class keeps the results of every subset in memory as two arrays: the ids of the retrieved names (int32)
+    and the outcome codes (uint8), about 5 bytes per query. The expected names are interned once for all subsets.
+    It has the same get_counts and get_rows methods as ResultStore, so it can be passed to Statistics.generate_f1
+    """
+
+    def __init__(self, correct_list, names=None):
+        """
+        :param correct_list: list of correct items. If it holds the ids of the base table of names
+        (CompiledCorpus.get_expected_rows), they are used as they are
+        :param names: the NameTable to intern the names with, a new one by default
+        """
+        self.names = names or NameTable()
+        if self.names.base is not None and getattr(correct_list, "table", None) is self.names.base:
+            self.expected_ids = correct_list.ids
+        else:
+            self.expected_ids = self.names.intern_all(item[0] for item in correct_list)
+        self.retrieved_ids = {}
+        self.codes = {}
+
+    def add(self, subset, positions, retrieved_ids):
+        """
+        This method classifies and stores the results of queries of a subset
+        :param subset: tuple of fields
+        :param positions: array of positions of the misspelled names
+        :param retrieved_ids: array of ids of the retrieved names, in the same order as positions
+        :return: the outcome codes of the added results
+        """
+        subset = tuple(subset)
+        if subset not in self.codes:
+            self.retrieved_ids[subset] = np.zeros(len(self.expected_ids), dtype=np.int32)
+            # results which were not added yet are marked with a code outside of the outcomes
+            self.codes[subset] = np.full(len(self.expected_ids), len(OUTCOMES), dtype=np.uint8)
+        positions = np.asarray(positions, dtype=np.int64)
+        codes = classify(self.expected_ids[positions], retrieved_ids)
+        self.retrieved_ids[subset][positions] = retrieved_ids
+        self.codes[subset][positions] = codes
+        return codes
+
+    def get_rows(self, subset):
+        """
+        This method returns the results of a subset as columns, pd.DataFrame builds the same frame as from rows
+        :param subset: tuple of fields
+        :return: dictionary of the retrieved names, the expected names and the results
+        """
+        subset = tuple(subset)
+        added = self.codes[subset] < len(OUTCOMES)
+        return {Constants.retrieved: self.names.lookup(self.retrieved_ids[subset][added]),
+                Constants.expected: self.names.lookup(self.expected_ids[added]),
+                Constants.result: OUTCOMES[self.codes[subset][added]]}
+
+    def get_counts(self):
+        """
+        This method counts the results of every subset, as Statistics.read_generated_files_to_list does
+        :return: list of dictionaries with fn, tp, tn, fp and fields
+        """
+        statistics = []
+        for subset, codes in self.codes.items():
+            counts = np.bincount(codes, minlength=len(OUTCOMES) + 1)
+            statistics.append({"fn": int(counts[FN]), "tp": int(counts[TP]), "tn": int(counts[TN]),
+                               "fp": int(counts[FP]), "fields": '-'.join(subset)})
+        return statistics
@@ -0,0 +1,245 @@
+"""
+This file contains a compiled, memory-mapped format of the names, the misspelled names and the expected names
+"""
+import csv
+import json
+import os
+
+import numpy as np
+
+from compactresults import NOT_FOUND
+
+FORMAT_VERSION = 1
+
+
+class StringTable:
+    """
+    This class reads strings out of a UTF-8 blob: the string of id i is blob[offsets[i]:offsets[i + 1]].
+    The ids sorted on the bytes of their strings allow a lookup by binary search, so no dictionary of all
+    the strings has to be built. Only the strings which are read are decoded
+    """
+
+    def __init__(self, offsets, blob, order):
+        """
+        :param offsets: array of n + 1 offsets (int64)
+        :param blob: array of the UTF-8 bytes of all the strings (uint8)
+        :param order: array of the ids sorted on their strings (int32)
+        """
+        self.offsets = offsets
+        self.blob = blob
+        self.order = order
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, string_id):
+        return self.get_bytes(string_id).decode("utf-8")
+
+    def get_bytes(self, string_id):
+        """
+        :param string_id:
+        :return: the UTF-8 bytes of a string
+        """
+        return self.blob[self.offsets[string_id]:self.offsets[string_id + 1]].tobytes()
+
+    def get_id(self, string):
+        """
+        :param string:
+        :return: the id of a string, None if it is not in the table
+        """
+        key = string.encode("utf-8")
+        low, high = 0, len(self.order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_bytes(self.order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.order) and self.get_bytes(self.order[low]) == key:
+            return int(self.order[low])
+        return None
+
+
+class CorpusRows:
+    """
+    This class is a read only list of names by id, each item is a row with a single name as read by Utils.read_csv,
+    so it can replace the lists of names passed to Statistics.calculate_statistics. The names are decoded on access
+    """
+
+    def __init__(self, table, ids):
+        """
+        :param table: the StringTable of the names
+        :param ids: array of name ids
+        """
+        self.table = table
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        return (self.table[self.ids[position]],)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class CompiledCorpus:
+    """
+    This class memory-maps a corpus compiled by CompiledCorpus.build: one table of all the distinct names
+    (id 0 is NOT_FOUND, as in NameTable), the ids of the indexed names (names.csv), of the misspelled names and,
+    at the same positions, of their expected names. The arrays are numpy files loaded with mmap_mode, so loading
+    a corpus of millions of names reads nothing but its manifest, and the pages are shared between processes
+    """
+
+    def __init__(self, directory=os.path.join("cache", "corpus")):
+        """
+        :param directory: the directory the corpus was built in
+        """
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json"), 'r') as a_file:
+            self.manifest = json.load(a_file)
+        if self.manifest.get("version") != FORMAT_VERSION:
+            raise ValueError("the corpus {} has an unknown format, build it again".format(directory))
+        self.names = StringTable(self.load("offsets"), self.load("blob"), self.load("order"))
+        self.indexed_ids = self.load("indexed")
+        self.misspelled_ids = self.load("misspelled")
+        self.expected_ids = self.load("expected")
+
+    def load(self, array_name):
+        """
+        :param array_name:
+        :return: the memory-mapped array
+        """
+        return np.load(os.path.join(self.directory, array_name + ".npy"), mmap_mode="r")
+
+    @classmethod
+    def load_or_build(cls, directory=os.path.join("cache", "corpus"), resources_path="resources", **kwargs):
+        """
+        This method loads a corpus, which is (re)built first if it is missing or older than its CSV files
+        :param directory:
+        :param resources_path:
+        :param kwargs: the file names passed to build
+        :return: the corpus
+        """
+        if os.path.isfile(os.path.join(directory, "manifest.json")):
+            corpus = cls(directory)
+            if not corpus.is_stale():
+                return corpus
+        cls.build(directory, resources_path, **kwargs)
+        return cls(directory)
+
+    @staticmethod
+    def build(directory=os.path.join("cache", "corpus"), resources_path="resources", names_file="names.csv",
+              expected_file="names-expected.csv", misspelled_file="names-misspelled.csv", pairs_file=None):
+        """
+        This method compiles the CSV files of the resources into a corpus directory.
+        The misspelled names are mapped to their expected names either line by line (misspelled_file and
+        expected_file must have the same number of lines), or by the rows (misspelled, expected) of pairs_file
+        :param directory:
+        :param resources_path:
+        :param names_file: the indexed names
+        :param expected_file: the expected names
+        :param misspelled_file: the misspelled names
+        :param pairs_file: optional CSV file of (misspelled, expected) rows, replacing the two files above
+        :return: the manifest of the corpus
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        ids = {NOT_FOUND: 0}
+        encoded = [NOT_FOUND.encode("utf-8")]
+
+        def intern(name):
+            name_id = ids.get(name)
+            if name_id is None:
+                name_id = ids[name] = len(encoded)
+                encoded.append(name.encode("utf-8"))
+            return name_id
+
+        def read_column(filename, column=0):
+            with open(os.path.join(resources_path, filename), 'r') as a_file:
+                return [intern(row[column]) for row in csv.reader(a_file)]
+
+        indexed = list(dict.fromkeys(read_column(names_file)))
+        if pairs_file is not None:
+            misspelled = read_column(pairs_file, 0)
+            expected = read_column(pairs_file, 1)
+            sources = [names_file, pairs_file]
+        else:
+            misspelled = read_column(misspelled_file)
+            expected = read_column(expected_file)
+            sources = [names_file, misspelled_file, expected_file]
+            if len(misspelled) != len(expected):
+                raise ValueError("{} has {} names but {} has {}, they must be aligned line by line".format(
+                    misspelled_file, len(misspelled), expected_file, len(expected)))
+
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=offsets[1:])
+        arrays = {"offsets": offsets,
+                  "blob": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+                  "order": np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int32),
+                  "indexed": np.array(indexed, dtype=np.int32),
+                  "misspelled": np.array(misspelled, dtype=np.int32),
+                  "expected": np.array(expected, dtype=np.int32)}
+        for array_name, values in arrays.items():
+            temporary = os.path.join(directory, array_name + ".tmp.npy")
+            np.save(temporary, values)
+            os.replace(temporary, os.path.join(directory, array_name + ".npy"))
+        manifest = {"version": FORMAT_VERSION,
+                    "resources_path": os.path.abspath(resources_path),
+                    "sources": {filename: os.stat(os.path.join(resources_path, filename)).st_mtime_ns
+                                for filename in sources},
+                    "names": len(encoded),
+                    "indexed": len(indexed),
+                    "misspelled": len(misspelled)}
+        # the manifest is written last, a corpus without manifest is incomplete
+        temporary = os.path.join(directory, "manifest.json.tmp")
+        with open(temporary, 'w') as a_file:
+            json.dump(manifest, a_file)
+        os.replace(temporary, os.path.join(directory, "manifest.json"))
+        return manifest
+
+    def is_stale(self):
+        """
+        :return: True if one of the CSV files the corpus was built from changed since
+        """
+        resources_path = self.manifest["resources_path"]
+        for filename, modified in self.manifest["sources"].items():
+            path = os.path.join(resources_path, filename)
+            if not os.path.isfile(path) or os.stat(path).st_mtime_ns != modified:
+                return True
+        return False
+
+    def get_name(self, name_id):
+        """
+        :param name_id:
+        :return: the name of an id
+        """
+        return self.names[name_id]
+
+    def get_id(self, name):
+        """
+        :param name:
+        :return: the id of a name, None if it is not in the corpus
+        """
+        return self.names.get_id(name)
+
+    def iter_indexed_names(self):
+        """
+        :return: an iterator of the names to be indexed, each name once
+        """
+        return (self.names[name_id] for name_id in self.indexed_ids)
+
+    def get_misspelled_rows(self):
+        """
+        :return: the misspelled names, in place of Utils.read_csv("names-misspelled.csv")
+        """
+        return CorpusRows(self.names, self.misspelled_ids)
+
+    def get_expected_rows(self):
+        """
+        :return: the expected names of the misspelled names, in place of Utils.read_csv("names-expected.csv")
+        """
+        return CorpusRows(self.names, self.expected_ids)
@@ -0,0 +1,126 @@
+"""
+This file contains methods to evaluate every combination of fields from per field search results
+"""
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import Utils
+
+
+class DecomposedSearch:
+    """
+    This class queries each misspelled name once per single field and derives the result of any
+    combination of fields offline.
+    A full query on several searchFields is a disjunction of the same query on every field, so the
+    score of a document for a combination of fields is the sum of its scores on each field.
+    Only the top_k hits per field are kept, hence documents ranked lower on every field are missed.
+    It implements make_search, so it can be passed as search engine to Statistics.calculate_statistics
+    """
+
+    def __init__(self, search_engine, fields, index_name="test", top_k=50):
+        """
+        :param search_engine: the target src engine, it must implement make_search_hits
+        :param fields: the single fields to be queried
+        :param index_name:
+        :param top_k: number of hits retrieved per name and field
+        """
+        self.search_engine = search_engine
+        self.fields = list(fields)
+        self.index_name = index_name
+        self.top_k = top_k
+        self.hits = {}
+        self.queries = 0
+
+    def collect(self, misspelled_list, concurrency=1):
+        """
+        This method queries every misspelled name on every single field and stores the hits
+        :param misspelled_list: list of misspelled items
+        :param concurrency: maximum number of queries in flight at the same time
+        """
+        pending = [(item[0], field) for item in misspelled_list for field in self.fields
+                   if field not in self.hits.get(item[0], {})]
+
+        def search(pair):
+            return self.search_engine.make_search_hits(pair[0], [pair[1]], self.index_name, self.top_k)
+
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(search, pending))
+        else:
+            results = [search(pair) for pair in pending]
+        for (name, field), hits in zip(pending, results):
+            self.hits.setdefault(name, {})[field] = hits
+        self.queries += len(pending)
+
+    def make_search(self, misspelled_name, fields, index_name=None):
+        """
+        This method returns the top ranked name for a combination of fields from the stored hits
+        :param misspelled_name:
+        :param fields:
+        :param index_name: ignored, the hits were collected from the index given to the constructor
+        :return: a name with the maximum summed score or NOT_FOUND otherwise
+        """
+        field_hits = self.hits[misspelled_name]
+        scores = {}
+        for field in fields:
+            for name, score in field_hits[field]:
+                scores[name] = scores.get(name, 0) + score
+        score = 0
+        found_name = "NOT_FOUND"
+        for name, name_score in scores.items():
+            if name_score > score:
+                score = name_score
+                found_name = name
+        return found_name
+
+    def measure_agreement(self, misspelled_list, subsets, sample_size=100, seed=0):
+        """
+        This method sends a sample of real multi field queries and compares them with the offline results
+        :param misspelled_list: list of misspelled items (already collected)
+        :param subsets: combinations of fields to sample from, single fields are skipped
+        :param sample_size: number of (name, subset) pairs to be checked
+        :param seed: seed of the sampling
+        :return: dictionary with the number of sampled queries, agreements and the agreement ratio
+        """
+        candidates = [subset for subset in subsets if len(subset) > 1]
+        if not candidates:
+            sample_size = 0
+        generator = random.Random(seed)
+        agreements = 0
+        disagreements = []
+        for _ in range(sample_size):
+            name = generator.choice(misspelled_list)[0]
+            subset = list(generator.choice(candidates))
+            expected = self.search_engine.make_search(name, subset, self.index_name)
+            offline = self.make_search(name, subset)
+            if expected == offline:
+                agreements += 1
+            else:
+                disagreements.append({"query": name, "fields": "-".join(subset),
+                                      "service": expected, "offline": offline})
+        return {"sampled": sample_size,
+                "agreements": agreements,
+                "agreement": agreements / sample_size if sample_size else -1,
+                "disagreements": disagreements}
+
+    def save(self, file_name, directory="cache"):
+        """
+        This method writes the collected hits to a json file
+        :param file_name:
+        :param directory:
+        """
+        Utils(directory).write_json_to_directory(self.hits, file_name, directory)
+
+    def load(self, file_name, directory="cache"):
+        """
+        This method loads hits written by save
+        :param file_name:
+        :param directory:
+        """
+        with open(os.path.join(directory, file_name + '.json'), 'r') as a_file:
+            hits = json.load(a_file)
+        for name, field_hits in hits.items():
+            self.hits.setdefault(name, {}).update(
+                {field: [tuple(hit) for hit in field_hit] for field, field_hit in field_hits.items()})
@@ -0,0 +1,298 @@
+"""
+This file contains methods to communicate with elastic search
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from itertools import islice
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from searchbackend import SearchBackend
+from utils import Utils
+
+LOGGER = logging.getLogger(__name__)
+
+# azure src tokenizers and analyzers and their elastic search counterpart
+ELASTIC_TOKENIZERS = {
+    "standard": "standard",
+    "standard_v2": "standard",
+    "classic": "classic",
+    "keyword": "keyword",
+    "keyword_v2": "keyword",
+    "letter": "letter",
+    "whitespace": "whitespace",
+    "uax_url_email": "uax_url_email",
+}
+ELASTIC_ANALYZERS = {
+    "standard.lucene": "standard",
+    "en.lucene": "english",
+    "en.microsoft": "english",
+    "keyword": "keyword",
+    "simple": "simple",
+    "stop": "stop",
+    "whitespace": "whitespace",
+}
+ELASTIC_TOKEN_FILTERS = {
+    "lowercase": "lowercase",
+    "asciifolding": "asciifolding",
+    # the phonetic token filter needs the analysis-phonetic plugin
+    "phonetic": {"type": "phonetic", "encoder": "metaphone"},
+}
+
+
+def create_elastic_index(schema):
+    """
+    This method translates an azure src index schema to the settings and mappings of an elastic search index.
+    Custom analyzers keep their tokenizer and token filters, pattern analyzers keep their (java) pattern,
+    predefined analyzers are replaced by the closest elastic search analyzer and the microsoft stemming
+    tokenizer by the standard tokenizer followed by an english stemmer
+    :param schema: the index schema (resources/index-schema.json)
+    :return: body of the index creation request
+    """
+    filters = {}
+    max_ngram_diff = 1
+    for definition in schema.get("tokenFilters", []):
+        filter_type = definition["@odata.type"]
+        if "NGram" in filter_type:
+            min_gram = definition.get("minGram", 1)
+            max_gram = definition.get("maxGram", 2)
+            filters[definition["name"]] = {"type": "edge_ngram" if "EdgeNGram" in filter_type else "ngram",
+                                           "min_gram": min_gram, "max_gram": max_gram}
+            if "EdgeNGram" not in filter_type:
+                max_ngram_diff = max(max_ngram_diff, max_gram - min_gram)
+        elif "Phonetic" in filter_type:
+            # doubleMetaphone -> double_metaphone
+            encoder = re.sub(r"(?<=[a-z])(?=[A-Z])", "_", definition.get("encoder", "metaphone")).lower()
+            filters[definition["name"]] = {"type": "phonetic", "encoder": encoder,
+                                           "replace": definition.get("replace", True)}
+        else:
+            raise ValueError("token filter {} is not supported".format(filter_type))
+    stemming_tokenizers = {definition["name"] for definition in schema.get("tokenizers", [])
+                           if "Stemming" in definition["@odata.type"]}
+    if stemming_tokenizers:
+        filters["english_stemmer"] = {"type": "stemmer", "language": "english"}
+
+    analyzers = {}
+    for definition in schema.get("analyzers", []):
+        if "PatternAnalyzer" in definition["@odata.type"]:
+            analyzer = {"type": "pattern", "pattern": definition.get("pattern", r"\W+"),
+                        "lowercase": definition.get("lowercase", True)}
+            if definition.get("flags"):
+                analyzer["flags"] = definition["flags"]
+            analyzers[definition["name"]] = analyzer
+            continue
+        token_filters = []
+        for name in definition.get("tokenFilters", []):
+            if name in filters:
+                token_filters.append(name)
+            elif isinstance(ELASTIC_TOKEN_FILTERS[name], dict):
+                filters[name] = ELASTIC_TOKEN_FILTERS[name]
+                token_filters.append(name)
+            else:
+                token_filters.append(ELASTIC_TOKEN_FILTERS[name])
+        tokenizer = definition["tokenizer"]
+        if tokenizer in stemming_tokenizers:
+            tokenizer = "standard"
+            token_filters = ["lowercase", "english_stemmer"] + token_filters
+        else:
+            tokenizer = ELASTIC_TOKENIZERS[tokenizer]
+        analyzers[definition["name"]] = {"type": "custom", "tokenizer": tokenizer, "filter": token_filters}
+
+    properties = {}
+    for field in schema["fields"]:
+        if field.get("key") or not field.get("searchable"):
+            properties[field["name"]] = {"type": "keyword"}
+            continue
+        index_analyzer = field.get("analyzer") or field.get("indexAnalyzer") or "standard.lucene"
+        search_analyzer = field.get("analyzer") or field.get("searchAnalyzer") or index_analyzer
+        mapping = {"type": "text", "analyzer": ELASTIC_ANALYZERS.get(index_analyzer, index_analyzer)}
+        if search_analyzer != index_analyzer:
+            mapping["search_analyzer"] = ELASTIC_ANALYZERS.get(search_analyzer, search_analyzer)
+        properties[field["name"]] = mapping
+
+    return {"settings": {"index": {"max_ngram_diff": max_ngram_diff},
+                         "analysis": {"analyzer": analyzers, "filter": filters}},
+            "mappings": {"properties": properties}}
+
+
+class ElasticSearchClient(SearchBackend):
+    """
+    This class contains methods to communicate with elastic search. The index is created from the azure src
+    schema, documents are inserted through _bulk and batches of queries are sent through _msearch,
+    so a whole block of (name, fields) queries costs a single request
+    """
+
+    def __init__(self, endpoint=None, metrics=None):
+        """
+        :param endpoint: base url of the cluster, the elastic endpoint of resources/config.yml by default
+        :param metrics: optional QueryMetrics, if given the latency and payload sizes of every query are recorded
+        """
+        self.utils = Utils(os.path.join("resources"))
+        self.config = self.utils.get_config()
+        elastic_config = self.config.get("elastic") or {}
+        self.endpoint = (endpoint or elastic_config.get("endpoint") or "http://localhost:9200").rstrip("/") + "/"
+        self.msearch_size = elastic_config.get("msearch_size", 100)
+        http_config = self.config.get("http") or {}
+        self.pool_size = http_config.get("pool_size", 10)
+        self.timeout = http_config.get("timeout", 30)
+        self.max_retries = http_config.get("max_retries", 5)
+        self.backoff_factor = http_config.get("backoff_factor", 0.5)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if elastic_config.get("username"):
+            self.session.auth = (elastic_config["username"], elastic_config.get("password") or "")
+        self.metrics = metrics
+        self.schemas = {}
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def send_request(self, method, path, body=None, ndjson=None):
+        """
+        This method sends a request through the pooled session. Rejected (429) and unavailable (5xx)
+        responses and connection errors are retried with exponential backoff (SearchBackend.send_with_retries)
+        :param method: http method (e.g. POST, PUT)
+        :param path: path of the request, relative to the endpoint
+        :param body: json body of the request
+        :param ndjson: list of json lines, the body of _bulk and _msearch requests
+        :return: the response of the last attempt
+        """
+        url = self.endpoint + path
+        if ndjson is not None:
+            data = "".join(json.dumps(line) + "\n" for line in ndjson).encode("utf-8")
+            headers = {"Content-Type": "application/x-ndjson"}
+        else:
+            data = json.dumps(body).encode("utf-8") if body is not None else None
+            headers = {"Content-Type": "application/json"}
+        return self.send_with_retries(method, url, data=data, headers=headers)
+
+    def create_index(self, index_name="test", schema=None):
+        """
+        this method (re)creates an index from the schema file (resources/index-schema.json)
+        :param index_name:
+        :param schema: the azure src index schema, resources/index-schema.json by default
+        :return: the settings and mappings of the index
+        """
+        schema = schema or self.utils.read_json_from_resources("index-schema.json")
+        body = create_elastic_index(schema)
+        self.delete_index(index_name)
+        self.schemas[index_name] = schema
+        response = self.send_request("PUT", index_name, body)
+        if not response.ok:
+            raise Exception("index {} could not be created: {}".format(index_name, response.text))
+        return body
+
+    def delete_index(self, index_name="test"):
+        """
+        this method drops an index if it exists
+        :param index_name:
+        """
+        self.send_request("DELETE", index_name)
+        self.schemas.pop(index_name, None)
+
+    def insert_documents(self, index_name="test", batch_size=1000, names=None):
+        """
+        This method inserts the names of names.csv into an index through _bulk, batch_size documents per request.
+        The documents are the ones inserted into azure src, so their ids are the same
+        :param index_name:
+        :param batch_size: number of documents per request
+        :param names: optional iterable of names inserted instead of the ones of names.csv
+        :return: the status of every document and the number of succeeded and failed documents
+        """
+        return self.index_documents(index_name, self.iter_documents(names=names, schema=self.get_schema(index_name)),
+                                    batch_size)
+
+    def index_documents(self, index_name, documents, batch_size=1000):
+        """
+        This method sends documents with their azure src action through _bulk, batch_size documents per request.
+        upload and mergeOrUpload replace the whole document, delete removes it (a missing document is not a failure)
+        :param index_name:
+        :param documents: iterable of documents, each with its @search.action
+        :param batch_size: number of documents per request
+        :return: the status of every document and the number of succeeded and failed documents
+        """
+        documents = iter(documents)
+        statuses = []
+        for batch in iter(lambda: list(islice(documents, batch_size)), []):
+            lines = []
+            for document in batch:
+                if document.get("@search.action") == "delete":
+                    lines.append({"delete": {"_index": index_name, "_id": document["id"]}})
+                    continue
+                source = {key: value for key, value in document.items() if key not in ("@search.action", "id")}
+                lines.append({"index": {"_index": index_name, "_id": document["id"]}})
+                lines.append(source)
+            response = self.send_request("POST", "_bulk", ndjson=lines)
+            if not response.ok:
+                statuses.extend({"key": document["id"], "status": False, "statusCode": response.status_code,
+                                 "errorMessage": response.text} for document in batch)
+                continue
+            for item in response.json()["items"]:
+                action, result = next(iter(item.items()))
+                status = result["status"] < 300 or (action == "delete" and result["status"] == 404)
+                statuses.append({"key": result["_id"], "status": status, "statusCode": result["status"],
+                                 "errorMessage": (result.get("error") or {}).get("reason")})
+        # make the documents visible to the next searches
+        self.send_request("POST", index_name + "/_refresh")
+        succeeded = sum(1 for status in statuses if status["status"])
+        return {"value": statuses, "succeeded": succeeded, "failed": len(statuses) - succeeded}
+
+    def make_search(self, misspelled_name, fields, index_name="test"):
+        """
+        this method queries an elastic search index
+        :param misspelled_name:
+        :param fields:
+        :param index_name:
+        :return: a name with the maximum rank or NOT_FOUND otherwise
+        """
+        body = self.utils.create_elastic_search_body(misspelled_name, fields, 1, ["standard_lucene"])
+        start = time.perf_counter()
+        response = self.send_request("POST", index_name + "/_search", body)
+        client_latency = time.perf_counter() - start
+        LOGGER.debug("search %s -> %s in %.1f ms", body, response.status_code, client_latency * 1000)
+        if not response.ok:
+            raise Exception("search of {} failed: {}".format(misspelled_name, response.text))
+        result = response.json()
+        if self.metrics is not None:
+            self.metrics.record(fields, client_latency, result.get("took", 0) / 1000,
+                                len(response.request.body or b""), len(response.content))
+        return self.utils.get_maximum_rank_from_elastic_search_json(result)
+
+    def make_search_many(self, queries, index_name="test"):
+        """
+        this method sends many independent queries through _msearch, msearch_size queries per request
+        :param queries: list of (misspelled name, fields)
+        :param index_name:
+        :return: list of names with the maximum rank (or NOT_FOUND), in the same order as queries
+        """
+        found_names = []
+        queries = iter(queries)
+        for block in iter(lambda: list(islice(queries, self.msearch_size)), []):
+            lines = []
+            for name, fields in block:
+                lines.append({"index": index_name})
+                lines.append(self.utils.create_elastic_search_body(name, fields, 1, ["standard_lucene"]))
+            start = time.perf_counter()
+            response = self.send_request("POST", "_msearch", ndjson=lines)
+            client_latency = time.perf_counter() - start
+            LOGGER.debug("msearch of %s queries -> %s in %.1f ms",
+                         len(block), response.status_code, client_latency * 1000)
+            if not response.ok:
+                raise Exception("msearch failed: {}".format(response.text))
+            results = response.json()["responses"]
+            for (name, fields), result in zip(block, results):
+                if "error" in result:
+                    raise Exception("search of {} failed: {}".format(name, result["error"]))
+                if self.metrics is not None:
+                    # the cost of the request is shared by its queries
+                    self.metrics.record(fields, client_latency / len(block), result.get("took", 0) / 1000,
+                                        len(response.request.body or b"") / len(block),
+                                        len(response.content) / len(block))
+                found_names.append(self.utils.get_maximum_rank_from_elastic_search_json(result))
+        return found_names
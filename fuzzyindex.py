@@ -0,0 +1,334 @@
+"""
+This file contains an in-process index to disambiguate misspelled names without a search service
+"""
+import math
+import os
+import re
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from analyzers import ascii_folding, metaphone
+from utils import Utils
+
+NON_ALPHANUMERIC = re.compile(r"[^a-z0-9 ]+")
+
+
+def normalize(name):
+    """
+    This method lower cases and ascii folds a name, removes its punctuation and collapses its spaces
+    (Tom O'halleran -> tom ohalleran, Sidney Mc. Elree -> sidney mc elree)
+    :param name:
+    :return: the normalized name
+    """
+    folded = ascii_folding([name.lower()])[0]
+    return " ".join(NON_ALPHANUMERIC.sub("", folded.replace("-", " ")).split())
+
+
+def get_pattern(first):
+    """
+    :param first: a string
+    :return: dictionary of character -> bit mask of its positions in the string, as edit_distance uses it
+    """
+    pattern = {}
+    for i, char in enumerate(first):
+        pattern[char] = pattern.get(char, 0) | (1 << i)
+    return pattern
+
+
+def edit_distance(first, second, maximum, pattern=None):
+    """
+    This method calculates the Damerau-Levenshtein (optimal string alignment) distance of two strings.
+    The columns of the matrix are encoded as bit vectors (Hyyrö's bit-parallel algorithm), so each character
+    of second costs a few integer operations whatever the length of first
+    :param first:
+    :param second:
+    :param maximum: the distance is capped at maximum + 1
+    :param pattern: get_pattern(first), if it is compared to many strings
+    :return: the distance, or maximum + 1 if it is larger than maximum
+    """
+    if abs(len(first) - len(second)) > maximum:
+        return maximum + 1
+    if first == second:
+        return 0
+    if not first:
+        return min(len(second), maximum + 1)
+    pattern = get_pattern(first) if pattern is None else pattern
+    mask = (1 << len(first)) - 1
+    last = 1 << (len(first) - 1)
+    positive, negative, matches, previous = mask, 0, 0, 0
+    distance = len(first)
+    for char in second:
+        equal = pattern.get(char, 0)
+        transposed = ((~matches & equal) << 1) & previous
+        matches = ((((equal & positive) + positive) ^ positive) | equal | negative | transposed) & mask
+        horizontal_positive = negative | (~(matches | positive) & mask)
+        horizontal_negative = matches & positive
+        if horizontal_positive & last:
+            distance += 1
+        elif horizontal_negative & last:
+            distance -= 1
+        horizontal_positive = ((horizontal_positive << 1) | 1) & mask
+        horizontal_negative = (horizontal_negative << 1) & mask
+        positive = horizontal_negative | (~(matches | horizontal_positive) & mask)
+        negative = matches & horizontal_positive
+        previous = equal
+    return min(distance, maximum + 1)
+
+
+def similarity(first, second, pattern=None):
+    """
+    :param pattern: get_pattern(first), if it is compared to many strings
+    :return: 1 - edit distance / length of the longest string
+    """
+    longest = max(len(first), len(second))
+    if longest == 0:
+        return 1.0
+    return 1.0 - edit_distance(first, second, longest, pattern) / longest
+
+
+class FuzzyNameIndex:
+    """
+    This class finds the names closest to a misspelled name. Candidates are generated per token from
+    a symmetric delete index (the deletes of every indexed token up to max_edit_distance, as SymSpell does)
+    and from the metaphone code of the token. Adjacent query tokens are also looked up joined together,
+    so that "Mc Elree" finds "McElree". Candidates are ranked on the matched tokens weighted by their idf,
+    then the best ones are re-ranked on the similarity of the whole names.
+    The matches of the last memo_size query tokens are memoized, the least recently used are evicted.
+    It implements make_search, so it can be passed as search engine to Statistics.calculate_statistics
+    """
+
+    def __init__(self, names=(), max_edit_distance=2, prefix_length=7, min_score=0.5, rerank=5, max_candidates=64,
+                 memo_size=100000):
+        """
+        :param names: the names to be indexed
+        :param max_edit_distance: maximum edit distance between a query token and an indexed token
+        :param prefix_length: only the deletes of this many first characters of a token are indexed
+        :param min_score: make_search returns NOT_FOUND below this score
+        :param rerank: number of candidates re-ranked on the similarity of the whole names
+        :param max_candidates: the deletes of a query token are looked up, closest first, until this many
+        indexed tokens are found
+        :param memo_size: number of query tokens whose matches are memoized
+        """
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        self.min_score = min_score
+        self.rerank = rerank
+        self.max_candidates = max_candidates
+        self.memo_size = memo_size
+        self.names = []
+        self.normalized = []
+        self.token_names = defaultdict(list)
+        self.deletes = defaultdict(set)
+        self.phonetic_tokens = defaultdict(set)
+        self.token_matches = OrderedDict()
+        self.token_arrays = {}
+        self.lock = threading.Lock()
+        self.buffers = threading.local()
+        self.add_names(names)
+
+    @classmethod
+    def from_csv(cls, filename="names.csv", resources_path="resources", **kwargs):
+        """
+        This method builds an index from the names of a CSV file
+        :param filename:
+        :param resources_path:
+        :return: the index
+        """
+        names = [token[0] for token in Utils(os.path.join(resources_path)).iter_csv(filename)]
+        return cls(names, **kwargs)
+
+    @classmethod
+    def from_corpus(cls, corpus, **kwargs):
+        """
+        This method builds an index from the indexed names of a CompiledCorpus
+        :param corpus:
+        :return: the index
+        """
+        return cls(corpus.iter_indexed_names(), **kwargs)
+
+    def get_deletes(self, token, maximum=None):
+        """
+        This method returns the strings obtained by deleting up to maximum characters of a token prefix
+        :param token:
+        :param maximum: maximum number of deleted characters, max_edit_distance by default
+        :return: set of deletes, including the prefix itself
+        """
+        return set(self.iter_deletes(token, maximum))
+
+    def iter_deletes(self, token, maximum=None):
+        """
+        This method yields the deletes of a token prefix by increasing number of deleted characters
+        :param token:
+        :param maximum: maximum number of deleted characters, max_edit_distance by default
+        :return: iterator of deletes, starting with the prefix itself
+        """
+        prefix = token[:self.prefix_length]
+        yield prefix
+        maximum = self.max_edit_distance if maximum is None else maximum
+        deletes = [prefix]
+        for _ in range(min(maximum, len(prefix) - 1)):
+            deletes = list(dict.fromkeys(delete[:i] + delete[i + 1:] for delete in deletes for i in range(len(delete))))
+            yield from deletes
+
+    def add_names(self, names):
+        """
+        This method indexes names
+        :param names:
+        """
+        self.token_matches = OrderedDict()
+        self.token_arrays = {}
+        for name in names:
+            name_id = len(self.names)
+            normalized = normalize(name)
+            self.names.append(name)
+            self.normalized.append(normalized)
+            for token in set(normalized.split()):
+                if token not in self.token_names:
+                    for delete in self.get_deletes(token):
+                        self.deletes[delete].add(token)
+                    self.phonetic_tokens[metaphone(token)].add(token)
+                self.token_names[token].append(name_id)
+
+    def lookup_token(self, token):
+        """
+        This method finds the indexed tokens close to a query token, the matches are memoized per token
+        :param token:
+        :return: dictionary of indexed token -> similarity
+        """
+        with self.lock:
+            matches = self.token_matches.get(token)
+            if matches is not None:
+                self.token_matches.move_to_end(token)
+                return matches
+        matches = self.find_token_matches(token)
+        with self.lock:
+            self.token_matches[token] = matches
+            if len(self.token_matches) > self.memo_size:
+                self.token_matches.popitem(last=False)
+        return matches
+
+    def find_token_matches(self, token):
+        """
+        This method looks up the delete index and the phonetic codes for a query token.
+        The deletes are looked up closest first until max_candidates indexed tokens are found, and the tokens
+        sharing the metaphone code are only kept if they are at least half similar to the query token
+        :param token:
+        :return: dictionary of indexed token -> similarity
+        """
+        maximum = self.max_edit_distance if len(token) > 4 else min(1, self.max_edit_distance)
+        matches = {}
+        candidates = set()
+        for delete in self.iter_deletes(token, maximum):
+            candidates.update(self.deletes.get(delete, ()))
+            if len(candidates) >= self.max_candidates:
+                break
+        pattern = get_pattern(token)
+        for candidate in candidates:
+            if abs(len(candidate) - len(token)) > maximum:
+                continue
+            distance = edit_distance(token, candidate, maximum, pattern)
+            if distance <= maximum:
+                matches[candidate] = 1.0 - distance / max(len(token), len(candidate))
+        code = metaphone(token)
+        if code:
+            for candidate in self.phonetic_tokens.get(code, ()):
+                longest = max(len(token), len(candidate))
+                # an edit distance match always scores higher than the phonetic score of the same token
+                if candidate in matches or abs(len(candidate) - len(token)) > longest // 2:
+                    continue
+                distance = edit_distance(token, candidate, longest // 2, pattern)
+                if distance <= longest // 2:
+                    matches[candidate] = 0.5 * (1.0 - distance / longest) + 0.25
+        return matches
+
+    def get_name_ids(self, token):
+        """
+        :param token: an indexed token
+        :return: array of the ids of the names having the token, memoized
+        """
+        ids = self.token_arrays.get(token)
+        if ids is None:
+            ids = np.array(self.token_names[token], dtype=np.int64)
+            self.token_arrays[token] = ids
+        return ids
+
+    def get_buffers(self):
+        """
+        :return: (scores, positions), arrays over all the indexed names kept per thread and reused by every query.
+        The scores are all zeros between two queries
+        """
+        buffers = getattr(self.buffers, "arrays", None)
+        if buffers is None or len(buffers[0]) < len(self.names):
+            buffers = (np.zeros(len(self.names)), np.zeros(len(self.names), dtype=np.int64))
+            self.buffers.arrays = buffers
+        return buffers
+
+    def get_best_ids(self, ids, weights, count):
+        """
+        This method sums the weights per name and keeps the names with the highest sums.
+        The sums are added in the buffers of the thread, so a query costs the number of its matches
+        and not the number of indexed names
+        :param ids: array of name ids, a name may appear more than once
+        :param weights: array of the weights of the ids
+        :param count: number of names to be kept
+        :return: array of the best name ids, highest sum first and lowest id first on ties
+        """
+        scores, positions = self.get_buffers()
+        np.add.at(scores, ids, weights)
+        # the last occurrence of every id wins, so each distinct id is kept once
+        occurrences = np.arange(len(ids))
+        positions[ids] = occurrences
+        distinct = ids[positions[ids] == occurrences]
+        sums = scores[distinct]
+        scores[ids] = 0
+        if len(distinct) > count:
+            # the ties of the last kept sum are all kept, then ordered on their ids
+            kept = sums >= np.partition(sums, len(sums) - count)[len(sums) - count]
+            distinct, sums = distinct[kept], sums[kept]
+        return distinct[np.lexsort((distinct, -sums))[:count]]
+
+    def disambiguate(self, name, top_k=5):
+        """
+        This method ranks the indexed names by their closeness to a (misspelled) name
+        :param name:
+        :param top_k: number of candidates to be returned, at least top_k candidates are re-ranked
+        :return: list of (name, score) with scores between 0 and 1, best first
+        """
+        normalized = normalize(name)
+        tokens = normalized.split()
+        if not tokens:
+            return []
+        query_tokens = tokens + [first + second for first, second in zip(tokens, tokens[1:])]
+        count = len(self.names)
+        name_ids = []
+        weights = []
+        for token in query_tokens:
+            for match, match_similarity in self.lookup_token(token).items():
+                ids = self.get_name_ids(match)
+                name_ids.append(ids)
+                weights.append(match_similarity * math.log(1 + count / len(ids)))
+        if not name_ids:
+            return []
+        ids = np.concatenate(name_ids)
+        candidates = self.get_best_ids(ids, np.repeat(weights, [len(token_ids) for token_ids in name_ids]),
+                                       max(self.rerank, top_k))
+        compact = normalized.replace(" ", "")
+        pattern = get_pattern(compact)
+        ranked = sorted(((similarity(compact, self.normalized[name_id].replace(" ", ""), pattern), name_id)
+                         for name_id in candidates.tolist()), key=lambda item: (-item[0], item[1]))
+        return [(self.names[name_id], score) for score, name_id in ranked[:top_k]]
+
+    def make_search(self, misspelled_name, fields=None, index_name=None):
+        """
+        This method returns the best candidate of a misspelled name
+        :param misspelled_name:
+        :param fields: ignored, there is a single index
+        :param index_name: ignored, there is a single index
+        :return: the best name or NOT_FOUND if there is no candidate scored at least min_score
+        """
+        candidates = self.disambiguate(misspelled_name, 1)
+        if not candidates or candidates[0][1] < self.min_score:
+            return "NOT_FOUND"
+        return candidates[0][0]
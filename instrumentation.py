@@ -0,0 +1,103 @@
+"""
+This file contains methods to measure the cost of the queries sent to a search engine
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from utils import Utils
+
+# fields the queries of the current context are recorded under instead of their searched fields (see recorded_as)
+RECORDED_FIELDS = contextvars.ContextVar("recorded_fields", default=None)
+
+
+@contextmanager
+def recorded_as(fields):
+    """
+    This method records the queries sent in its context under other fields than the searched ones, e.g. the subsets
+    with the pseudo field of NormalizedSearch, which the search engine never sees. It holds per thread and per
+    asyncio task
+    :param fields: the fields the queries are recorded under
+    """
+    token = RECORDED_FIELDS.set(list(fields))
+    try:
+        yield
+    finally:
+        RECORDED_FIELDS.reset(token)
+
+
+class QueryMetrics:
+    """
+    This class records the client side latency, the service side latency and the payload sizes of every query,
+    grouped by the searched fields, and reports their percentiles and throughput
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def record(self, fields, client_latency, service_latency=None, request_bytes=0, response_bytes=0):
+        """
+        This method records one query
+        :param fields: the searched fields, replaced by the ones of recorded_as in its context
+        :param client_latency: seconds between sending the request and reading the response
+        :param service_latency: seconds spent by the service (elapsed-time header), None if unknown
+        :param request_bytes: size of the request body
+        :param response_bytes: size of the response body
+        """
+        name = '-'.join(RECORDED_FIELDS.get() or fields)
+        now = time.perf_counter()
+        with self.lock:
+            self.samples.setdefault(name, []).append(
+                (client_latency, np.nan if service_latency is None else service_latency, request_bytes, response_bytes))
+            start, _ = self.windows.get(name, (now - client_latency, now))
+            self.windows[name] = (min(start, now - client_latency), now)
+
+    def get_report(self):
+        """
+        This method summarizes the recorded queries per fields
+        :return: list of dictionaries with the fields, the number of queries, the p50/p95/p99 latencies
+        in milliseconds, the mean payload sizes in bytes and the throughput in queries per second
+        """
+        report = []
+        with self.lock:
+            items = [(name, np.array(samples, dtype=float), self.windows[name])
+                     for name, samples in self.samples.items()]
+        for name, samples, (start, end) in items:
+            client = samples[:, 0] * 1000
+            service = samples[:, 1] * 1000
+            stat = {"fields": name, "queries": len(samples)}
+            for percentile in (50, 95, 99):
+                stat["client_p{}".format(percentile)] = float(np.percentile(client, percentile))
+                stat["service_p{}".format(percentile)] = float(np.nanpercentile(service, percentile)) \
+                    if not np.isnan(service).all() else -1
+            stat["request_bytes"] = float(samples[:, 2].mean())
+            stat["response_bytes"] = float(samples[:, 3].mean())
+            stat["throughput"] = len(samples) / (end - start) if end > start else -1
+            report.append(stat)
+        return report
+
+    def add_to_scores(self, scores):
+        """
+        This method adds the latency report of each fields to the scores calculated by Statistics.generate_f1
+        :param scores: list of dictionaries with a fields key
+        :return: the scores
+        """
+        report = {stat["fields"]: stat for stat in self.get_report()}
+        for score in scores:
+            stat = report.get(score["fields"])
+            if stat is not None:
+                score.update({key: value for key, value in stat.items() if key != "fields"})
+        return scores
+
+    def write_report(self, file_name="latency", directory="reports"):
+        """
+        This method writes the latency report to a json file
+        :param file_name:
+        :param directory:
+        """
+        Utils(directory).write_json_to_directory(self.get_report(), file_name, directory)
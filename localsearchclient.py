@@ -0,0 +1,245 @@
+"""
+This file contains an in-process search engine which emulates the azure src index of resources/index-schema.json
+"""
+import math
+import os
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from analyzers import create_field_analyzers
+from searchbackend import SearchBackend
+from utils import Utils
+
+
+class LocalSearchClient(SearchBackend):
+    """
+    This class has the same interface as AzureSearchClient, but the index lives in memory:
+    every field is an inverted index built with the analyzers of the schema and scored with BM25.
+    The documents are the ones of iter_documents, keyed by their ids as in the service, so inserting a name again
+    replaces its document. It needs no search service, so the statistics can be calculated offline.
+    """
+
+    def __init__(self, k1=1.2, b=0.75, memo_size=100000):
+        """
+        :param k1: BM25 term frequency saturation
+        :param b: BM25 document length normalization
+        :param memo_size: number of analyzed (field, query) kept per index
+        """
+        self.utils = Utils(os.path.join("resources"))
+        self.k1 = k1
+        self.b = b
+        self.memo_size = memo_size
+        self.indexes = {}
+        self.schemas = {}
+
+    def create_index(self, index_name="test", schema=None):
+        """
+        this method creates an empty index from a schema
+        :param index_name:
+        :param schema: the index schema, resources/index-schema.json by default
+        :return: the index schema
+        """
+        body = dict(schema) if schema is not None else self.utils.read_json_from_resources("index-schema.json")
+        body["name"] = index_name
+        self.schemas[index_name] = body
+        self.indexes[index_name] = LocalIndex(create_field_analyzers(body), self.k1, self.b, self.memo_size)
+        return body
+
+    def insert_documents(self, index_name="test", names=None):
+        """
+        This method inserts the names of resources/names.csv into an index. A name already in the index
+        replaces its document, as an upload to the service does
+        :param index_name:
+        :param names: optional iterable of names inserted instead of the ones of names.csv
+        :return: status per inserted document, as the service does (201 if created, 200 if replaced)
+        """
+        index = self.indexes[index_name]
+        documents = list(self.iter_documents(names=names, schema=self.get_schema(index_name)))
+        statuses = [{"key": document["id"], "status": True,
+                     "statusCode": 200 if document["id"] in index.documents else 201} for document in documents]
+        index.add_documents((document["id"], document["standard_lucene"]) for document in documents)
+        return {"value": statuses}
+
+    def index_documents(self, index_name, documents):
+        """
+        This method applies documents with their own action to an index: upload and mergeOrUpload
+        replace the document of a name, delete removes it. The postings are rebuilt once
+        :param index_name:
+        :param documents: iterable of documents, each with its @search.action
+        :return: status per document, as the service does
+        """
+        index = self.indexes[index_name]
+        statuses = []
+        for document in documents:
+            if document.get("@search.action") == "delete":
+                index.documents.pop(document["id"], None)
+            else:
+                index.documents[document["id"]] = document["standard_lucene"]
+            statuses.append({"key": document["id"], "status": True, "statusCode": 200})
+        index.add_documents(())
+        return {"value": statuses, "succeeded": len(statuses), "failed": 0}
+
+    def delete_index(self, index_name="test"):
+        """
+        this method drops an index
+        :param index_name:
+        """
+        self.indexes.pop(index_name, None)
+        self.schemas.pop(index_name, None)
+
+    def make_search(self, misspelled_name, fields, index_name="test"):
+        """
+        this method queries the local index
+        :param misspelled_name:
+        :param fields:
+        :param index_name:
+        :return: a name with the maximum rank or NOT_FOUND otherwise
+        """
+        index = self.indexes[index_name]
+        scores = index.score(misspelled_name, fields)
+        if not len(scores):
+            return "NOT_FOUND"
+        best = int(np.argmax(scores))
+        return index.names[best] if scores[best] > 0 else "NOT_FOUND"
+
+    def make_search_many(self, queries, index_name="test"):
+        """
+        this method answers many independent queries at once
+        :param queries: list of (misspelled name, fields)
+        :param index_name:
+        :return: list of names with the maximum rank (or NOT_FOUND), in the same order as queries
+        """
+        return [self.make_search(name, fields, index_name) for name, fields in queries]
+
+    def make_search_hits(self, misspelled_name, fields, index_name="test", top=50):
+        """
+        this method queries the local index and returns the ranked hits instead of the top one
+        :param misspelled_name:
+        :param fields:
+        :param index_name:
+        :param top: maximum number of hits to be returned
+        :return: a list of (name, score)
+        """
+        index = self.indexes[index_name]
+        scores = index.score(misspelled_name, fields)
+        ranked = np.argsort(-scores, kind="stable")[:top]
+        hits = {}
+        for position in ranked:
+            if scores[position] <= 0:
+                break
+            hits.setdefault(index.names[position], float(scores[position]))
+        return list(hits.items())
+
+
+class LocalIndex:
+    """
+    This class holds one inverted index per field. The postings are sparse (the ids and weights of the documents
+    of a term), so a query only adds up the postings of its terms. The analyzed terms of the last memo_size
+    (field, query) are memoized, as the same query is sent to a field once per subset containing it
+    """
+
+    def __init__(self, field_analyzers, k1, b, memo_size=100000):
+        """
+        :param field_analyzers: dictionary of field name -> analyzer function
+        :param k1: BM25 term frequency saturation
+        :param b: BM25 document length normalization
+        :param memo_size: number of analyzed (field, query) kept, the least recently used are evicted
+        """
+        self.field_analyzers = field_analyzers
+        self.k1 = k1
+        self.b = b
+        self.memo_size = memo_size
+        # document id -> name, the position of a document in names is its id in the postings
+        self.documents = {}
+        self.names = []
+        self.postings = {field: {} for field in field_analyzers}
+        self.query_terms = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add_documents(self, documents):
+        """
+        This method adds documents to the index, a document replaces the one with the same id,
+        and rebuilds the postings of every field
+        :param documents: iterable of (document id, name to be indexed in every field)
+        """
+        self.documents.update(documents)
+        self.names = list(self.documents.values())
+        for field, analyzer in self.field_analyzers.items():
+            self.postings[field] = self.build_postings(analyzer)
+
+    def build_postings(self, analyzer):
+        """
+        This method builds the inverted index of a field. Each posting holds the document ids of a term
+        and their BM25 weight (idf and length normalized term frequency), so a query only sums them up
+        :param analyzer:
+        :return: dictionary of term -> (document ids, weights)
+        """
+        term_frequencies = [Counter(analyzer(name)) for name in self.names]
+        lengths = np.array([sum(frequencies.values()) for frequencies in term_frequencies], dtype=float)
+        average_length = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+        documents = {}
+        for document, frequencies in enumerate(term_frequencies):
+            for term, frequency in frequencies.items():
+                documents.setdefault(term, []).append((document, frequency))
+        postings = {}
+        count = len(self.names)
+        for term, entries in documents.items():
+            ids = np.array([entry[0] for entry in entries], dtype=np.int64)
+            frequencies = np.array([entry[1] for entry in entries], dtype=float)
+            idf = math.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+            norms = self.k1 * (1 - self.b + self.b * lengths[ids] / average_length)
+            postings[term] = (ids, idf * frequencies * (self.k1 + 1) / (frequencies + norms))
+        return postings
+
+    def get_query_terms(self, query, field):
+        """
+        This method analyzes a query for a field.
+        As the full lucene query parser does, the query is split on whitespaces before each part is analyzed
+        :param query:
+        :param field:
+        :return: list of terms
+        """
+        key = (field, query)
+        with self.lock:
+            terms = self.query_terms.get(key)
+            if terms is not None:
+                self.query_terms.move_to_end(key)
+                return terms
+        analyzer = self.field_analyzers[field]
+        terms = [term for part in query.split() for term in analyzer(part)]
+        with self.lock:
+            self.query_terms[key] = terms
+            if len(self.query_terms) > self.memo_size:
+                self.query_terms.popitem(last=False)
+        return terms
+
+    def score_field(self, query, field, scores=None):
+        """
+        This method scores every document for a query on a single field
+        :param query:
+        :param field:
+        :param scores: optional array of scores per document the scores are added to
+        :return: array of scores per document
+        """
+        if scores is None:
+            scores = np.zeros(len(self.names))
+        postings = self.postings[field]
+        for term in self.get_query_terms(query, field):
+            posting = postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        return scores
+
+    def score(self, query, fields):
+        """
+        This method scores every document for a query on several fields, the scores of the fields are summed
+        :param query:
+        :param fields:
+        :return: array of scores per document
+        """
+        scores = np.zeros(len(self.names))
+        for field in fields:
+            self.score_field(query, field, scores)
+        return scores
@@ -1,10 +1,19 @@
+import logging
+import os
+
 from azuresearchclient import AzureSearchClient
 from constants import Constants
+from instrumentation import QueryMetrics
 from statistics import Statistics
+from utils import Utils
 
 if __name__ == "__main__":
+    CONFIG = Utils(os.path.join("resources")).get_config()
+    logging.basicConfig(level=(CONFIG.get("logging") or {}).get("level", "INFO"))
+    # latency and payload sizes of every query
+    METRICS = QueryMetrics()
     # Create Search Index
-    AZURE = AzureSearchClient()
+    AZURE = AzureSearchClient(metrics=METRICS)
     # Create Search Index
     AZURE.create_index("index222")
     # insert documents into the search index (corrected spelled names)
@@ -22,5 +31,6 @@ if __name__ == "__main__":
     STATS.calculate_statistics(correct_list, misspelled_list, all_subsets, AZURE, True)
 
     # plot the results
-    SCORES = STATS.generate_f1()
+    SCORES = METRICS.add_to_scores(STATS.generate_f1())
+    METRICS.write_report()
     STATS.create_plot(SCORES)
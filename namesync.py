@@ -0,0 +1,274 @@
+"""
+This file contains a delta synchronization of resources/names.csv into a search index
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+from analyzers import create_field_analyzers
+from utils import Utils
+
+
+def get_fingerprint(document):
+    """
+    :param document: a document, with or without its @search.action
+    :return: the sha1 of the content of the document, so a change of its fields is detected
+    """
+    content = {key: value for key, value in document.items() if key != "@search.action"}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class NameManifest:
+    """
+    This class keeps, per index, the id, the name and the fingerprint of every document the index is known to hold.
+    Only the documents the search engine acknowledged are recorded
+    """
+
+    def __init__(self, path=os.path.join("cache", "manifest.sqlite")):
+        """
+        :param path: path of the SQLite file, its directory is created if it does not exist
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS documents ("
+                                "index_name TEXT NOT NULL, "
+                                "id TEXT NOT NULL, "
+                                "name TEXT NOT NULL, "
+                                "fingerprint TEXT NOT NULL, "
+                                "PRIMARY KEY (index_name, id)) WITHOUT ROWID")
+        self.connection.commit()
+
+    def get_documents(self, index_name):
+        """
+        :param index_name:
+        :return: dictionary of document id -> (name, fingerprint) of an index
+        """
+        return {document_id: (name, fingerprint) for document_id, name, fingerprint in
+                self.connection.execute("SELECT id, name, fingerprint FROM documents WHERE index_name = ?",
+                                        (index_name,))}
+
+    def update(self, index_name, uploaded, deleted):
+        """
+        This method records the documents applied to an index
+        :param index_name:
+        :param uploaded: list of (id, name, fingerprint) of the uploaded documents
+        :param deleted: list of ids of the deleted documents
+        """
+        self.connection.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                                    [(index_name,) + tuple(document) for document in uploaded])
+        self.connection.executemany("DELETE FROM documents WHERE index_name = ? AND id = ?",
+                                    [(index_name, document_id) for document_id in deleted])
+        self.connection.commit()
+
+    def drop(self, index_name):
+        """
+        This method forgets the documents of an index, e.g. after it has been (re)created
+        :param index_name:
+        """
+        self.connection.execute("DELETE FROM documents WHERE index_name = ?", (index_name,))
+        self.connection.commit()
+
+    def count(self, index_name):
+        """
+        :param index_name:
+        :return: number of documents of an index
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM documents WHERE index_name = ?",
+                                       (index_name,)).fetchone()[0]
+
+    def close(self):
+        """
+        This method closes the SQLite connection
+        """
+        self.connection.close()
+
+
+class NameSynchronizer:
+    """
+    This class keeps a search index in line with a CSV of names, sending only what changed since the last sync:
+    the documents of the CSV are compared to the manifest by id (the sha1 of the name) and fingerprint,
+    new and changed documents are sent as mergeOrUpload and the documents which left the CSV as delete.
+    Then only the cached results the changed names can affect are dropped:
+    - the results which retrieved a deleted or changed name
+    - the results of queries sharing a term with an added, changed or deleted name on one of their fields,
+      the terms being produced by the analyzers of the schema (a document only scores for a query it shares
+      a term with). The small shift of the scores of the other documents (average length, idf) is ignored.
+    Results of subsets with a field the schema does not know (e.g. the normalized marker) are all dropped,
+    as their queries are rewritten before they are sent
+    """
+
+    def __init__(self, search_engine, manifest=None, cache=None, result_store=None, misspelled_list=None,
+                 schema=None):
+        """
+        :param search_engine: the target src engine, with index_documents (Azure, Elastic, Local)
+        :param manifest: the NameManifest, cache/manifest.sqlite by default
+        :param cache: optional QueryCache of the search engine
+        :param result_store: optional ResultStore, its affected results are queried again by the next run
+        :param misspelled_list: list of misspelled names the result store positions refer to
+        :param schema: the index schema, resources/index-schema.json by default
+        """
+        self.utils = Utils(os.path.join("resources"))
+        self.search_engine = search_engine
+        self.manifest = manifest or NameManifest()
+        self.cache = cache
+        self.result_store = result_store
+        self.misspelled_list = misspelled_list
+        self.schema = schema or self.utils.read_json_from_resources("index-schema.json")
+        self.field_analyzers = create_field_analyzers(self.schema)
+        self.query_terms = {}
+
+    def plan(self, index_name="test", filename="names.csv"):
+        """
+        This method compares the documents of a CSV file to the manifest of an index
+        :param index_name:
+        :param filename:
+        :return: dictionary with the added and changed documents and the (id, name) of the deleted documents
+        """
+        indexed = self.manifest.get_documents(index_name)
+        added = []
+        changed = []
+        for document in self.search_engine.iter_documents(filename, schema=self.schema):
+            known = indexed.pop(document["id"], None)
+            if known is None:
+                added.append(document)
+            elif known[1] != get_fingerprint(document):
+                changed.append(document)
+        deleted = [(document_id, name) for document_id, (name, _) in indexed.items()]
+        return {"added": added, "changed": changed, "deleted": deleted}
+
+    def sync(self, index_name="test", filename="names.csv", dry_run=False, **kwargs):
+        """
+        This method applies the difference between a CSV file and an index, then invalidates the affected results
+        :param index_name:
+        :param filename:
+        :param dry_run: if true, only the difference is calculated
+        :param kwargs: passed to index_documents of the search engine (e.g. batch_size, concurrency)
+        :return: dictionary with the number of added, changed, deleted and failed documents
+        and of invalidated cached queries and stored results
+        """
+        plan = self.plan(index_name, filename)
+        summary = {"added": len(plan["added"]), "changed": len(plan["changed"]), "deleted": len(plan["deleted"]),
+                   "failed": 0, "invalidated_queries": 0, "invalidated_results": 0}
+        if dry_run or not (plan["added"] or plan["changed"] or plan["deleted"]):
+            return summary
+        documents = [dict(document, **{"@search.action": "mergeOrUpload"})
+                     for document in plan["added"] + plan["changed"]]
+        documents += [{"@search.action": "delete", "id": document_id} for document_id, _ in plan["deleted"]]
+        result = self.search_engine.index_documents(index_name, documents, **kwargs)
+        succeeded = {status["key"] for status in result["value"] if status.get("status")}
+        summary["failed"] = result["failed"]
+        self.manifest.update(index_name,
+                             [(document["id"], document["standard_lucene"], get_fingerprint(document))
+                              for document in plan["added"] + plan["changed"] if document["id"] in succeeded],
+                             [document_id for document_id, _ in plan["deleted"] if document_id in succeeded])
+
+        # a failed document may have been applied all the same, so it is invalidated as well
+        removed = {document["standard_lucene"] for document in plan["changed"]} | {name for _, name in plan["deleted"]}
+        touched = self.get_terms(removed | {document["standard_lucene"] for document in plan["added"]})
+        summary["invalidated_queries"] = self.invalidate_cache(index_name, touched, removed)
+        summary["invalidated_results"] = self.invalidate_results(touched, removed)
+        return summary
+
+    def ingest(self, index_name="test", filename="names.csv", names=None, **kwargs):
+        """
+        This method uploads every name of a CSV file to an index, as insert_documents does, and records the
+        documents the search engine acknowledged in the manifest. The next sync then only sends what changed
+        and deletes the names which left the CSV since
+        :param index_name:
+        :param filename:
+        :param names: optional iterable of names uploaded instead of the ones of the CSV file
+        :param kwargs: passed to index_documents of the search engine (e.g. batch_size, concurrency)
+        :return: the status of every document and the number of succeeded and failed documents
+        """
+        recorded = {}
+
+        def iter_documents():
+            for document in self.search_engine.iter_documents(filename, names=names, schema=self.schema):
+                recorded[document["id"]] = (document["standard_lucene"], get_fingerprint(document))
+                yield document
+
+        result = self.search_engine.index_documents(index_name, iter_documents(), **kwargs)
+        succeeded = {status["key"] for status in result["value"] if status.get("status")}
+        self.manifest.update(index_name, [(document_id,) + recorded[document_id]
+                                          for document_id in succeeded if document_id in recorded], [])
+        if self.cache is not None:
+            self.cache.invalidate(index_name)
+        return result
+
+    def reset(self, index_name="test"):
+        """
+        This method (re)creates an index and forgets its manifest and cached queries,
+        the next sync uploads every name
+        :param index_name:
+        """
+        self.search_engine.create_index(index_name)
+        self.manifest.drop(index_name)
+        if self.cache is not None:
+            self.cache.invalidate(index_name)
+
+    def get_terms(self, names):
+        """
+        :param names:
+        :return: dictionary of field -> set of the terms of the names on that field
+        """
+        return {field: {term for name in names for term in analyzer(name)}
+                for field, analyzer in self.field_analyzers.items()}
+
+    def is_affected(self, query, fields, retrieved, touched, removed):
+        """
+        :param query: the query text
+        :param fields: the searched fields
+        :param retrieved: the cached result of the query
+        :param touched: the terms of the changed names per field
+        :param removed: the deleted and changed names
+        :return: True if the result of the query may differ after the change
+        """
+        if retrieved in removed:
+            return True
+        for field in fields:
+            if field not in self.field_analyzers:
+                return True
+            terms = self.query_terms.get((field, query))
+            if terms is None:
+                # as the full lucene query parser does, the query is split on whitespaces before it is analyzed
+                analyzer = self.field_analyzers[field]
+                terms = {term for part in query.split() for term in analyzer(part)}
+                self.query_terms[(field, query)] = terms
+            if not terms.isdisjoint(touched[field]):
+                return True
+        return False
+
+    def invalidate_cache(self, index_name, touched, removed):
+        """
+        This method drops the cached queries of an index the change may affect
+        :param index_name:
+        :param touched: the terms of the changed names per field
+        :param removed: the deleted and changed names
+        :return: number of dropped queries
+        """
+        if self.cache is None:
+            return 0
+        keys = [(query, search_fields) for query, search_fields, result in self.cache.get_entries(index_name)
+                if self.is_affected(query, search_fields.split(","), result, touched, removed)]
+        return self.cache.delete(index_name, keys)
+
+    def invalidate_results(self, touched, removed):
+        """
+        This method drops the stored results the change may affect, the next run of calculate_statistics
+        queries their names again
+        :param touched: the terms of the changed names per field
+        :param removed: the deleted and changed names
+        :return: number of dropped results
+        """
+        if self.result_store is None or self.misspelled_list is None:
+            return 0
+        invalidated = 0
+        for subset in self.result_store.get_subsets():
+            positions = [position for position, retrieved in self.result_store.get_retrieved(subset)
+                         if self.is_affected(self.misspelled_list[position][0], subset, retrieved, touched, removed)]
+            invalidated += self.result_store.delete(subset, positions)
+        return invalidated
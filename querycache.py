@@ -0,0 +1,177 @@
+"""
+This file contains a disk-backed cache for the results of search queries
+"""
+import os
+import sqlite3
+import threading
+import time
+
+
+class QueryCache:
+    """
+    This class stores the result of a query per (index name, query, searchFields) in a SQLite file,
+    so that repeated evaluations do not send the same query to the search service again.
+    The least recently used entries are evicted when the cache holds more than max_entries.
+    The access times of the hits are kept in memory and the new results are committed every flush_every
+    writes (and on flush or close), so a lookup never waits for the disk
+    """
+
+    def __init__(self, path=os.path.join("cache", "query-cache.sqlite"), max_entries=1000000, flush_every=1000):
+        """
+        :param path: path of the SQLite file, its directory is created if it does not exist
+        :param max_entries: maximum number of cached results
+        :param flush_every: number of hits and new results between two commits
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.accesses = {}
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results ("
+                                "index_name TEXT NOT NULL, "
+                                "query TEXT NOT NULL, "
+                                "search_fields TEXT NOT NULL, "
+                                "result TEXT NOT NULL, "
+                                "last_access REAL NOT NULL, "
+                                "PRIMARY KEY (index_name, query, search_fields))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+        self.connection.commit()
+        self.size = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, index_name, query, search_fields):
+        """
+        This method looks up a cached result
+        :param index_name:
+        :param query: the query text
+        :param search_fields: the searchFields string of the request body
+        :return: the cached result or None if the query has not been cached
+        """
+        key = (index_name, query, search_fields)
+        with self.lock:
+            row = self.connection.execute("SELECT result FROM results "
+                                          "WHERE index_name = ? AND query = ? AND search_fields = ?",
+                                          key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.accesses[key] = time.time()
+            if len(self.accesses) + self.pending >= self.flush_every:
+                self.flush_locked()
+            return row[0]
+
+    def put(self, index_name, query, search_fields, result):
+        """
+        This method stores the result of a query and evicts the least recently used entries
+        if the cache is full
+        :param index_name:
+        :param query: the query text
+        :param search_fields: the searchFields string of the request body
+        :param result: the result of the query
+        """
+        with self.lock:
+            cursor = self.connection.execute("UPDATE results SET result = ?, last_access = ? "
+                                             "WHERE index_name = ? AND query = ? AND search_fields = ?",
+                                             (result, time.time(), index_name, query, search_fields))
+            if cursor.rowcount == 0:
+                self.connection.execute("INSERT INTO results VALUES (?, ?, ?, ?, ?)",
+                                        (index_name, query, search_fields, result, time.time()))
+                self.size += 1
+            self.accesses.pop((index_name, query, search_fields), None)
+            self.pending += 1
+            if self.size > self.max_entries:
+                # the least recently used entries are only known once the access times are written
+                self.write_accesses()
+                overflow = self.size - self.max_entries
+                self.connection.execute("DELETE FROM results WHERE rowid IN "
+                                        "(SELECT rowid FROM results ORDER BY last_access LIMIT ?)",
+                                        (overflow,))
+                self.evictions += overflow
+                self.size -= overflow
+            if len(self.accesses) + self.pending >= self.flush_every:
+                self.flush_locked()
+
+    def write_accesses(self):
+        """
+        This method writes the access times of the hits kept in memory, the caller holds the lock
+        """
+        if self.accesses:
+            self.connection.executemany("UPDATE results SET last_access = ? "
+                                        "WHERE index_name = ? AND query = ? AND search_fields = ?",
+                                        [(accessed,) + key for key, accessed in self.accesses.items()])
+            self.accesses = {}
+
+    def flush_locked(self):
+        """
+        This method writes the access times and commits the new results, the caller holds the lock
+        """
+        self.write_accesses()
+        self.connection.commit()
+        self.pending = 0
+
+    def flush(self):
+        """
+        This method writes the access times of the hits and commits the results stored since the last flush
+        """
+        with self.lock:
+            self.flush_locked()
+
+    def invalidate(self, index_name):
+        """
+        This method drops every cached result of an index. It must be called whenever the index
+        is (re)created or its documents change
+        :param index_name:
+        """
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM results WHERE index_name = ?", (index_name,))
+            self.size -= max(0, cursor.rowcount)
+            self.flush_locked()
+
+    def get_entries(self, index_name):
+        """
+        :param index_name:
+        :return: list of (query, search_fields, result) cached for an index
+        """
+        with self.lock:
+            return self.connection.execute("SELECT query, search_fields, result FROM results WHERE index_name = ?",
+                                           (index_name,)).fetchall()
+
+    def delete(self, index_name, keys):
+        """
+        This method drops some cached results of an index, e.g. the ones affected by changed documents
+        :param index_name:
+        :param keys: iterable of (query, search_fields)
+        :return: number of dropped results
+        """
+        with self.lock:
+            cursor = self.connection.executemany("DELETE FROM results "
+                                                 "WHERE index_name = ? AND query = ? AND search_fields = ?",
+                                                 [(index_name, query, search_fields) for query, search_fields in keys])
+            deleted = max(0, cursor.rowcount)
+            self.size -= deleted
+            self.flush_locked()
+            return deleted
+
+    def get_stats(self):
+        """
+        :return: dictionary with the number of entries, hits, misses and evictions
+        """
+        return {"entries": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
+
+    def close(self):
+        """
+        This method writes what is pending and closes the underlying SQLite connection
+        """
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,210 @@
+"""
+This file contains a client side normalization and expansion of the queries sent to a search engine
+"""
+import os
+import re
+from collections import defaultdict
+
+from analyzers import ascii_folding, lowercase, metaphone, standard_tokenizer
+from fuzzyindex import similarity
+from instrumentation import recorded_as
+from utils import Utils
+
+# punctuation which separates words (Mc. Elree), apostrophes inside a word are kept (O'halleran)
+PUNCTUATION = re.compile(r"[^\w\s']+|'(?!\w)|(?<!\w)'")
+
+
+class QueryNormalizer:
+    """
+    This class rewrites a (misspelled) name before it is sent to the search engine, so that a single cheap field
+    matches what otherwise needs several analyzers:
+    - collapse: the punctuation between words is removed and the spaces collapsed (Sidney Mc. Elree -> Sidney Mc Elree)
+    - fold: the name is lower cased and its accents removed
+    - join: adjacent tokens are also added joined together (mc elree -> mcelree, o halleran -> o'halleran)
+    - phonetic: a token which is not in the vocabulary is expanded with the tokens of the vocabulary
+      with the same metaphone code (copens -> koppens, sibil -> sybyl)
+    The expansions are appended to the query, which is searched in any mode (OR) by the engine.
+    Without a vocabulary, every joined form is added and there is no phonetic expansion.
+    The rewritten queries are memoized
+    """
+
+    def __init__(self, vocabulary=None, collapse=True, fold=True, join=True, phonetic=True, max_expansions=3,
+                 min_similarity=0.6):
+        """
+        :param vocabulary: the indexed names, their tokens are the known tokens
+        :param collapse: remove the punctuation between words
+        :param fold: lower case the name and remove its accents
+        :param join: add the joined forms of adjacent tokens
+        :param phonetic: add the known tokens sounding like an unknown token
+        :param max_expansions: maximum number of phonetic expansions per token
+        :param min_similarity: minimum similarity (1 - edit distance / length) of a phonetic expansion to its token
+        """
+        self.collapse = collapse
+        self.fold = fold
+        self.join = join
+        self.phonetic = phonetic
+        self.max_expansions = max_expansions
+        self.min_similarity = min_similarity
+        self.tokens = None
+        self.phonetic_tokens = defaultdict(set)
+        self.rewritten = {}
+        if vocabulary is not None:
+            self.add_vocabulary(vocabulary)
+
+    @classmethod
+    def from_csv(cls, filename="names.csv", resources_path="resources", **kwargs):
+        """
+        This method creates a normalizer whose vocabulary is the names of a CSV file
+        :param filename:
+        :param resources_path:
+        :return: the normalizer
+        """
+        names = [token[0] for token in Utils(os.path.join(resources_path)).iter_csv(filename)]
+        return cls(names, **kwargs)
+
+    def add_vocabulary(self, names):
+        """
+        This method adds the tokens of names to the known tokens, as the standard analyzer produces them
+        :param names:
+        """
+        self.tokens = self.tokens or set()
+        self.rewritten = {}
+        for name in names:
+            for token in ascii_folding(lowercase(standard_tokenizer(name))):
+                if token not in self.tokens:
+                    self.tokens.add(token)
+                    self.phonetic_tokens[metaphone(token)].add(token)
+
+    def normalize(self, name):
+        """
+        This method applies the collapse and fold steps
+        :param name:
+        :return: the normalized name
+        """
+        if self.collapse:
+            name = " ".join(PUNCTUATION.sub(" ", name).split())
+        if self.fold:
+            name = " ".join(ascii_folding(lowercase(name.split())))
+        return name
+
+    def expand(self, name):
+        """
+        This method normalizes a name and appends its expansions, the result is memoized
+        :param name:
+        :return: the query to be sent to the search engine
+        """
+        query = self.rewritten.get(name)
+        if query is None:
+            query = self.rewrite(name)
+            self.rewritten[name] = query
+        return query
+
+    def rewrite(self, name):
+        """
+        :param name:
+        :return: the normalized name followed by the joined forms and the phonetic expansions of its tokens
+        """
+        tokens = self.normalize(name).split()
+        terms = dict.fromkeys(tokens)
+        if self.join:
+            for first, second in zip(tokens, tokens[1:]):
+                for joined in self.get_joined_forms(first, second):
+                    terms.setdefault(joined)
+        if self.phonetic and self.tokens is not None:
+            for token in tokens:
+                for expansion in self.get_phonetic_expansions(token):
+                    terms.setdefault(expansion)
+        return " ".join(terms)
+
+    def get_joined_forms(self, first, second):
+        """
+        :param first: a token
+        :param second: the next token
+        :return: the joined forms of two tokens which are known (all of them without vocabulary)
+        """
+        forms = [first + second]
+        if len(first) == 1 and first.isalpha():
+            # o halleran -> o'halleran, d angelo -> d'angelo
+            forms.append(first + "'" + second)
+        if self.tokens is None:
+            return forms
+        return [form for form in forms if form.lower() in self.tokens]
+
+    def get_phonetic_expansions(self, token):
+        """
+        :param token:
+        :return: up to max_expansions known tokens with the metaphone code of an unknown token and at least
+        min_similarity, closest first
+        """
+        key = token.lower()
+        if key in self.tokens or len(key) < 3:
+            return []
+        ranked = sorted((-similarity(key, candidate), candidate)
+                        for candidate in self.phonetic_tokens.get(metaphone(key), ()))
+        return [candidate for score, candidate in ranked[:self.max_expansions] if -score >= self.min_similarity]
+
+
+class NormalizedSearch:
+    """
+    This class puts a QueryNormalizer in front of a search engine. Subsets containing the marker field are
+    searched with the rewritten query on their other fields, the other subsets are passed through unchanged.
+    So normalized and plain subsets can be evaluated in the same sweep, and their f1 scores and query costs
+    compared in the same reports (normalized-standard_lucene.csv next to standard_lucene.csv)
+    """
+
+    def __init__(self, search_engine, normalizer, marker="normalized"):
+        """
+        :param search_engine: the target src engine (Elastic, Azure)
+        :param normalizer: the QueryNormalizer
+        :param marker: the pseudo field marking the subsets to be normalized
+        """
+        self.search_engine = search_engine
+        self.normalizer = normalizer
+        self.marker = marker
+
+    def mark(self, subsets):
+        """
+        :param subsets: list of subsets
+        :return: the same subsets, marked to be normalized
+        """
+        return [(self.marker,) + tuple(subset) for subset in subsets]
+
+    def make_search(self, misspelled_name, fields, index_name="test"):
+        """
+        this method queries the search engine, with the rewritten name if the marker is one of the fields
+        :param misspelled_name:
+        :param fields:
+        :param index_name:
+        :return: a name with the maximum rank or NOT_FOUND otherwise
+        """
+        if self.marker not in fields:
+            return self.search_engine.make_search(misspelled_name, fields, index_name)
+        # the query cost is recorded under the marked subset, apart from the one of the plain subset
+        with recorded_as(fields):
+            return self.search_engine.make_search(self.normalizer.expand(misspelled_name),
+                                                  [field for field in fields if field != self.marker], index_name)
+
+    def make_search_many(self, queries, index_name="test"):
+        """
+        this method answers many queries through make_search_many of the search engine. The queries of each subset
+        are sent together, the ones of a marked subset rewritten and recorded under the marked subset
+        :param queries: list of (misspelled name, fields)
+        :param index_name:
+        :return: list of names with the maximum rank (or NOT_FOUND), in the same order as queries
+        """
+        subsets = {}
+        for position, (misspelled_name, fields) in enumerate(queries):
+            subsets.setdefault(tuple(fields), []).append(position)
+        found_names = [None] * len(queries)
+        for fields, positions in subsets.items():
+            if self.marker not in fields:
+                found = self.search_engine.make_search_many([queries[position] for position in positions], index_name)
+            else:
+                searched = [field for field in fields if field != self.marker]
+                with recorded_as(fields):
+                    found = self.search_engine.make_search_many(
+                        [(self.normalizer.expand(queries[position][0]), searched) for position in positions],
+                        index_name)
+            for position, found_name in zip(positions, found):
+                found_names[position] = found_name
+        return found_names
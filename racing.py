@@ -0,0 +1,180 @@
+"""
+This file contains the bookkeeping of a racing evaluation: the subsets are evaluated in rounds and the ones
+which cannot beat the leader any more are dropped
+"""
+import math
+
+import numpy as np
+
+from compactresults import FN, FP, OUTCOMES, TN, TP
+
+
+def wilson_interval(successes, trials, z, sampled_fraction=0.0):
+    """
+    This method calculates the Wilson score interval of a proportion. The names are drawn without replacement
+    from a finite list, so the interval is narrowed by the finite population correction and is a single point
+    once every name has been evaluated
+    :param successes:
+    :param trials:
+    :param z: the normal quantile of the confidence (e.g. 2.58 for 99%)
+    :param sampled_fraction: fraction of the names already evaluated
+    :return: (low, high)
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    p = successes / trials
+    z2 = z * z * max(0.0, 1.0 - sampled_fraction)
+    denominator = 1 + z2 / trials
+    center = (p + z2 / (2 * trials)) / denominator
+    half_width = math.sqrt(z2 * p * (1 - p) / trials + z2 * z2 / (4 * trials * trials)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def f1_from_scores(precision, recall):
+    """
+    :param precision:
+    :param recall:
+    :return: the f1 score, an increasing function of both the precision and the recall, -1 if it is undefined
+    """
+    if precision < 0 or recall < 0 or precision + recall == 0:
+        return -1.0
+    return 2 * precision * recall / (precision + recall)
+
+
+class Race:
+    """
+    This class keeps the running outcomes of every subset of a race and a confidence interval on their f1 score.
+    The f1 score is the one of generate_f1: the precision is TN / (TN + FP) (TP / (TP + FP) if precision_from_tn
+    is false) and the recall TP / (TP + FN). The f1 score increases with both, so the Wilson intervals of the
+    precision and of the recall give an interval of the f1 score.
+    As every subset is evaluated on the same names in the same order, a subset is compared to the leader
+    (the subset with the best f1 score so far) on the names both were evaluated on: the difference of their
+    f1 scores is linearized per name (delta method), and the subset is pruned when the upper bound of the difference
+    is below zero. The paired bound is much narrower than the intervals of two f1 scores close to each other
+    """
+
+    def __init__(self, subsets, names_count, z=2.58, min_names=60, precision_from_tn=True):
+        """
+        :param subsets: list of subsets
+        :param names_count: number of misspelled names
+        :param z: the normal quantile of the confidence of the bounds
+        :param min_names: number of names a subset is evaluated on before it can be pruned or lead
+        :param precision_from_tn: calculate the precision as generate_f1 does (TN / (TN + FP)),
+        otherwise TP / (TP + FP)
+        """
+        self.names_count = names_count
+        self.z = z
+        self.min_names = min_names
+        # the outcome counted as a success of the precision
+        self.precise = TN if precision_from_tn else TP
+        self.codes = {tuple(subset): np.full(names_count, len(OUTCOMES), dtype=np.uint8) for subset in subsets}
+        self.counts = {subset: np.zeros(len(OUTCOMES), dtype=np.int64) for subset in self.codes}
+        self.evaluated = {subset: 0 for subset in self.codes}
+        self.alive = list(self.codes)
+        self.pruned = []
+
+    def add(self, subset, codes):
+        """
+        This method adds the outcomes of the next names of a subset, in the order of the race
+        :param subset: tuple of fields
+        :param codes: array of outcome codes
+        """
+        subset = tuple(subset)
+        evaluated = self.evaluated[subset]
+        self.codes[subset][evaluated:evaluated + len(codes)] = codes
+        self.counts[subset] += np.bincount(codes, minlength=len(OUTCOMES) + 1)[:len(OUTCOMES)]
+        self.evaluated[subset] += len(codes)
+
+    def get_f1(self, subset):
+        """
+        :param subset: tuple of fields
+        :return: the f1 score of a subset so far, -1 if it is undefined
+        """
+        counts = self.counts[subset]
+        precision_trials = counts[self.precise] + counts[FP]
+        recall_trials = counts[TP] + counts[FN]
+        if not precision_trials or not recall_trials:
+            return -1.0
+        return f1_from_scores(counts[self.precise] / precision_trials, counts[TP] / recall_trials)
+
+    def get_interval(self, subset):
+        """
+        :param subset: tuple of fields
+        :return: (low, high) bounds of the f1 score of a subset
+        """
+        counts = self.counts[subset]
+        sampled_fraction = self.evaluated[subset] / self.names_count if self.names_count else 1.0
+        precision = wilson_interval(int(counts[self.precise]), int(counts[self.precise] + counts[FP]), self.z,
+                                    sampled_fraction)
+        recall = wilson_interval(int(counts[TP]), int(counts[TP] + counts[FN]), self.z, sampled_fraction)
+        return f1_from_scores(precision[0], recall[0]), f1_from_scores(precision[1], recall[1])
+
+    def get_difference_interval(self, subset, leader):
+        """
+        :param subset: tuple of fields
+        :param leader: tuple of fields
+        :return: (low, high) bounds of the f1 score of a subset minus the one of the leader,
+        on the names both were evaluated on
+        """
+        names = min(self.evaluated[subset], self.evaluated[leader])
+        if names < 2:
+            return -1.0, 1.0
+        difference = 0.0
+        influence = np.zeros(names)
+        for sign, codes in ((1, self.codes[subset][:names]), (-1, self.codes[leader][:names])):
+            precise, false_positives, true_positives, false_negatives = (
+                (codes == outcome).astype(float) for outcome in (self.precise, FP, TP, FN))
+            a, b, tp, fn = (indicator.mean() for indicator in (precise, false_positives, true_positives,
+                                                               false_negatives))
+            if a + b == 0 or tp + fn == 0:
+                return -1.0, 1.0
+            precision, recall = a / (a + b), tp / (tp + fn)
+            if precision + recall == 0:
+                return -1.0, 1.0
+            # f1 = 2 precision recall / (precision + recall), linearized around the means
+            difference += sign * f1_from_scores(precision, recall)
+            precision_influence = (b * precise - a * false_positives) / (a + b) ** 2
+            recall_influence = (fn * true_positives - tp * false_negatives) / (tp + fn) ** 2
+            influence += sign * 2 * (recall ** 2 * precision_influence + precision ** 2 * recall_influence) \
+                / (precision + recall) ** 2
+        half_width = self.z * math.sqrt(influence.var(ddof=1) / names * max(0.0, 1 - names / self.names_count))
+        return difference - half_width, difference + half_width
+
+    def prune(self):
+        """
+        This method drops the subsets which cannot beat the leader any more,
+        a subset evaluated on every name is complete and is not pruned
+        :return: the subsets pruned by this call
+        """
+        candidates = [subset for subset in self.alive if self.evaluated[subset] >= self.min_names]
+        if len(candidates) < 2:
+            return []
+        leader = max(candidates, key=self.get_f1)
+        pruned = [subset for subset in candidates if subset != leader and self.evaluated[subset] < self.names_count
+                  and self.get_difference_interval(subset, leader)[1] < 0]
+        self.alive = [subset for subset in self.alive if subset not in pruned]
+        self.pruned.extend(pruned)
+        return pruned
+
+    def get_summary(self):
+        """
+        :return: dictionary of fields -> number of names, evaluated names, f1 score and its bounds so far,
+        pruned flag and queries saved
+        """
+        summary = {}
+        for subset in self.codes:
+            low, high = self.get_interval(subset)
+            summary['-'.join(subset)] = {"names": self.names_count,
+                                         "evaluated": self.evaluated[subset],
+                                         "f1": self.get_f1(subset),
+                                         "f1_low": low,
+                                         "f1_high": high,
+                                         "pruned": subset in self.pruned,
+                                         "queries_saved": self.names_count - self.evaluated[subset]}
+        return summary
+
+    def get_queries_saved(self):
+        """
+        :return: number of queries the pruned subsets did not send
+        """
+        return sum(self.names_count - self.evaluated[subset] for subset in self.pruned)
@@ -0,0 +1,182 @@
+"""
+This file contains an append-only store for the results of the statistics
+"""
+import os
+import sqlite3
+
+from constants import Constants
+
+
+class ResultStore:
+    """
+    This class stores every (subset, misspelled name) result in a single SQLite file as soon as it is known.
+    A subset is recorded once as a bit mask over the known fields, each row only references the subset id.
+    Rows are committed every flush_every rows, so an interrupted run resumes from the last flushed row.
+    """
+
+    def __init__(self, path=os.path.join("cache", "results.sqlite"), flush_every=1000):
+        """
+        :param path: path of the SQLite file, its directory is created if it does not exist
+        :param flush_every: number of rows written between two commits
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.flush_every = flush_every
+        self.pending = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS fields ("
+                                "position INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS subsets ("
+                                "id INTEGER PRIMARY KEY, mask INTEGER NOT NULL UNIQUE, name TEXT NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results ("
+                                "subset_id INTEGER NOT NULL, "
+                                "position INTEGER NOT NULL, "
+                                "retrieved TEXT NOT NULL, "
+                                "expected TEXT NOT NULL, "
+                                "result TEXT NOT NULL, "
+                                "PRIMARY KEY (subset_id, position)) WITHOUT ROWID")
+        self.connection.commit()
+        self.fields = {name: position for position, name in
+                       self.connection.execute("SELECT position, name FROM fields")}
+        self.subset_ids = {}
+
+    def get_subset_id(self, subset):
+        """
+        This method returns the id of a subset, the subset and its unknown fields are registered on first use
+        :param subset: tuple of fields
+        :return: the id of the subset
+        """
+        subset = tuple(subset)
+        subset_id = self.subset_ids.get(subset)
+        if subset_id is not None:
+            return subset_id
+        mask = 0
+        for field in subset:
+            if field not in self.fields:
+                self.fields[field] = len(self.fields)
+                self.connection.execute("INSERT INTO fields VALUES (?, ?)", (self.fields[field], field))
+            mask |= 1 << self.fields[field]
+        row = self.connection.execute("SELECT id FROM subsets WHERE mask = ?", (mask,)).fetchone()
+        if row is None:
+            subset_id = self.connection.execute("INSERT INTO subsets (mask, name) VALUES (?, ?)",
+                                                (mask, '-'.join(subset))).lastrowid
+        else:
+            subset_id = row[0]
+        self.subset_ids[subset] = subset_id
+        return subset_id
+
+    def add(self, subset, position, retrieved, expected, result):
+        """
+        This method appends the result of a query, it is committed with the next flush
+        :param subset: tuple of fields
+        :param position: position of the misspelled name in the list of misspelled names
+        :param retrieved: name retrieved from the search engine
+        :param expected: expected name
+        :param result: TP, TN, FP or FN
+        """
+        self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                                (self.get_subset_id(subset), position, retrieved, expected, result))
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def add_many(self, subset, positions, retrieved_list, expected_list, results):
+        """
+        This method appends the results of many queries of a subset, they are committed with the next flush
+        :param subset: tuple of fields
+        :param positions: positions of the misspelled names
+        :param retrieved_list: names retrieved from the search engine
+        :param expected_list: expected names
+        :param results: TP, TN, FP or FN per query
+        """
+        subset_id = self.get_subset_id(subset)
+        rows = [(subset_id, int(position), retrieved, expected, result)
+                for position, retrieved, expected, result in zip(positions, retrieved_list, expected_list, results)]
+        self.connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", rows)
+        self.pending += len(rows)
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        This method commits the rows appended since the last flush
+        """
+        self.connection.commit()
+        self.pending = 0
+
+    def get_positions(self, subset):
+        """
+        :param subset: tuple of fields
+        :return: set of positions of the misspelled names already stored for a subset
+        """
+        return {row[0] for row in self.connection.execute("SELECT position FROM results WHERE subset_id = ?",
+                                                          (self.get_subset_id(subset),))}
+
+    def get_subsets(self):
+        """
+        :return: list of the subsets (tuples of fields) which have been stored
+        """
+        return [tuple(name.split('-')) for name, in self.connection.execute("SELECT name FROM subsets ORDER BY id")]
+
+    def get_retrieved(self, subset):
+        """
+        :param subset: tuple of fields
+        :return: list of (position, retrieved name) stored for a subset
+        """
+        return self.connection.execute("SELECT position, retrieved FROM results WHERE subset_id = ? ORDER BY position",
+                                       (self.get_subset_id(subset),)).fetchall()
+
+    def delete(self, subset, positions):
+        """
+        This method drops some results of a subset, so that their names are queried again by the next run
+        :param subset: tuple of fields
+        :param positions: positions of the misspelled names
+        :return: number of dropped results
+        """
+        subset_id = self.get_subset_id(subset)
+        cursor = self.connection.executemany("DELETE FROM results WHERE subset_id = ? AND position = ?",
+                                             [(subset_id, int(position)) for position in positions])
+        self.flush()
+        return max(0, cursor.rowcount)
+
+    def count(self, subset):
+        """
+        :param subset: tuple of fields
+        :return: number of results stored for a subset
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM results WHERE subset_id = ?",
+                                       (self.get_subset_id(subset),)).fetchone()[0]
+
+    def get_rows(self, subset):
+        """
+        This method returns the results of a subset in the same shape as calculate_statistics builds them
+        :param subset: tuple of fields
+        :return: list of dictionaries with the retrieved name, the expected name and the result
+        """
+        return [{Constants.retrieved: retrieved, Constants.expected: expected, Constants.result: result}
+                for retrieved, expected, result in
+                self.connection.execute("SELECT retrieved, expected, result FROM results "
+                                        "WHERE subset_id = ? ORDER BY position", (self.get_subset_id(subset),))]
+
+    def get_counts(self):
+        """
+        This method counts the results of every subset, as Statistics.read_generated_files_to_list does
+        :return: list of dictionaries with fn, tp, tn, fp and fields
+        """
+        statistics = {}
+        for name, result, count in self.connection.execute(
+                "SELECT subsets.name, results.result, COUNT(*) FROM results "
+                "JOIN subsets ON subsets.id = results.subset_id "
+                "GROUP BY subsets.id, results.result ORDER BY subsets.id"):
+            stat = statistics.setdefault(name, {"fn": 0, "tp": 0, "tn": 0, "fp": 0, "fields": name})
+            stat[result.lower()] = count
+        return list(statistics.values())
+
+    def close(self):
+        """
+        This method flushes the pending rows and closes the SQLite connection
+        """
+        self.flush()
+        self.connection.close()
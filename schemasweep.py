@@ -0,0 +1,295 @@
+"""
+This file contains a sweep of the analyzer parameters of resources/index-schema.json: every variant of the schema
+is built as its own index and evaluated side by side
+"""
+import copy
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from compactresults import CompactResults
+from instrumentation import QueryMetrics
+from statistics import Statistics
+from utils import Utils
+
+LOGGER = logging.getLogger(__name__)
+
+DEFINITION_SECTIONS = ("tokenFilters", "tokenizers", "charFilters", "analyzers")
+
+
+def set_parameter(schema, key, value):
+    """
+    This method sets a parameter of a tokenizer, a token filter, a char filter or an analyzer of a schema
+    :param schema: the index schema, changed in place
+    :param key: "definition name.parameter", e.g. "n-gram_filter.minGram"
+    :param value:
+    """
+    name, _, parameter = key.rpartition(".")
+    for section in DEFINITION_SECTIONS:
+        for definition in schema.get(section, []):
+            if definition["name"] == name:
+                definition[parameter] = value
+                return
+    raise ValueError("{} is not a tokenizer, a filter or an analyzer of the schema".format(name))
+
+
+def is_valid(schema):
+    """
+    :param schema: the index schema
+    :return: False if a n-gram filter or tokenizer has a minGram greater than its maxGram
+    """
+    for section in DEFINITION_SECTIONS:
+        for definition in schema.get(section, []):
+            if definition.get("minGram", 1) > definition.get("maxGram", definition.get("minGram", 1)):
+                return False
+    return True
+
+
+def create_variants(schema, grid):
+    """
+    This method creates a schema per combination of the values of a grid
+    :param schema: the base index schema
+    :param grid: dictionary of "definition name.parameter" -> list of values
+    :return: list of (parameters, schema), the invalid combinations are skipped
+    """
+    keys = sorted(grid)
+    variants = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        parameters = dict(zip(keys, values))
+        variant = copy.deepcopy(schema)
+        for key, value in parameters.items():
+            set_parameter(variant, key, value)
+        if not is_valid(variant):
+            LOGGER.warning("skipping the invalid variant %s", parameters)
+            continue
+        variants.append((parameters, variant))
+    return variants
+
+
+def get_field_fingerprints(schema):
+    """
+    This method fingerprints the analysis of every searchable field: its analyzers and the tokenizers,
+    token filters and char filters they use. Two schemas index a field the same way if its fingerprints are equal
+    :param schema: the index schema
+    :return: dictionary of field name -> fingerprint
+    """
+    definitions = {definition["name"]: definition
+                   for section in DEFINITION_SECTIONS for definition in schema.get(section, [])}
+    fingerprints = {}
+    for field in schema["fields"]:
+        if not field.get("searchable") or field.get("key"):
+            continue
+        analysis = []
+        for key in ("analyzer", "indexAnalyzer", "searchAnalyzer"):
+            analyzer = definitions.get(field.get(key))
+            if analyzer is None:
+                analysis.append(field.get(key))
+                continue
+            # predefined tokenizers and filters are referenced by their name only
+            parts = [analyzer.get("tokenizer")] + analyzer.get("tokenFilters", []) + analyzer.get("charFilters", [])
+            analysis.append([analyzer] + [definitions.get(part, part) for part in parts])
+        fingerprints[field["name"]] = hashlib.sha1(json.dumps(analysis, sort_keys=True).encode("utf-8")).hexdigest()
+    return fingerprints
+
+
+class TimedBackend:
+    """
+    This class searches a given index of a search engine and records the latency of every query
+    """
+
+    def __init__(self, search_engine, index_name, metrics):
+        """
+        :param search_engine:
+        :param index_name:
+        :param metrics: the QueryMetrics the latencies are recorded into
+        """
+        self.search_engine = search_engine
+        self.index_name = index_name
+        self.metrics = metrics
+
+    def make_search(self, misspelled_name, fields):
+        start = time.perf_counter()
+        retrieved = self.search_engine.make_search(misspelled_name, fields, self.index_name)
+        self.metrics.record(fields, time.perf_counter() - start)
+        return retrieved
+
+    def make_search_many(self, queries):
+        start = time.perf_counter()
+        retrieved = self.search_engine.make_search_many(queries, self.index_name)
+        # the queries of a block share one request, each is charged its share of the latency
+        latency = (time.perf_counter() - start) / max(1, len(queries))
+        for _, fields in queries:
+            self.metrics.record(fields, latency)
+        return retrieved
+
+
+class SchemaSweep:
+    """
+    This class evaluates variants of the index schema generated from a grid of analyzer parameters.
+    A subset is evaluated once per distinct analysis of its fields: a variant which indexes the fields of a subset
+    the same way as a variant before it reuses its results, and a variant with nothing left to evaluate is not built.
+    The variants are built, filled, evaluated and dropped by at most parallel workers at the same time,
+    so no more than parallel variant indexes exist at once
+    """
+
+    def __init__(self, search_engine, correct_list, misspelled_list, grid, schema=None, corpus=None, prefix="sweep",
+                 parallel=2, concurrency=1, batch_size=None, keep_indexes=False):
+        """
+        :param search_engine: the target src engine, with create_index(index_name, schema) and delete_index
+        :param correct_list: list of correct items
+        :param misspelled_list: list of misspelled items
+        :param grid: dictionary of "definition name.parameter" -> list of values
+        :param schema: the base index schema, resources/index-schema.json by default
+        :param corpus: optional CompiledCorpus, its names are indexed instead of the ones of names.csv
+        :param prefix: prefix of the names of the variant indexes
+        :param parallel: maximum number of variants built and evaluated at the same time
+        :param concurrency: maximum number of queries in flight per variant
+        :param batch_size: if given, the names are searched by blocks of batch_size through make_search_many
+        :param keep_indexes: if true, the variant indexes are not dropped once evaluated
+        """
+        self.utils = Utils(os.path.join("resources"))
+        self.search_engine = search_engine
+        self.correct_list = correct_list
+        self.misspelled_list = misspelled_list
+        self.schema = schema or self.utils.read_json_from_resources("index-schema.json")
+        self.grid = grid
+        self.corpus = corpus
+        self.prefix = prefix
+        self.parallel = parallel
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.keep_indexes = keep_indexes
+        self.report = []
+
+    def get_variants(self):
+        """
+        :return: list of (parameters, schema) of the base schema and of its distinct variants
+        """
+        variants = [({}, self.schema)]
+        seen = {json.dumps(self.schema, sort_keys=True)}
+        for parameters, schema in create_variants(self.schema, self.grid):
+            key = json.dumps(schema, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                variants.append((parameters, schema))
+        return variants
+
+    def get_changed_fields(self, variants):
+        """
+        :param variants: list of (parameters, schema)
+        :return: the fields analyzed differently by at least one variant
+        """
+        fingerprints = [get_field_fingerprints(schema) for _, schema in variants]
+        return [field for field in fingerprints[0]
+                if any(other.get(field) != fingerprints[0][field] for other in fingerprints[1:])]
+
+    def run(self, subsets=None):
+        """
+        This method evaluates the subsets on every variant and writes the comparative report
+        :param subsets: the subsets to be evaluated, by default every field changed by the grid on its own
+        :return: list of dictionaries with the variant, its parameters, the fields, the counts,
+        the precision, recall and f1 score, the latency percentiles and whether the results were reused
+        """
+        variants = self.get_variants()
+        if subsets is None:
+            subsets = [(field,) for field in self.get_changed_fields(variants)]
+        LOGGER.info("variants: %s, subsets: %s", len(variants), len(subsets))
+
+        # the first variant needing a (field, fingerprint) combination evaluates it, the others reuse it
+        owners = {}
+        plans = []
+        for number, (parameters, schema) in enumerate(variants):
+            fingerprints = get_field_fingerprints(schema)
+            plan = []
+            for subset in subsets:
+                key = tuple((field, fingerprints[field]) for field in subset)
+                plan.append((subset, key, owners.setdefault(key, number) != number))
+            plans.append(plan)
+
+        results = {}
+        pending = [number for number, plan in enumerate(plans) if not all(reused for _, _, reused in plan)]
+        with ThreadPoolExecutor(max_workers=max(1, self.parallel)) as executor:
+            evaluated = executor.map(lambda number: self.evaluate_variant(
+                number, variants[number][1], [subset for subset, _, reused in plans[number] if not reused]), pending)
+            for number, (counts, latencies) in zip(pending, evaluated):
+                for subset, key, reused in plans[number]:
+                    if not reused:
+                        results[key] = (counts['-'.join(subset)], latencies.get('-'.join(subset), {}))
+
+        self.report = []
+        for number, (parameters, _) in enumerate(variants):
+            for subset, key, reused in plans[number]:
+                counts, latency = results[key]
+                stat = {"variant": self.get_index_name(number), "parameters": parameters,
+                        "fields": '-'.join(subset), "reused": reused}
+                stat.update(counts)
+                stat["precision"] = Statistics.calc_precision(stat["tn"], stat["fp"])
+                stat["recall"] = Statistics.calc_recall(stat["tp"], stat["fn"])
+                stat["f1"] = Statistics.f1_score(stat["precision"], stat["recall"])
+                stat["client_p50"] = latency.get("client_p50", -1)
+                stat["client_p95"] = latency.get("client_p95", -1)
+                stat["queries"] = 0 if reused else latency.get("queries", 0)
+                self.report.append(stat)
+        return self.report
+
+    def get_index_name(self, number):
+        """
+        :param number: the number of a variant, 0 is the base schema
+        :return: the name of the index of the variant
+        """
+        return "{}-{:03d}".format(self.prefix, number)
+
+    def evaluate_variant(self, number, schema, subsets):
+        """
+        This method builds the index of a variant, evaluates subsets on it and drops it
+        :param number: the number of the variant
+        :param schema: the schema of the variant
+        :param subsets: the subsets to be evaluated
+        :return: (dictionary of fields -> counts, dictionary of fields -> latency report)
+        """
+        index_name = self.get_index_name(number)
+        metrics = QueryMetrics()
+        statistics = Statistics()
+        statistics.results = CompactResults(self.correct_list, statistics.names)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency) if self.concurrency > 1 else None
+        try:
+            self.search_engine.create_index(index_name, schema)
+            names = self.corpus.iter_indexed_names() if self.corpus is not None else None
+            self.search_engine.insert_documents(index_name, names=names)
+            search_engine = TimedBackend(self.search_engine, index_name, metrics)
+            for subset in subsets:
+                retrieved_list = statistics.search_subset(self.misspelled_list, subset, search_engine, executor,
+                                                          self.batch_size)
+                statistics.record_results(subset, range(len(self.misspelled_list)), retrieved_list,
+                                          self.correct_list, self.misspelled_list)
+                LOGGER.info("%s: %s evaluated", index_name, '-'.join(subset))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            if not self.keep_indexes:
+                self.search_engine.delete_index(index_name)
+        counts = {stat["fields"]: {key: value for key, value in stat.items() if key != "fields"}
+                  for stat in statistics.results.get_counts()}
+        return counts, {stat["fields"]: stat for stat in metrics.get_report()}
+
+    def get_best(self):
+        """
+        :return: the row of the report with the highest f1 score per subset
+        """
+        best = {}
+        for stat in self.report:
+            if stat["fields"] not in best or stat["f1"] > best[stat["fields"]]["f1"]:
+                best[stat["fields"]] = stat
+        return best
+
+    def write_report(self, file_name="schema-sweep", directory="reports"):
+        """
+        This method writes the comparative report to a json file
+        :param file_name:
+        :param directory:
+        """
+        self.utils.write_json_to_directory(self.report, file_name, directory)
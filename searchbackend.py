@@ -0,0 +1,164 @@
+"""
+This file contains the interface of the search engines the statistics are calculated against
+"""
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from email.utils import parsedate_to_datetime
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class SearchBackend(ABC):
+    """
+    This class is the interface of a search engine: an index is created from resources/index-schema.json,
+    the names of resources/names.csv are inserted into it, then misspelled names are searched one by one
+    or by batches. Statistics.calculate_statistics only needs make_search, and make_search_many
+    when a batch size is given
+    """
+
+    @abstractmethod
+    def create_index(self, index_name="test", schema=None):
+        """
+        this method creates an index from the schema file (resources/index-schema.json)
+        :param index_name:
+        :param schema: the index schema, resources/index-schema.json by default
+        :return: the created index schema
+        """
+
+    @abstractmethod
+    def delete_index(self, index_name="test"):
+        """
+        this method drops an index
+        :param index_name:
+        """
+
+    @abstractmethod
+    def insert_documents(self, index_name="test"):
+        """
+        this method inserts the names of resources/names.csv into an index
+        :param index_name:
+        :return: the status of every document
+        """
+
+    @abstractmethod
+    def make_search(self, misspelled_name, fields, index_name="test"):
+        """
+        this method searches a misspelled name on some fields of an index
+        :param misspelled_name:
+        :param fields:
+        :param index_name:
+        :return: a name with the maximum rank or NOT_FOUND otherwise
+        """
+
+    def make_search_many(self, queries, index_name="test"):
+        """
+        this method answers many independent queries, one after another unless the engine batches them
+        :param queries: list of (misspelled name, fields)
+        :param index_name:
+        :return: list of names with the maximum rank (or NOT_FOUND), in the same order as queries
+        """
+        return [self.make_search(name, fields, index_name) for name, fields in queries]
+
+    @abstractmethod
+    def index_documents(self, index_name, documents):
+        """
+        this method applies documents with their own action (upload, mergeOrUpload, delete) to an index,
+        it is needed to synchronize an index with resources/names.csv (NameSynchronizer)
+        :param index_name:
+        :param documents: iterable of documents, each with its @search.action
+        :return: the status of every document and the number of succeeded and failed documents
+        """
+
+    def get_schema(self, index_name="test"):
+        """
+        :param index_name:
+        :return: the schema an index was created with by this client, resources/index-schema.json otherwise
+        """
+        schema = self.schemas.get(index_name)
+        return schema if schema is not None else self.utils.read_json_from_resources("index-schema.json")
+
+    def iter_documents(self, filename="names.csv", names=None, schema=None):
+        """
+        This method lazily creates one document per distinct name of a CSV file of the resources (self.utils).
+        The name is the value of every searchable text field of the schema.
+        The id of a document is derived from its name, so uploading the same names again replaces
+        the existing documents instead of duplicating them
+        :param filename:
+        :param names: optional iterable of names read instead of the CSV file (e.g. CompiledCorpus.iter_indexed_names)
+        :param schema: the index schema, resources/index-schema.json by default
+        :return: an iterator of documents
+        """
+        schema = schema if schema is not None else self.utils.read_json_from_resources("index-schema.json")
+        fields = [field["name"] for field in schema["fields"]
+                  if field.get("searchable") and not field.get("key") and field.get("type") == "Edm.String"]
+        if names is None:
+            names = (token[0] for token in self.utils.iter_csv(filename))
+        seen = set()
+        for name in names:
+            document_id = self.get_document_id(name)
+            if document_id in seen:
+                continue
+            seen.add(document_id)
+            document = {"@search.action": "upload", "id": document_id}
+            document.update((field, name) for field in fields)
+            yield document
+
+    def send_with_retries(self, method, url, max_retries=None, **kwargs):
+        """
+        This method sends a request through the pooled session of an http client (self.session, self.timeout,
+        self.max_retries, self.backoff_factor, self.retries and self.lock). Throttled (429), unavailable (5xx)
+        responses and connection errors are retried with exponential backoff, honouring the Retry-After header
+        of the service when present
+        :param method: http method (e.g. POST, PUT)
+        :param url:
+        :param max_retries: maximum number of retries, self.max_retries by default
+        :param kwargs: the arguments of requests.Session.request (json, data, headers)
+        :return: the response of the last attempt
+        """
+        import requests
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+                    return response
+                delay = self.get_retry_delay(response, attempt)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= max_retries:
+                    raise
+                delay = self.get_retry_delay(None, attempt)
+            with self.lock:
+                self.retries += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def get_retry_delay(self, response, attempt):
+        """
+        This method calculates how long to wait before retrying a request
+        :param response: the throttled response, or None if the request failed to connect
+        :param attempt: number of attempts already retried
+        :return: delay in seconds
+        """
+        backoff = self.backoff_factor * (2 ** attempt)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if not retry_after:
+            return backoff
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return backoff
+
+    @staticmethod
+    def get_document_id(name):
+        """
+        This method derives a document key from a name
+        :param name:
+        :return: the sha1 of the name (a valid azure src key)
+        """
+        return hashlib.sha1(name.encode("utf-8")).hexdigest()
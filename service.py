@@ -0,0 +1,298 @@
+"""
+This file contains a long-running http service to disambiguate names
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from instrumentation import QueryMetrics
+from utils import Utils
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    This class is a thread safe least recently used cache of responses
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key:
+        :return: the cached value or None
+        """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        This method caches a value and evicts the least recently used one if the cache is full
+        :param key:
+        :param value:
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        This method drops every cached value
+        """
+        with self.lock:
+            self.entries.clear()
+
+
+class Backend:
+    """
+    This class groups what answers a query: a search engine, the index to be queried and the fields to be searched.
+    A backend is never modified, a reload replaces it as a whole
+    """
+
+    def __init__(self, search_engine, fields, index_name="test"):
+        self.search_engine = search_engine
+        self.fields = list(fields)
+        self.index_name = index_name
+
+
+class DisambiguationService:
+    """
+    This class answers disambiguation requests with the current backend, caches the responses and counts
+    the requests. The backend can be replaced while requests are served: requests in flight finish on the
+    backend they started with, the following ones use the new backend
+    """
+
+    def __init__(self, backend, cache_size=10000):
+        """
+        :param backend: the Backend answering the queries
+        :param cache_size: maximum number of cached responses
+        """
+        self.backend = backend
+        self.cache = ResponseCache(cache_size)
+        self.metrics = QueryMetrics()
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.counters = {"requests": 0, "cache_hits": 0, "errors": 0, "reloads": 0}
+
+    @staticmethod
+    def choose_fields():
+        """
+        This method picks the shortest combination of fields with the highest f1 score of the generated reports
+        :return: list of fields
+        """
+        from statistics import Statistics
+        statistics = Statistics()
+        fields = statistics.utils.get_shortest_fields_with_highest_f1_score(statistics.generate_f1())
+        return fields.split('-') if fields else ["standard_lucene"]
+
+    def count(self, counter):
+        """
+        :param counter: name of the counter to be incremented
+        """
+        with self.lock:
+            self.counters[counter] += 1
+
+    def disambiguate(self, name):
+        """
+        This method finds the name closest to a (misspelled) name
+        :param name:
+        :return: dictionary with the query, the result, the searched fields and whether it was cached
+        """
+        self.count("requests")
+        backend = self.backend
+        result = self.cache.get(name)
+        if result is not None:
+            self.count("cache_hits")
+            return {"query": name, "result": result, "fields": backend.fields, "cached": True}
+        start = time.perf_counter()
+        result = backend.search_engine.make_search(name, backend.fields, backend.index_name)
+        self.metrics.record(backend.fields, time.perf_counter() - start)
+        # a response of a backend replaced in the meantime must not be cached,
+        # the check and the put are atomic with the swap and the clear of reload
+        with self.reload_lock:
+            if self.backend is backend:
+                self.cache.put(name, result)
+        return {"query": name, "result": result, "fields": backend.fields, "cached": False}
+
+    def reload(self, backend):
+        """
+        This method swaps the backend. The new backend must be ready (index created and documents inserted)
+        :param backend: the new Backend
+        """
+        with self.reload_lock:
+            self.backend = backend
+            self.cache.clear()
+        self.count("reloads")
+        LOGGER.info("backend reloaded: index %s, fields %s", backend.index_name, backend.fields)
+
+    def get_stats(self):
+        """
+        :return: the counters of the service and the latency report of the queries sent to the backend
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        stats["latency"] = self.metrics.get_report()
+        return stats
+
+    def create_server(self, host="localhost", port=8080, backend_factory=None):
+        """
+        This method creates an http server exposing:
+        GET /disambiguate?name=... the result for a name
+        GET /stats the counters and latencies
+        POST /reload builds a new backend with backend_factory(json body) and swaps it,
+        a body which is not a json object or which backend_factory rejects with a ValueError is answered with 400
+        :param host:
+        :param port:
+        :param backend_factory: function from the json body of /reload to a new Backend
+        :return: the http server, call serve_forever to start it
+        """
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, message_format, *args):
+                LOGGER.debug(message_format, *args)
+
+            def send_json(self, status, body):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/disambiguate":
+                    names = parse_qs(url.query).get("name")
+                    if not names:
+                        self.send_json(400, {"error": "missing name parameter"})
+                        return
+                    try:
+                        self.send_json(200, service.disambiguate(names[0]))
+                    except Exception as error:
+                        service.count("errors")
+                        LOGGER.exception("disambiguation of %s failed", names[0])
+                        self.send_json(502, {"error": str(error)})
+                elif url.path == "/stats":
+                    self.send_json(200, service.get_stats())
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                if urlparse(self.path).path != "/reload" or backend_factory is None:
+                    self.send_json(404, {"error": "not found"})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    if not isinstance(body, dict):
+                        raise ValueError("the body must be a json object")
+                    backend = backend_factory(body)
+                except ValueError as error:
+                    service.count("errors")
+                    self.send_json(400, {"error": str(error)})
+                    return
+                except Exception as error:
+                    service.count("errors")
+                    LOGGER.exception("reload failed")
+                    self.send_json(500, {"error": str(error)})
+                    return
+                service.reload(backend)
+                self.send_json(200, {"index_name": backend.index_name, "fields": backend.fields})
+
+        return ThreadingHTTPServer((host, port), Handler)
+
+
+def create_backend_factory(backend_type, endpoint=None):
+    """
+    This method creates the function building a new backend on /reload.
+    The json body may contain the index name, the fields (chosen from the generated reports by default)
+    and the names CSV file in resources. The names are indexed by every backend, with azure they are only
+    inserted when the index is rebuilt, so names without rebuild are rejected. An azure rebuild creates a new index
+    named after index_name and a timestamp in milliseconds, the index being served is left untouched until the swap and the indexes
+    rebuilt before it are dropped by the next rebuild
+    :param backend_type: azure, local or fuzzy
+    :param endpoint: endpoint of the azure src service (e.g. a local stub server)
+    :return: function from the json body of /reload to a Backend, raising ValueError on an invalid body
+    """
+    clients = {}
+    rebuilt = []
+    rebuild_lock = threading.Lock()
+    utils = Utils(os.path.join("resources"))
+
+    def read_names(filename):
+        resources = os.path.realpath(utils.resources_path)
+        path = os.path.realpath(os.path.join(resources, filename))
+        if os.path.commonpath([resources, path]) != resources or not os.path.isfile(path):
+            raise ValueError("{} is not a file of the resources".format(filename))
+        return [token[0] for token in utils.iter_csv(os.path.relpath(path, resources))]
+
+    def factory(body):
+        index_name = body.get("index_name", "test")
+        fields = body.get("fields") or DisambiguationService.choose_fields()
+        names_file = body.get("names")
+        if backend_type == "fuzzy":
+            from fuzzyindex import FuzzyNameIndex
+            return Backend(FuzzyNameIndex(read_names(names_file or "names.csv")), fields, index_name)
+        if backend_type == "local":
+            from localsearchclient import LocalSearchClient
+            client = LocalSearchClient()
+            client.create_index(index_name)
+            client.insert_documents(index_name, names=read_names(names_file) if names_file else None)
+            return Backend(client, fields, index_name)
+        if names_file and not body.get("rebuild"):
+            raise ValueError("names are only inserted into an azure src index which is rebuilt")
+        names = read_names(names_file) if names_file else None
+        if "azure" not in clients:
+            from azuresearchclient import AzureSearchClient
+            from querycache import QueryCache
+            clients["azure"] = AzureSearchClient(endpoint, cache=QueryCache())
+        if body.get("rebuild"):
+            with rebuild_lock:
+                # the last rebuilt index may still be served, the ones before it were swapped out by an earlier reload
+                for old_index in rebuilt[:-1]:
+                    clients["azure"].delete_index(old_index)
+                del rebuilt[:-1]
+                index_name = "{}-{}".format(index_name, int(time.time() * 1000))
+                clients["azure"].create_index(index_name)
+                clients["azure"].insert_documents(index_name, names=names)
+                rebuilt.append(index_name)
+        return Backend(clients["azure"], fields, index_name)
+
+    return factory
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Serve name disambiguation over http")
+    PARSER.add_argument("--host", default="localhost")
+    PARSER.add_argument("--port", type=int, default=8080)
+    PARSER.add_argument("--backend", choices=["azure", "local", "fuzzy"], default="azure")
+    PARSER.add_argument("--endpoint", help="endpoint of the search service, e.g. a local stub server")
+    PARSER.add_argument("--index", default="test")
+    PARSER.add_argument("--fields", nargs="*", help="fields to be searched, chosen from the generated reports by default")
+    PARSER.add_argument("--cache-size", type=int, default=10000)
+    ARGS = PARSER.parse_args()
+    CONFIG = Utils(os.path.join("resources")).get_config()
+    logging.basicConfig(level=(CONFIG.get("logging") or {}).get("level", "INFO"))
+    FACTORY = create_backend_factory(ARGS.backend, ARGS.endpoint)
+    SERVICE = DisambiguationService(FACTORY({"index_name": ARGS.index, "fields": ARGS.fields}), ARGS.cache_size)
+    SERVER = SERVICE.create_server(ARGS.host, ARGS.port, FACTORY)
+    LOGGER.info("serving on http://%s:%s", ARGS.host, ARGS.port)
+    SERVER.serve_forever()
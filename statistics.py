@@ -1,14 +1,18 @@
 """
 This file contains modules used to calculate the statistics for a src engine
 """
+import json
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from itertools import islice
 from os import walk
-import pandas as pd
 
 from constants import Constants
 from utils import Utils
-from matplotlib import pyplot as plt
+
+LOGGER = logging.getLogger(__name__)
 
 
 class Statistics:
@@ -16,8 +20,27 @@ class Statistics:
     This class contains methods to calculate the statistics for a src index
     """
 
-    def __init__(self):
+    def __init__(self, corpus=None):
+        """
+        :param corpus: optional CompiledCorpus, the names are then interned with the ids of the corpus
+        and its expected rows (get_expected_rows) are used as they are
+        """
         self.utils = Utils(os.path.join("resources"))
+        self.corpus = corpus
+        self.name_table = None
+        # results of the last calculate_statistics, can be passed to generate_f1
+        self.results = None
+
+    @property
+    def names(self):
+        """
+        :return: the NameTable the names are interned with, created on first use so that numpy is only
+        imported by the stages calculating statistics
+        """
+        if self.name_table is None:
+            from compactresults import NameTable
+            self.name_table = NameTable(self.corpus.names if self.corpus is not None else None)
+        return self.name_table
 
     def mark_confusion_matrix(self, expected, retrieved):
         """
@@ -139,10 +162,13 @@ class Statistics:
                              misspelled_list,
                              subsets,
                              search_engine,
-                             generate_reports=False):
+                             generate_reports=False,
+                             concurrency=1,
+                             result_store=None,
+                             batch_size=None):
         """
-        This function calculates different metrics for each fields and returns
-        a list of the results accordingly.
+        This function calculates different metrics for each fields. Nothing is returned, the results of the
+        queries sent are kept in self.results (CompactResults), which can be passed to generate_f1.
         pseudo code:
         <p>
         for each item in misspelled_items:
@@ -157,53 +183,244 @@ class Statistics:
         :param subsets:  a subset of all  combinations of different fields.
         we send a src request to each of those subsets
         :param generate_reports: if true, it create individual report files per field
-        :return: a list of the results
+        :param concurrency: maximum number of queries in flight at the same time.
+        1 (default) sends the queries one after another
+        :param result_store: optional ResultStore. If given, every result is appended to it as soon as
+        its query completes and the names already stored for a subset are not queried again
+        :param batch_size: if given, the names are searched by blocks of batch_size through make_search_many
+        (e.g. one _msearch request per block with ElasticSearchClient)
         """
-        print("total subsets: " + str(len(subsets)))
-        for subset in subsets:
+        from compactresults import CompactResults
+        self.clear_race()
+        LOGGER.info("total subsets: %s", len(subsets))
+        self.results = CompactResults(correct_list, self.names)
+        executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+        try:
+            for processed, subset in enumerate(subsets):
+                positions = self.get_pending_positions(subset, len(misspelled_list), generate_reports, result_store)
+                if not positions:
+                    continue
+                LOGGER.info("%s: %s", processed, '-'.join(subset))
+                retrieved_list = self.search_subset([misspelled_list[i] for i in positions],
+                                                    subset, search_engine, executor, batch_size)
+                self.record_results(subset, positions, retrieved_list, correct_list, misspelled_list,
+                                    generate_reports, result_store)
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
-            if self.already_processed(subset):
+    async def calculate_statistics_async(self, correct_list,
+                                         misspelled_list,
+                                         subsets,
+                                         search_engine,
+                                         generate_reports=False,
+                                         result_store=None):
+        """
+        This function does the same as calculate_statistics with an asyncio search engine
+        (e.g. AsyncAzureSearchClient): the queries of a subset are all scheduled at once, the search engine
+        limits how many of them are in flight
+        :param search_engine: a search engine whose make_search is a coroutine
+        :param correct_list: list of correct items
+        :param misspelled_list:   list of misspelled items
+        :param subsets:  a subset of all  combinations of different fields.
+        :param generate_reports: if true, it create individual report files per field
+        :param result_store: optional ResultStore, as in calculate_statistics
+        """
+        import asyncio
+        from compactresults import CompactResults
+        self.clear_race()
+        LOGGER.info("total subsets: %s", len(subsets))
+        self.results = CompactResults(correct_list, self.names)
+        for processed, subset in enumerate(subsets):
+            positions = self.get_pending_positions(subset, len(misspelled_list), generate_reports, result_store)
+            if not positions:
                 continue
-            DIR = 'generated'
-            print(len([name for name in os.listdir(DIR) if os.path.isfile(os.path.join(DIR, name))]))
-            true_positive = 0
-            true_negative = 0
-            false_positive = 0
-            false_negative = 0
-            data = []
-            for i in range(0, len(misspelled_list)):
-                retrieved = search_engine.make_search(misspelled_list[i][0], list(subset))
-                print(retrieved)
-                expected = correct_list[i][0]
-                result = Statistics().mark_confusion_matrix(expected, retrieved).value
-                if result == Result.TP.value:
-                    true_positive += 1
-                elif result == Result.TN.value:
-                    true_negative += 1
-                elif result == Result.FP.value:
-                    false_positive += 1
-                elif result == Result.FN.value:
-                    false_negative += 1
-
-                data_object = {
-                    Constants.retrieved: retrieved,
-                    Constants.expected: expected,
-                    Constants.result: result}
-
-                data.append(data_object)
-
-            file_name = '-'.join(subset)
-            if generate_reports:
-                self.utils.generate_reports(data, file_name)
+            LOGGER.info("%s: %s", processed, '-'.join(subset))
+            fields = list(subset)
+            retrieved_list = await asyncio.gather(*(search_engine.make_search(misspelled_list[i][0], fields)
+                                                    for i in positions))
+            self.record_results(subset, positions, retrieved_list, correct_list, misspelled_list,
+                                generate_reports, result_store)
+
+    def calculate_statistics_racing(self, correct_list,
+                                    misspelled_list,
+                                    subsets,
+                                    search_engine,
+                                    generate_reports=False,
+                                    concurrency=1,
+                                    result_store=None,
+                                    batch_size=None,
+                                    round_size=20,
+                                    z=2.58,
+                                    min_names=60,
+                                    seed=0,
+                                    precision_from_tn=True):
+        """
+        This function does the same as calculate_statistics, but the subsets race against each other:
+        the names are shuffled, then every subset still in the race is evaluated on the next round_size names.
+        After each round, the subsets whose f1 score cannot reach the one of the leader any more (see Race)
+        are dropped, so the bad subsets only cost a few rounds of queries.
+        The summary of the race is written to reports/race.json, generate_f1 uses it to flag the pruned subsets
+        :param search_engine: the target src engine (Elastic, Azure)
+        :param correct_list: list of correct items
+        :param misspelled_list:   list of misspelled items
+        :param subsets:  a subset of all  combinations of different fields.
+        :param generate_reports: if true, it create individual report files per field. The reports of the pruned
+        subsets only have the names they were evaluated on, calculate_statistics evaluates these subsets again
+        :param concurrency: maximum number of queries in flight at the same time
+        :param result_store: optional ResultStore, the names already stored for a subset are not queried again
+        :param batch_size: if given, the names are searched by blocks of batch_size through make_search_many
+        :param round_size: number of names per round
+        :param z: the normal quantile of the confidence of the f1 intervals (2.58: 99%)
+        :param min_names: number of names a subset is evaluated on before it can be pruned
+        :param seed: seed of the order of the names
+        :param precision_from_tn: rank the subsets on the f1 score of generate_f1, whose precision is TN / (TN + FP).
+        If false, the precision is TP / (TP + FP) as in generate_f1_vectorized(precision_from_tn=False)
+        :return: dictionary of fields -> number of names, evaluated names, pruned flag and queries saved
+        """
+        import numpy as np
+        from compactresults import CompactResults, OUTCOMES
+        from racing import Race
+        self.clear_race()
+        LOGGER.info("total subsets: %s", len(subsets))
+        self.results = CompactResults(correct_list, self.names)
+        race = Race(subsets, len(misspelled_list), z, min_names, precision_from_tn)
+        if result_store is not None:
+            for subset in race.alive:
+                stored = result_store.get_retrieved(subset)
+                if stored:
+                    self.results.add(subset, np.array([row[0] for row in stored], dtype=np.int64),
+                                     self.names.intern_all(row[1] for row in stored))
+        order = np.random.RandomState(seed).permutation(len(misspelled_list))
+        executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+        try:
+            for start in range(0, len(order), round_size):
+                block = order[start:start + round_size]
+                for subset in race.alive:
+                    codes = self.results.codes.get(tuple(subset))
+                    positions = [int(i) for i in block] if codes is None else \
+                        [int(i) for i in block if codes[i] == len(OUTCOMES)]
+                    if positions:
+                        retrieved_list = self.search_subset([misspelled_list[i] for i in positions],
+                                                            subset, search_engine, executor, batch_size)
+                        self.record_results(subset, positions, retrieved_list, correct_list, misspelled_list,
+                                            False, result_store)
+                    race.add(subset, self.results.codes[tuple(subset)][block])
+                for subset in race.prune():
+                    LOGGER.info("%s pruned after %s names, f1 %.3f", '-'.join(subset),
+                                race.evaluated[subset], race.get_f1(subset))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        if generate_reports:
+            for subset in race.counts:
+                data = result_store.get_rows(subset) if result_store is not None else self.results.get_rows(subset)
+                self.utils.generate_reports(data, '-'.join(subset))
+        summary = race.get_summary()
+        self.utils.write_json_to_directory(summary, "race", "reports")
+        LOGGER.info("pruned subsets: %s, queries saved: %s", len(race.pruned), race.get_queries_saved())
+        return summary
+
+    def get_pending_positions(self, subset, names_count, generate_reports=False, result_store=None):
+        """
+        This method finds the names which still have to be queried for a subset
+        :param subset: the fields to be searched
+        :param names_count: number of misspelled names
+        :param generate_reports: if true, the report of a subset completed in the result store is written if missing
+        :param result_store: optional ResultStore
+        :return: the positions of the names to be queried, empty if the subset was already processed
+        """
+        if result_store is None:
+            return [] if self.already_processed(subset, names_count) else range(0, names_count)
+        stored = result_store.get_positions(subset)
+        positions = [i for i in range(0, names_count) if i not in stored]
+        if not positions and generate_reports and not self.already_processed(subset, names_count):
+            self.utils.generate_reports(result_store.get_rows(subset), '-'.join(subset))
+        return positions
+
+    def record_results(self, subset, positions, retrieved_list, correct_list, misspelled_list,
+                       generate_reports=False, result_store=None):
+        """
+        This method marks the retrieved names of a subset, stores them and writes the report of the subset.
+        Names are interned and marked in chunks, with one array operation per chunk. With a result store,
+        a chunk is flush_every results long, so they are stored as soon as they are known
+        :param subset: the searched fields
+        :param positions: positions of the queried names
+        :param retrieved_list: retrieved names, in the same order as positions
+        :param correct_list: list of correct items
+        :param misspelled_list: list of misspelled items
+        :param generate_reports: if true, it create the report file of the subset
+        :param result_store: optional ResultStore
+        """
+        import numpy as np
+        from compactresults import OUTCOMES
+        chunk_size = max(1, result_store.flush_every if result_store is not None else 10000)
+        pending = zip(positions, retrieved_list)
+        for chunk in iter(lambda: list(islice(pending, chunk_size)), []):
+            chunk_positions = np.array([item[0] for item in chunk], dtype=np.int64)
+            retrieved_names = [item[1] for item in chunk]
+            codes = self.results.add(subset, chunk_positions, self.names.intern_all(retrieved_names))
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                for i, retrieved in chunk:
+                    LOGGER.debug("%s: %s -> %s", '-'.join(subset), misspelled_list[i][0], retrieved)
+            if result_store is not None:
+                result_store.add_many(subset, chunk_positions, retrieved_names,
+                                      [correct_list[i][0] for i in chunk_positions], OUTCOMES[codes])
+
+        if result_store is not None:
+            result_store.flush()
+        if generate_reports:
+            data = result_store.get_rows(subset) if result_store is not None else self.results.get_rows(subset)
+            self.utils.generate_reports(data, '-'.join(subset))
 
     @staticmethod
-    def already_processed(subset):
+    def search_subset(misspelled_list, subset, search_engine, executor=None, batch_size=None):
+        """
+        This method sends a query per misspelled name to the search engine on the fields of a subset
+        :param misspelled_list: list of misspelled items
+        :param subset: the fields to be searched
+        :param search_engine: the target src engine (Elastic, Azure)
+        :param executor: if given, the queries are sent concurrently on this executor,
+        otherwise they are sent one after another
+        :param batch_size: if given, the names are searched by blocks of batch_size with make_search_many
+        :return: iterator of retrieved names, in the same order as misspelled_list.
+        Each name is yielded as soon as its query (and the ones before it) completed
+        """
+        fields = list(subset)
+        if batch_size:
+            blocks = [misspelled_list[i:i + batch_size] for i in range(0, len(misspelled_list), batch_size)]
+
+            def search_block(block):
+                return search_engine.make_search_many([(item[0], fields) for item in block])
+
+            found = map(search_block, blocks) if executor is None else executor.map(search_block, blocks)
+            return (retrieved for block in found for retrieved in block)
+        if executor is None:
+            return (search_engine.make_search(item[0], fields) for item in misspelled_list)
+        # executor.map yields results in input order, whatever order the queries complete in
+        return executor.map(lambda item: search_engine.make_search(item[0], fields), misspelled_list)
+
+    @staticmethod
+    def already_processed(subset, names_count=None):
+        """
+        :param subset: the fields searched
+        :param names_count: if given, a report with fewer rows is partial (a subset pruned by
+        calculate_statistics_racing) and the subset is not processed yet
+        :return: true if the report of the subset is in the generated directory
+        """
         file_name = '-'.join(subset)
         file_name = os.path.join('generated', file_name + '.csv')
-        return os.path.isfile(file_name)
+        if not os.path.isfile(file_name):
+            return False
+        if names_count is None:
+            return True
+        with open(file_name, 'r') as a_file:
+            # one header line and one line per name
+            return sum(1 for _ in a_file) - 1 >= names_count
 
     @staticmethod
     def read_generated_files_to_list():
+        import pandas as pd
         statistics = []
         f = []
         for (dirpath, dirnames, filenames) in walk("generated"):
@@ -219,7 +436,39 @@ class Statistics:
         return statistics
 
     @staticmethod
-    def create_plot(f1_scores):
+    def read_generated_files_to_frame(directory="generated"):
+        """
+        This method loads the results of every generated file into a single frame, with the result
+        and the fields as categorical columns, and counts them in one group by
+        :param directory:
+        :return: a frame indexed on the fields with one column of counts per result (FN, TP, TN, FP)
+        """
+        import numpy as np
+        import pandas as pd
+        frames = []
+        for a_file in sorted(os.listdir(directory)):
+            path = os.path.join(directory, a_file)
+            if not os.path.isfile(path) or not a_file.endswith(".csv"):
+                continue
+            frame = pd.read_csv(path, usecols=[Constants.result], dtype={Constants.result: "category"})
+            frame["fields"] = os.path.splitext(a_file)[0]
+            frames.append(frame)
+        categories = [result.value for result in Result]
+        if not frames:
+            return pd.DataFrame(columns=categories, dtype=np.int64)
+        frame = pd.concat(frames, ignore_index=True)
+        frame[Constants.result] = pd.Categorical(frame[Constants.result], categories=categories)
+        frame["fields"] = frame["fields"].astype("category")
+        return frame.groupby(["fields", Constants.result], observed=False).size().unstack(fill_value=0)
+
+    @staticmethod
+    def create_plot(f1_scores, file_name=None):
+        """
+        This method plots the f1 scores higher than the one of standard_lucene
+        :param f1_scores: the scores of generate_f1
+        :param file_name: if given, the plot is saved to this file instead of being shown
+        """
+        from matplotlib import pyplot as plt
         UTILS = Utils(os.path.join("resources"))
         # json_file = UTILS.read_json_from_resources("reports.json")
         sorted_on_f1 = UTILS.sort_on_f1_score(f1_scores, False)
@@ -253,16 +502,99 @@ class Statistics:
                     xycoords='figure points',
                     xytext=(329, 100),
                     )
-        plt.show()
+        if file_name:
+            fig.savefig(file_name)
+        else:
+            plt.show()
 
-    def generate_f1(self):
-        statistics = self.read_generated_files_to_list()
+    def generate_f1(self, result_store=None):
+        """
+        This method calculates precision, recall and f1 score per subset
+        :param result_store: if given, the counts are read from this ResultStore instead of the generated directory
+        :return: list of dictionaries with the counts, the scores and the fields of every subset
+        """
+        statistics = result_store.get_counts() if result_store is not None else self.read_generated_files_to_list()
         for stat in statistics:
             stat["precision"] = Statistics.calc_precision(stat["tn"], stat["fp"])
             stat["recall"] = Statistics.calc_recall(stat["tp"], stat["fn"])
             stat["f1"] = Statistics.f1_score(stat["precision"], stat["recall"])
+        return self.add_race_flags(statistics)
+
+    def generate_f1_vectorized(self, result_store=None, precision_from_tn=True):
+        """
+        This method calculates precision, recall and f1 score for all subsets at once with array operations.
+        By default it returns the same numbers as generate_f1, which calculates the precision from the
+        true negatives (TN / (TN + FP)) instead of the true positives.
+        Undefined scores are -1 as in calc_precision, calc_recall and f1_score
+        :param result_store: if given, the counts are read from this ResultStore instead of the generated directory
+        :param precision_from_tn: if false, the precision is TP / (TP + FP)
+        :return: list of dictionaries with the counts, the scores and the fields of every subset
+        """
+        import numpy as np
+        import pandas as pd
+        if result_store is not None:
+            counts = pd.DataFrame(result_store.get_counts(), columns=["fn", "tp", "tn", "fp", "fields"])
+            counts = counts.set_index("fields")
+        else:
+            counts = self.read_generated_files_to_frame().rename(columns=str.lower)
+        fn = counts["fn"].to_numpy(dtype=float)
+        tp = counts["tp"].to_numpy(dtype=float)
+        tn = counts["tn"].to_numpy(dtype=float)
+        fp = counts["fp"].to_numpy(dtype=float)
+        precision = self.safe_ratio(tn if precision_from_tn else tp, fp)
+        recall = self.safe_ratio(tp, fn)
+        total = precision + recall
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f1 = np.where(total == 0, -1.0, 2 * precision * recall / total)
+        return self.add_race_flags([{"fn": int(fn[i]), "tp": int(tp[i]), "tn": int(tn[i]), "fp": int(fp[i]),
+                                     "fields": str(fields), "precision": float(precision[i]),
+                                     "recall": float(recall[i]), "f1": float(f1[i])}
+                                    for i, fields in enumerate(counts.index)])
+
+    @staticmethod
+    def clear_race(race_file=os.path.join("reports", "race.json")):
+        """
+        This method removes the summary of the last race when a new sweep starts, so that add_race_flags
+        does not flag the subsets of this sweep with the race of another one
+        :param race_file: the summary of the last race
+        """
+        if os.path.isfile(race_file):
+            os.remove(race_file)
+
+    @staticmethod
+    def add_race_flags(statistics, race_file=os.path.join("reports", "race.json")):
+        """
+        This method flags the subsets which were pruned by calculate_statistics_racing. A subset is pruned
+        if it was evaluated on fewer names than the race had, the scores of a pruned subset are the ones
+        of the names it was evaluated on
+        :param statistics: list of dictionaries with the counts of every subset
+        :param race_file: the summary of the last race, removed by clear_race when a sweep starts
+        :return: the same list, each subset with the number of evaluated names, the pruned flag and the queries saved
+        """
+        race = {}
+        if os.path.isfile(race_file):
+            with open(race_file) as a_file:
+                race = json.load(a_file)
+        for stat in statistics:
+            stat["evaluated"] = stat["tp"] + stat["fp"] + stat["tn"] + stat["fn"]
+            names = race.get(stat["fields"], {}).get("names", stat["evaluated"])
+            stat["pruned"] = stat["evaluated"] < names
+            stat["queries_saved"] = max(0, names - stat["evaluated"])
         return statistics
 
+    @staticmethod
+    def safe_ratio(numerator, other):
+        """
+        This method calculates numerator / (numerator + other) element wise, -1 where it is undefined
+        :param numerator: array of counts
+        :param other: array of counts
+        :return: array of ratios
+        """
+        import numpy as np
+        total = numerator + other
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total == 0, -1.0, numerator / total)
+
 
 class Result(Enum):
     """
@@ -0,0 +1,144 @@
+"""
+This file contains strategies to find the best combination of fields without evaluating all of them
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from statistics import Result, Statistics
+
+
+class SubsetSearch:
+    """
+    This class searches the combination of fields with the highest f1 score (and the shortest name among equal
+    scores, as Utils.get_shortest_fields_with_highest_f1_score) with forward selection / beam search, optionally
+    using successive halving on growing samples of names to drop weak candidates early.
+    Results are memoized per (subset, name), so a candidate evaluated on a larger sample reuses its earlier queries
+    """
+
+    def __init__(self, search_engine, correct_list, misspelled_list, concurrency=1, precision_from_tn=True, seed=0):
+        """
+        :param search_engine: the target src engine (Elastic, Azure)
+        :param correct_list: list of correct items
+        :param misspelled_list: list of misspelled items
+        :param concurrency: maximum number of queries in flight at the same time
+        :param precision_from_tn: calculate the precision as generate_f1 does (TN / (TN + FP)),
+        if false TP / (TP + FP) is used
+        :param seed: seed of the order in which names are sampled
+        """
+        self.statistics = Statistics()
+        self.search_engine = search_engine
+        self.correct_list = correct_list
+        self.misspelled_list = misspelled_list
+        self.concurrency = concurrency
+        self.precision_from_tn = precision_from_tn
+        self.order = list(range(len(misspelled_list)))
+        random.Random(seed).shuffle(self.order)
+        self.results = {}
+        self.queries = 0
+
+    def evaluate(self, subset, sample_size=None):
+        """
+        This method calculates the scores of a subset on the first sample_size names of the shuffled order
+        :param subset: tuple of fields
+        :param sample_size: number of names, all names by default
+        :return: dictionary with the counts, precision, recall, f1, fields and the sample size
+        """
+        positions = self.order[:sample_size] if sample_size else self.order
+        known = self.results.setdefault(subset, {})
+        pending = [i for i in positions if i not in known]
+        if pending:
+            executor = ThreadPoolExecutor(max_workers=self.concurrency) if self.concurrency > 1 else None
+            try:
+                retrieved_list = Statistics.search_subset([self.misspelled_list[i] for i in pending],
+                                                          subset, self.search_engine, executor)
+                for i, retrieved in zip(pending, retrieved_list):
+                    known[i] = self.statistics.mark_confusion_matrix(self.correct_list[i][0], retrieved)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+            self.queries += len(pending)
+        counts = {result: 0 for result in Result}
+        for i in positions:
+            counts[known[i]] += 1
+        stat = {"fn": counts[Result.FN], "tp": counts[Result.TP], "tn": counts[Result.TN],
+                "fp": counts[Result.FP], "fields": '-'.join(subset), "sample": len(positions)}
+        stat["precision"] = self.safe_ratio(stat["tn"] if self.precision_from_tn else stat["tp"], stat["fp"])
+        stat["recall"] = self.safe_ratio(stat["tp"], stat["fn"])
+        total = stat["precision"] + stat["recall"]
+        stat["f1"] = -1 if total == 0 else 2 * stat["precision"] * stat["recall"] / total
+        return stat
+
+    @staticmethod
+    def safe_ratio(numerator, other):
+        """
+        :return: numerator / (numerator + other), or -1 if it is undefined
+        """
+        return -1 if numerator + other == 0 else numerator / (numerator + other)
+
+    @staticmethod
+    def rank(stats):
+        """
+        This method sorts scores on f1 in descending order and on the length of the fields in ascending order
+        :param stats:
+        :return: the sorted scores
+        """
+        return sorted(stats, key=lambda stat: (-stat["f1"], len(stat["fields"]), stat["fields"]))
+
+    def successive_halving(self, candidates, keep, min_sample, eta):
+        """
+        This method evaluates candidates on growing samples of names and keeps the best 1/eta of them
+        at each round, until only keep candidates remain or the sample covers all names
+        :param candidates: list of subsets
+        :param keep: number of candidates to be returned
+        :param min_sample: size of the first sample
+        :param eta: growth of the sample and reduction of the candidates per round
+        :return: the scores of the remaining candidates on all names
+        """
+        sample_size = min_sample
+        while len(candidates) > keep and sample_size < len(self.order):
+            ranked = self.rank([self.evaluate(subset, sample_size) for subset in candidates])
+            survivors = {stat["fields"] for stat in ranked[:max(keep, len(candidates) // eta)]}
+            candidates = [subset for subset in candidates if '-'.join(subset) in survivors]
+            sample_size *= eta
+        return [self.evaluate(subset) for subset in candidates]
+
+    def beam_search(self, fields, width=1, min_sample=None, eta=3):
+        """
+        This method grows the combinations one field at a time and keeps the best width combinations per size.
+        It stops as soon as adding a field does not improve the best f1 score. A width of 1 is forward selection
+        :param fields: the fields to be combined, their order is kept in the combinations
+        :param width: number of combinations kept per size
+        :param min_sample: if given, candidates are pruned with successive halving starting with this many names
+        :param eta: growth factor of successive halving
+        :return: dictionary with the best fields, its scores, the number of queries sent and the exhaustive cost
+        """
+        fields = list(fields)
+        beam = [()]
+        best = None
+        evaluated = set()
+        for _ in fields:
+            candidates = []
+            for subset in beam:
+                for field in fields:
+                    if field in subset:
+                        continue
+                    candidate = tuple(item for item in fields if item in subset or item == field)
+                    if candidate not in evaluated:
+                        evaluated.add(candidate)
+                        candidates.append(candidate)
+            if not candidates:
+                break
+            if min_sample:
+                stats = self.successive_halving(candidates, width, min_sample, eta)
+            else:
+                stats = [self.evaluate(subset) for subset in candidates]
+            ranked = self.rank(stats)[:width]
+            if best is not None and self.rank([best, ranked[0]])[0] is best:
+                break
+            best = ranked[0]
+            beam = [tuple(stat["fields"].split('-')) for stat in ranked]
+        return {"best": best,
+                "fields": best["fields"] if best else "",
+                "queries": self.queries,
+                "exhaustive_queries": (2 ** len(fields) - 1) * len(self.misspelled_list),
+                "evaluated_subsets": len(evaluated)}
@@ -0,0 +1,275 @@
+"""
+This file contains a resumable sweep of (subset x name) queries split in shards across processes or machines
+"""
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+from compactresults import NameTable, OUTCOMES, classify
+from constants import Constants
+from utils import Utils
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SweepRunner:
+    """
+    This class splits the queries of every subset into shards of consecutive names. Workers (processes of a machine,
+    or machines sharing the directory) claim a shard by creating its lease file, and write its results to a
+    checkpoint file once it is done. A lease which is not renewed within lease_seconds is considered abandoned and
+    can be claimed by another worker, so a crash only loses the shard in progress.
+    The checkpoints are merged into the same per subset reports as Statistics.calculate_statistics
+    """
+
+    def __init__(self, directory="sweep", shard_size=50, lease_seconds=300):
+        """
+        :param directory: shared directory of the plan, the leases and the checkpoints
+        :param shard_size: number of names per shard
+        :param lease_seconds: time after which a lease which was not renewed expires
+        """
+        self.directory = directory
+        self.shard_size = shard_size
+        self.lease_seconds = lease_seconds
+        self.leases = os.path.join(directory, "leases")
+        self.checkpoints = os.path.join(directory, "checkpoints")
+        self.utils = Utils(os.path.join("resources"))
+
+    def plan(self, subsets, names_count):
+        """
+        This method writes the plan of the sweep, or loads it if another worker already wrote it
+        :param subsets: the subsets to be evaluated
+        :param names_count: number of misspelled names
+        :return: the plan, a dictionary with the subsets, the number of names and the shards
+        """
+        self.utils.make_directory_if_not_exists(self.leases)
+        self.utils.make_directory_if_not_exists(self.checkpoints)
+        path = os.path.join(self.directory, "plan.json")
+        if not os.path.isfile(path):
+            shards = ["{:05d}-{:07d}".format(subset_index, start)
+                      for subset_index in range(len(subsets))
+                      for start in range(0, names_count, self.shard_size)]
+            self.write_atomically(path, {"subsets": [list(subset) for subset in subsets],
+                                         "names_count": names_count,
+                                         "shard_size": self.shard_size,
+                                         "shards": shards})
+        with open(path, 'r') as a_file:
+            plan = json.load(a_file)
+        if plan["names_count"] != names_count or plan["subsets"] != [list(subset) for subset in subsets]:
+            raise ValueError("the sweep directory {} belongs to another sweep".format(self.directory))
+        self.shard_size = plan["shard_size"]
+        return plan
+
+    @staticmethod
+    def write_atomically(path, content):
+        """
+        This method writes a json file under a temporary name and renames it, so readers never see a partial file
+        :param path:
+        :param content:
+        """
+        temporary = "{}.{}.{}.tmp".format(path, socket.gethostname(), os.getpid())
+        with open(temporary, 'w') as a_file:
+            json.dump(content, a_file)
+        os.replace(temporary, path)
+
+    def is_done(self, shard):
+        """
+        :param shard: id of the shard
+        :return: true if the shard has a checkpoint
+        """
+        return os.path.isfile(os.path.join(self.checkpoints, shard + ".json"))
+
+    def claim(self, shard, worker_id):
+        """
+        This method tries to take the lease of a shard
+        :param shard: id of the shard
+        :param worker_id:
+        :return: true if the worker holds the lease
+        """
+        path = os.path.join(self.leases, shard + ".lease")
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(descriptor, 'w') as a_file:
+                a_file.write(worker_id)
+            return True
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - os.path.getmtime(path) < self.lease_seconds:
+                return False
+            # the lease expired: move it away, a rename succeeds for a single worker. The moved file cannot be
+            # renewed any more, so if it is still expired it is dropped and the lease is claimed again
+            moved = self.move_lease(path, worker_id)
+        except FileNotFoundError:
+            return False
+        if time.time() - os.path.getmtime(moved) < self.lease_seconds:
+            # another worker took the lease over since it was read as expired: give it back
+            self.restore_lease(moved, path)
+            return False
+        os.remove(moved)
+        return self.claim(shard, worker_id)
+
+    @staticmethod
+    def move_lease(path, worker_id):
+        """
+        This method renames a lease to a name of its own, so no other worker can renew, release or take it over
+        :param path: path of the lease
+        :param worker_id:
+        :return: the new path of the lease
+        """
+        moved = "{}.{}.moved".format(path, worker_id)
+        os.rename(path, moved)
+        return moved
+
+    @staticmethod
+    def restore_lease(moved, path):
+        """
+        This method puts a moved lease back, unless another lease was created in the meantime
+        :param moved: the path the lease was moved to
+        :param path: the path of the lease
+        """
+        try:
+            os.link(moved, path)
+        except FileExistsError:
+            pass
+        os.remove(moved)
+
+    def renew(self, shard):
+        """
+        This method extends the lease of a shard
+        :param shard: id of the shard
+        """
+        try:
+            os.utime(os.path.join(self.leases, shard + ".lease"))
+        except FileNotFoundError:
+            # the lease is being checked by a worker which read it as expired
+            pass
+
+    def release(self, shard, worker_id):
+        """
+        This method drops the lease of a shard if the worker still holds it. A worker whose lease expired
+        and was taken over by another worker leaves the lease of the new owner
+        :param shard: id of the shard
+        :param worker_id:
+        """
+        path = os.path.join(self.leases, shard + ".lease")
+        try:
+            moved = self.move_lease(path, worker_id)
+        except FileNotFoundError:
+            return
+        with open(moved, 'r') as a_file:
+            owner = a_file.read()
+        if owner == worker_id:
+            os.remove(moved)
+        else:
+            self.restore_lease(moved, path)
+
+    def process(self, plan, shard, search_engine, correct_list, misspelled_list):
+        """
+        This method sends the queries of a shard and writes its checkpoint
+        :param plan: the plan of the sweep
+        :param shard: id of the shard
+        :param search_engine: the target src engine (Elastic, Azure)
+        :param correct_list: list of correct items
+        :param misspelled_list: list of misspelled items
+        """
+        subset_index, start = (int(part) for part in shard.split('-'))
+        subset = plan["subsets"][subset_index]
+        positions = range(start, min(start + self.shard_size, len(misspelled_list)))
+        retrieved_list = []
+        for i in positions:
+            retrieved_list.append(search_engine.make_search(misspelled_list[i][0], subset))
+            self.renew(shard)
+        expected_list = [correct_list[i][0] for i in positions]
+        names = NameTable()
+        codes = classify(names.intern_all(expected_list), names.intern_all(retrieved_list))
+        results = [list(result) for result in zip(retrieved_list, expected_list, OUTCOMES[codes])]
+        self.write_atomically(os.path.join(self.checkpoints, shard + ".json"),
+                              {"subset": subset, "start": start, "results": results})
+
+    def run_worker(self, search_engine, correct_list, misspelled_list, subsets, worker_id=None, poll_seconds=5):
+        """
+        This method claims and processes shards until every shard of the sweep has a checkpoint
+        :param search_engine: the target src engine (Elastic, Azure)
+        :param correct_list: list of correct items
+        :param misspelled_list: list of misspelled items
+        :param subsets: the subsets to be evaluated
+        :param worker_id: name of the worker, host and process id by default
+        :param poll_seconds: time to wait before looking again for shards leased by other workers
+        :return: number of shards processed by this worker
+        """
+        worker_id = worker_id or "{}-{}".format(socket.gethostname(), os.getpid())
+        plan = self.plan(subsets, len(misspelled_list))
+        processed = 0
+        while True:
+            remaining = [shard for shard in plan["shards"] if not self.is_done(shard)]
+            if not remaining:
+                return processed
+            claimed = False
+            for shard in remaining:
+                if self.is_done(shard) or not self.claim(shard, worker_id):
+                    continue
+                claimed = True
+                try:
+                    if not self.is_done(shard):
+                        self.process(plan, shard, search_engine, correct_list, misspelled_list)
+                        processed += 1
+                        LOGGER.info("%s processed shard %s", worker_id, shard)
+                finally:
+                    self.release(shard, worker_id)
+            if not claimed:
+                time.sleep(poll_seconds)
+
+    def run(self, search_engine_factory, correct_list, misspelled_list, subsets, processes=4):
+        """
+        This method runs a worker per process on this machine
+        :param search_engine_factory: picklable function without arguments creating the search engine of a worker
+        :param correct_list: list of correct items
+        :param misspelled_list: list of misspelled items
+        :param subsets: the subsets to be evaluated
+        :param processes: number of worker processes
+        :return: number of shards processed per worker
+        """
+        self.plan(subsets, len(misspelled_list))
+        with multiprocessing.Pool(processes) as pool:
+            return pool.starmap(run_worker_process,
+                                [(self.directory, self.shard_size, self.lease_seconds, search_engine_factory,
+                                  correct_list, misspelled_list, subsets) for _ in range(processes)])
+
+    def merge(self, generate_reports=True):
+        """
+        This method merges the checkpoints of every completed subset, in the order of the names
+        :param generate_reports: if true, it creates the report file of every completed subset in generated directory
+        :return: dictionary of fields -> rows, for the subsets whose shards are all done
+        """
+        with open(os.path.join(self.directory, "plan.json"), 'r') as a_file:
+            plan = json.load(a_file)
+        merged = {}
+        for subset_index, subset in enumerate(plan["subsets"]):
+            shards = [shard for shard in plan["shards"] if int(shard.split('-')[0]) == subset_index]
+            if not all(self.is_done(shard) for shard in shards):
+                continue
+            rows = []
+            for shard in sorted(shards):
+                with open(os.path.join(self.checkpoints, shard + ".json"), 'r') as a_file:
+                    for retrieved, expected, result in json.load(a_file)["results"]:
+                        rows.append({Constants.retrieved: retrieved,
+                                     Constants.expected: expected,
+                                     Constants.result: result})
+            file_name = '-'.join(subset)
+            merged[file_name] = rows
+            if generate_reports:
+                self.utils.generate_reports(rows, file_name)
+        return merged
+
+
+def run_worker_process(directory, shard_size, lease_seconds, search_engine_factory,
+                       correct_list, misspelled_list, subsets):
+    """
+    This method is the entry point of a worker process
+    :return: number of shards processed by the worker
+    """
+    runner = SweepRunner(directory, shard_size, lease_seconds)
+    return runner.run_worker(search_engine_factory(), correct_list, misspelled_list, subsets)
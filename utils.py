@@ -6,9 +6,6 @@ import os
 import csv
 from itertools import chain, combinations
 
-import yaml
-import pandas as pd
-
 
 class Utils:
     """
@@ -44,6 +41,7 @@ class Utils:
         :param file_name:
         :return:
         """
+        import pandas as pd
         generated = "generated"
         self.make_directory_if_not_exists(generated)
         data_frame = pd.DataFrame(data)
@@ -82,25 +80,39 @@ class Utils:
         with open(filename, 'r') as a_file:
             return list(csv.reader(a_file))
 
+    def iter_csv(self, filename="names.csv"):
+        """
+        This method reads a CSV file lazily
+        :param filename:
+        :return: an iterator of the elements per line of CSV
+        """
+        filename = os.path.join(self.resources_path, filename)
+        with open(filename, 'r') as a_file:
+            for row in csv.reader(a_file):
+                yield row
+
     def get_config(self):
         """
         this method loads a YAML config file in a dictionary
         :return: dictionary of configuration file
         """
+        import yaml
         yaml_path = os.path.join(self.resources_path, "config.yml")
         with open(yaml_path, 'r') as configuration:
             return yaml.load(configuration, Loader=yaml.FullLoader)
 
     @staticmethod
-    def create_elastic_search_body(query, fields):
+    def create_elastic_search_body(query, fields, size=None, source=None):
         """
         this method receives  a query and an array of fields,
         then it generates a request body to be sent to the Elastic Search
         :param query:
         :param fields:
+        :param size: if given, the maximum number of hits to be returned
+        :param source: if given, the list of fields to be returned per hit
         :return: src body
         """
-        return {
+        body = {
             "query": {
                 "multi_match": {
                     "query": "" + query + "",
@@ -109,22 +121,34 @@ class Utils:
                 }
             }
         }
+        if size is not None:
+            body["size"] = size
+        if source is not None:
+            body["_source"] = source
+        return body
 
     @staticmethod
-    def create_azure_search_body(query, fields):
+    def create_azure_search_body(query, fields, top=None, select=None):
         """
         this method receives  a query and an array of fields,
         then it generates a request body to be sent to the Elastic Search
         :param query:
         :param fields:
+        :param top: if given, the maximum number of hits to be returned
+        :param select: if given, the list of fields to be returned per hit
         :return: src body
         """
         searchFields = ",".join(fields)
-        return {
+        body = {
             "queryType": "full",
             "search": query,
             "searchFields": searchFields
         }
+        if top is not None:
+            body["top"] = top
+        if select is not None:
+            body["select"] = ",".join(select)
+        return body
 
     @staticmethod
     def get_maximum_rank_from_elastic_search_response(response):
@@ -142,6 +166,22 @@ class Utils:
                 found_name = hit.name[0]
         return found_name
 
+    @staticmethod
+    def get_maximum_rank_from_elastic_search_json(response):
+        """
+        this method receives the json response of an Elastic Search query and returns the maximum ranked hits.
+        it will return NOT_FOUND if response has not hits
+        :param response:
+        :return: a username with the maximum rank or NOT_FOUND otherwise
+        """
+        score = 0
+        found_name = "NOT_FOUND"
+        for hit in response['hits']['hits']:
+            if hit['_score'] > score:
+                score = hit['_score']
+                found_name = hit['_source']['standard_lucene']
+        return found_name
+
     @staticmethod
     def get_maximum_rank_from_azure_search_response(response):
         """
@@ -158,6 +198,20 @@ class Utils:
                 found_name = hit['standard_lucene']
         return found_name
 
+    @staticmethod
+    def get_ranked_hits_from_azure_search_response(response):
+        """
+        this method receives a response and returns the hits with their scores.
+        if a name is returned more than once, its highest score is kept
+        :param response:
+        :return: a list of (name, score) in the order of the response
+        """
+        hits = {}
+        for hit in response['value']:
+            name = hit['standard_lucene']
+            hits[name] = max(hits.get(name, 0), hit['@search.score'])
+        return list(hits.items())
+
     @staticmethod
     def get_subsets(iterable):
         """